@@ -275,11 +275,24 @@ class HamsterCli(object):
 
         start_time = start_time or dt.datetime.combine(dt.date.today(), dt.time())
         end_time = end_time or start_time.replace(hour=23, minute=59, second=59)
-        facts = self.storage.get_facts(start_time, end_time)
+        facts = self.storage.iter_facts(start_time, end_time)
 
         writer = reports.simple(facts, start_time.date(), end_time.date(), export_format)
 
 
+    def import_facts(self, *args):
+        """Add the facts from a tsv, xml or json file (cf. reports.read)."""
+        if not args:
+            print("Error: please specify a file to import")
+            return
+        path = args[0]
+        on_conflict = args[1] if len(args) > 1 else "skip"
+        facts = list(reports.read(path))
+        ids = self.storage.add_facts(facts, on_conflict=on_conflict)
+        added = len([id_ for id_ in ids if id_])
+        print(_("Imported {} facts, skipped {}").format(added, len(ids) - added))
+
+
     def _activities(self, search=""):
         '''Print the names of all the activities.'''
         if "@" in search:
@@ -374,12 +387,7 @@ class HamsterCli(object):
         print(fact_line.format(**headers))
         print("-" * min(row_width, 80))
 
-        by_cat = {}
         for fact in facts:
-            cat = fact.category or _("Unsorted")
-            by_cat.setdefault(cat, dt.timedelta(0))
-            by_cat[cat] += fact.delta
-
             pretty_fact = fact_dict(fact, print_with_date)
             print(fact_line.format(**pretty_fact))
 
@@ -395,8 +403,10 @@ class HamsterCli(object):
 
         cats = []
         total_duration = dt.timedelta()
-        for cat, duration in sorted(by_cat.items(), key=lambda x: x[1], reverse=True):
-            cats.append("{}: {}".format(cat, duration.format()))
+        for cat, duration in self.storage.get_totals(start_time, end_time,
+                                                     group_by="category",
+                                                     search_terms=search):
+            cats.append("{}: {}".format(cat or _("Unsorted"), duration.format()))
             total_duration += duration
 
         for line in word_wrap(", ".join(cats), 80):
@@ -406,6 +416,28 @@ class HamsterCli(object):
         print()
 
 
+    def rebuild(self, *args):
+        """Rebuild the search index and the daily totals."""
+        self.storage.rebuild_index()
+        self.storage.rebuild_daily_totals()
+
+
+    def archive(self, *args):
+        """Move the facts that ended before the given day to the archive."""
+        if not args:
+            print("Error: please specify a day (YYYY-MM-DD)")
+            return
+        day = dt.date.parse(args[0])
+        count = self.storage.archive_facts(day)
+        print(_("Archived {} facts").format(count))
+
+
+    def maintenance(self, *args):
+        """Run the database maintenance tasks, and print their timing."""
+        for name, elapsed in self.storage.maintenance():
+            print("{}: {:.3f}s".format(name, elapsed))
+
+
     def version(self):
         print(hamster.__version__)
 
@@ -424,9 +456,18 @@ Actions:
       term
     * export [html|tsv|ical|xml] [start-date [end-date]]: Export activities with
       the specified format
+    * import file [skip|solve|keep]: Import activities from a tsv, xml or json
+      file. Activities overlapping existing ones are skipped (default),
+      make room as when added one by one (solve), or are kept as they are.
     * current: Print current activity
     * activities: List all the activities names, one per line.
     * categories: List all the categories names, one per line.
+    * rebuild: Rebuild the search index and daily totals, if searches or
+      totals miss activities.
+    * archive YYYY-MM-DD: Move the activities that ended before that day to
+      the archive database. They are still listed, searched and exported.
+    * maintenance: Run the database maintenance (statistics, search index
+      optimization, vacuum) now, instead of waiting for the service to be idle.
 
     * overview / preferences / add / about: launch specific window
 
@@ -482,6 +523,9 @@ Example usage:
 
     if args.action in ("start", "track"):
         action = "add"  # alias
+    elif args.action == "import":
+        # reserved word
+        action = "import_facts"
     elif args.action == "prefs":
         # for backward compatibility
         action = "preferences"
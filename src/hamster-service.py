@@ -1,7 +1,15 @@
 #!/usr/bin/env python3
 # nicked off gwibber
 
+import concurrent.futures
+import functools
+import inspect
+import json
+import threading
+import time
+
 import dbus
+import dbus.lowlevel
 import dbus.service
 
 from gi.repository import GLib as glib
@@ -18,18 +26,36 @@ from hamster.lib import default_logger
 from hamster.lib.dbus import (
     DBusMainLoop,
     fact_signature,
+    facts_columns_signature,
     from_dbus_date,
     from_dbus_fact,
     from_dbus_fact_json,
     from_dbus_range,
+    to_dbus_changes_json,
+    to_dbus_daily_totals_json,
     to_dbus_fact,
-    to_dbus_fact_json
+    to_dbus_fact_json,
+    to_dbus_facts_columns,
+    to_dbus_totals_json,
 )
 from hamster.lib.fact import Fact, FactError
 
 logger = default_logger(__file__)
 
 
+# idle maintenance (cf. Storage.maintenance_steps).
+# Seconds without requests before a round starts, seconds between checks,
+# seconds between the end of a round and the next one,
+# and seconds of work per main loop iteration.
+MAINTENANCE_IDLE = 300
+MAINTENANCE_CHECK = 60
+MAINTENANCE_INTERVAL = 24 * 3600
+MAINTENANCE_TIME_BOX = 0.05
+
+# threads running the read-only methods (cf. storage_method)
+READER_THREADS = 4
+
+
 DBusMainLoop(set_as_default=True)
 loop = glib.MainLoop()
 
@@ -38,16 +64,60 @@ if "org.gnome.Hamster" in dbus.SessionBus().list_names():
     quit()
 
 
+def storage_method(pool, **dbus_kwds):
+    """org.gnome.Hamster method running on a worker thread.
+
+    pool is "writer", the single thread changing the database,
+    or "readers", for methods that only read (cf. db.Storage.fetchall_snapshot).
+    The method returns its result as usual, the reply is sent
+    from the main loop when done, and other calls are answered meanwhile.
+    """
+    out_signature = dbus_kwds.get("out_signature")
+    outputs = len(tuple(dbus.Signature(out_signature))) if out_signature else 0
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, reply, error):
+            self._submit(pool, func, args, outputs, reply, error)
+        # dbus-python finds the arguments in the signature
+        parameters = [parameter.replace(default=inspect.Parameter.empty)
+                      for parameter in inspect.signature(func).parameters.values()]
+        parameters += [inspect.Parameter(name, inspect.Parameter.POSITIONAL_OR_KEYWORD)
+                       for name in ("reply", "error")]
+        wrapper.__signature__ = inspect.Signature(parameters)
+        return dbus.service.method("org.gnome.Hamster",
+                                   async_callbacks=("reply", "error"),
+                                   **dbus_kwds)(wrapper)
+    return decorator
+
+
+def idle_call(func, *args):
+    """Call func(*args) once, from the main loop."""
+    def once():
+        func(*args)
+        return False
+    glib.idle_add(once)
+
+
 class Storage(db.Storage, dbus.service.Object):
     __dbus_object_path__ = "/org/gnome/Hamster"
 
-    def __init__(self, loop):
+    def __init__(self, loop, stats=False):
+        # the main loop only passes messages,
+        # database work happens in these (cf. storage_method)
+        self.__write_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="hamster-writer")
+        self.__read_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=READER_THREADS, thread_name_prefix="hamster-reader")
+
         self.bus = dbus.SessionBus()
         bus_name = dbus.service.BusName("org.gnome.Hamster", bus=self.bus)
 
 
         dbus.service.Object.__init__(self, bus_name, self.__dbus_object_path__)
-        db.Storage.__init__(self, unsorted_localized="")
+        db.Storage.__init__(self, unsorted_localized="", stats=stats)
+        # the fixtures ran here, from now on the writer does the writes
+        self.writer_thread = self.__write_pool.submit(threading.get_ident).result()
 
         self.mainloop = loop
 
@@ -57,6 +127,13 @@ class Storage(db.Storage, dbus.service.Object):
                                                   None)
         self.__monitor.connect("changed", self._on_us_change)
 
+        self.__last_request = time.monotonic()
+        self.__last_maintenance = None  # end of the last complete round
+        self.__maintenance_round = None  # steps left in the current round
+        self.__maintenance_running = False  # steps queued on the writer
+        self.bus.add_message_filter(self._on_message)
+        glib.timeout_add_seconds(MAINTENANCE_CHECK, self._on_maintenance_check)
+
     def run_fixtures(self):
         """we start with an empty database and then populate with default
            values. This way defaults can be localized!"""
@@ -86,20 +163,99 @@ class Storage(db.Storage, dbus.service.Object):
             print("`{}` has changed. Quitting!".format(__file__))
             self.Quit()
 
-    @dbus.service.signal("org.gnome.Hamster")
-    def TagsChanged(self): pass
+    def _submit(self, pool, func, args, outputs, reply, error):
+        """Run func(self, *args) in the pool, then reply from the main loop.
+
+        outputs is the number of values in the reply.
+        """
+        executor = self.__write_pool if pool == "writer" else self.__read_pool
+
+        def on_done(future):
+            exception = future.exception()
+            if exception is not None:
+                logger.error("{} failed".format(func.__name__), exc_info=exception)
+                idle_call(error, exception)
+            elif outputs == 0:
+                idle_call(reply)
+            elif outputs == 1:
+                idle_call(reply, future.result())
+            else:
+                idle_call(reply, *future.result())
+
+        executor.submit(func, self, *args).add_done_callback(on_done)
+
+    def call_in_writer(self, func, *args):
+        self.__write_pool.submit(func, *args).add_done_callback(self._log_failure)
+
+    def _log_failure(self, future):
+        exception = future.exception()
+        if exception is not None:
+            logger.error("writer task failed", exc_info=exception)
+
+    def _on_message(self, bus, message):
+        if isinstance(message, dbus.lowlevel.MethodCallMessage):
+            self.__last_request = time.monotonic()
+        # let the message through
+        return dbus.lowlevel.HANDLER_RESULT_NOT_YET_HANDLED
+
+    def _on_maintenance_check(self):
+        now = time.monotonic()
+        idle = now - self.__last_request >= MAINTENANCE_IDLE
+        due = (self.__maintenance_round is not None
+               or self.__last_maintenance is None
+               or now - self.__last_maintenance >= MAINTENANCE_INTERVAL)
+        if idle and due and not self.__maintenance_running:
+            self.__maintenance_running = True
+            self.__write_pool.submit(self._maintenance_step)
+        return True
+
+    def _maintenance_step(self):
+        """Run maintenance steps for up to MAINTENANCE_TIME_BOX seconds,
+        on the writer thread.
+
+        Queued again until the round is done, so that the writes
+        requested meanwhile get in between. Pauses as soon as
+        a request comes in, the next check resumes where it stopped.
+        """
+        try:
+            if time.monotonic() - self.__last_request < MAINTENANCE_IDLE:
+                logger.info("idle maintenance paused")
+                self.__maintenance_running = False
+                return
+            if self.__maintenance_round is None:
+                logger.info("idle maintenance started")
+                self.__maintenance_round = self.maintenance_steps()
+            deadline = time.monotonic() + MAINTENANCE_TIME_BOX
+            for name, elapsed in self.__maintenance_round:
+                if time.monotonic() >= deadline:
+                    self.__write_pool.submit(self._maintenance_step)
+                    return
+        except Exception:
+            logger.exception("idle maintenance failed")
+            self.__maintenance_round = None
+            self.__maintenance_running = False
+            return
+        logger.info("idle maintenance done")
+        self.__maintenance_round = None
+        self.__maintenance_running = False
+        self.__last_maintenance = time.monotonic()
+
+    # the change signals carry the current revision, cf. GetChangesSince.
+    # The revision is read by the changing thread, signals leave from the main loop.
+    @dbus.service.signal("org.gnome.Hamster", signature='i')
+    def TagsChanged(self, revision): pass
     def tags_changed(self):
-        self.TagsChanged()
+        idle_call(self.TagsChanged, self.get_revision())
 
-    @dbus.service.signal("org.gnome.Hamster")
-    def FactsChanged(self): pass
+    @dbus.service.signal("org.gnome.Hamster", signature='i')
+    def FactsChanged(self, revision): pass
     def facts_changed(self):
-        self.FactsChanged()
+        idle_call(self.FactsChanged, self.get_revision())
 
-    @dbus.service.signal("org.gnome.Hamster")
-    def ActivitiesChanged(self): pass
+    @dbus.service.signal("org.gnome.Hamster", signature='i')
+    def ActivitiesChanged(self, revision): pass
     def activities_changed(self):
-        self.ActivitiesChanged()
+        idle_call(self.ActivitiesChanged, self.get_revision())
 
     @dbus.service.signal("org.gnome.Hamster")
     def ToggleCalled(self): pass
@@ -107,9 +263,10 @@ class Storage(db.Storage, dbus.service.Object):
         self.toggle_called()
 
     def dispatch_overwrite(self):
-        self.TagsChanged()
-        self.FactsChanged()
-        self.ActivitiesChanged()
+        revision = self.get_revision()
+        idle_call(self.TagsChanged, revision)
+        idle_call(self.FactsChanged, revision)
+        idle_call(self.ActivitiesChanged, revision)
 
     @dbus.service.method("org.gnome.Hamster")
     def Quit(self):
@@ -134,7 +291,7 @@ class Storage(db.Storage, dbus.service.Object):
         self.ToggleCalled()
 
     # facts
-    @dbus.service.method("org.gnome.Hamster", in_signature='siib', out_signature='i')
+    @storage_method("writer", in_signature='siib', out_signature='i')
     def AddFact(self, fact_str, start_time, end_time, temporary):
         """Add fact specified by a string.
 
@@ -176,7 +333,7 @@ class Storage(db.Storage, dbus.service.Object):
         return self.add_fact(fact)
 
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='s', out_signature='i')
+    @storage_method("writer", in_signature='s', out_signature='i')
     def AddFactJSON(self, dbus_fact):
         """Add fact given in JSON format.
 
@@ -195,6 +352,25 @@ class Storage(db.Storage, dbus.service.Object):
         return self.add_fact(fact)
 
 
+    @storage_method("writer", in_signature='ass', out_signature='ai')
+    def AddFactsJSON(self, dbus_facts, on_conflict):
+        """Add many facts at once, in a single transaction.
+
+        Meant for imports: facts are added as they are,
+        without the on-going fact handling of AddFactJSON.
+
+        Args:
+            dbus_facts (list of str): facts in JSON format
+                                      (cf. from_dbus_fact_json).
+            on_conflict (str): "skip", "solve" or "keep",
+                               cf. Storage.add_facts.
+        Returns:
+            fact ids, in the same order, 0 for skipped facts.
+        """
+        facts = [from_dbus_fact_json(dbus_fact) for dbus_fact in dbus_facts]
+        return self.add_facts(facts, on_conflict=on_conflict)
+
+
     @dbus.service.method("org.gnome.Hamster",
                          in_signature="si",
                          out_signature='bs')
@@ -224,18 +400,18 @@ class Storage(db.Storage, dbus.service.Object):
         return success, message
 
 
-    @dbus.service.method("org.gnome.Hamster",
-                         in_signature='i',
-                         out_signature=fact_signature)
+    @storage_method("writer",
+                    in_signature='i',
+                    out_signature=fact_signature)
     def GetFact(self, fact_id):
         """Get fact by id. For output format see GetFacts"""
         fact = self.get_fact(fact_id)
         return to_dbus_fact(fact)
 
 
-    @dbus.service.method("org.gnome.Hamster",
-                         in_signature='i',
-                         out_signature="s")
+    @storage_method("writer",
+                    in_signature='i',
+                    out_signature="s")
     def GetFactJSON(self, fact_id):
         """Get fact by id.
 
@@ -245,7 +421,7 @@ class Storage(db.Storage, dbus.service.Object):
         return to_dbus_fact_json(fact)
 
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='isiib', out_signature='i')
+    @storage_method("writer", in_signature='isiib', out_signature='i')
     def UpdateFact(self, fact_id, fact, start_time, end_time, temporary):
         start_time = start_time or None
         if start_time:
@@ -257,9 +433,9 @@ class Storage(db.Storage, dbus.service.Object):
         return self.update_fact(fact_id, fact, start_time, end_time, temporary)
 
 
-    @dbus.service.method("org.gnome.Hamster",
-                         in_signature='is',
-                         out_signature='i')
+    @storage_method("writer",
+                    in_signature='is',
+                    out_signature='i')
     def UpdateFactJSON(self, fact_id, dbus_fact):
         """Update fact.
 
@@ -273,7 +449,38 @@ class Storage(db.Storage, dbus.service.Object):
         return self.update_fact(fact_id, fact)
 
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='i')
+    @storage_method("writer",
+                    in_signature='a(is)',
+                    out_signature='a(is)')
+    def UpdateFactsJSON(self, dbus_updates):
+        """Update many facts at once, in a single transaction,
+        with a single FactsChanged signal.
+
+        Args:
+            dbus_updates (list of (int, str)): fact id, and new content
+                                               in JSON format.
+        Returns:
+            list of (new id, error message), in the same order.
+            The message is empty on success, the id is 0 on failure
+            (including malformed JSON).
+        """
+        results = [None] * len(dbus_updates)
+        updates, positions = [], []
+        for position, (fact_id, dbus_fact) in enumerate(dbus_updates):
+            try:
+                fact = from_dbus_fact_json(dbus_fact)
+            except (AttributeError, KeyError, TypeError, ValueError) as error:
+                results[position] = (0, "invalid fact JSON ({}: {})"
+                                        .format(type(error).__name__, error))
+                continue
+            updates.append((fact_id, fact))
+            positions.append(position)
+        for position, result in zip(positions, self.update_facts(updates)):
+            results[position] = result
+        return results
+
+
+    @storage_method("writer", in_signature='i')
     def StopTracking(self, end_time):
         """Stops tracking the current activity"""
         end_time = end_time or None
@@ -282,21 +489,33 @@ class Storage(db.Storage, dbus.service.Object):
         return self.stop_tracking(end_time)
 
 
-    @dbus.service.method("org.gnome.Hamster")
+    @storage_method("writer")
     def StopOrRestartTracking(self):
         """Stops or restarts tracking the last activity"""
         return self.stop_or_restart_tracking()
 
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='i')
+    @storage_method("writer", in_signature='i')
     def RemoveFact(self, fact_id):
         """Remove fact from storage by it's ID"""
         return self.remove_fact(fact_id)
 
 
-    @dbus.service.method("org.gnome.Hamster",
-                         in_signature='uus',
-                         out_signature='a{}'.format(fact_signature))
+    @storage_method("writer", in_signature='ai', out_signature='as')
+    def RemoveFacts(self, fact_ids):
+        """Remove many facts at once, in a single transaction,
+        with a single FactsChanged signal.
+
+        Returns:
+            list of error messages, in the same order,
+            empty for the removed facts.
+        """
+        return self.remove_facts(fact_ids)
+
+
+    @storage_method("readers",
+                    in_signature='uus',
+                    out_signature='a{}'.format(fact_signature))
     def GetFacts(self, start_date, end_date, search_terms):
         """Gets facts between the day of start_date and the day of end_date.
         Parameters:
@@ -319,9 +538,9 @@ class Storage(db.Storage, dbus.service.Object):
         return [to_dbus_fact(fact) for fact in self.get_facts(start, end, search_terms)]
 
 
-    @dbus.service.method("org.gnome.Hamster",
-                         in_signature='ss',
-                         out_signature='as')
+    @storage_method("readers",
+                    in_signature='ss',
+                    out_signature='as')
     def GetFactsJSON(self, dbus_range, search_terms):
         """Gets facts between the day of start and the day of end.
 
@@ -341,7 +560,112 @@ class Storage(db.Storage, dbus.service.Object):
                 for fact in self.get_facts(range, search_terms=search_terms)]
 
 
-    @dbus.service.method("org.gnome.Hamster", out_signature='a{}'.format(fact_signature))
+    @storage_method("readers",
+                    in_signature='ss',
+                    out_signature=facts_columns_signature)
+    def GetFactsColumns(self, dbus_range, search_terms):
+        """Same facts as GetFactsJSON, one typed array per field.
+
+        Cheaper to build and to read than a JSON string per fact
+        (cf. to_dbus_facts_columns for the layout,
+        and from_dbus_facts_columns to get the facts back).
+
+        Args:
+            dbus_range (str): same as in GetFactsJSON.
+            search_terms (str): same as in GetFactsJSON.
+        """
+        range = from_dbus_range(dbus_range)
+        return to_dbus_facts_columns(self.get_facts(range, search_terms=search_terms))
+
+
+    @storage_method("readers",
+                    in_signature='sssii',
+                    out_signature='as')
+    def GetFactsPage(self, dbus_range, search_terms, after_start, after_id, limit):
+        """Page of the facts GetFactsJSON would return.
+
+        For long ranges, that would not fit in a single message.
+
+        Args:
+            dbus_range (str): same as in GetFactsJSON.
+            search_terms (str): same as in GetFactsJSON.
+            after_start (str): start of the last fact of the previous page,
+                               as in the JSON facts. Empty for the first page.
+            after_id (int): id of the last fact of the previous page.
+            limit (int): maximum number of facts.
+        Return:
+            array of D-Bus facts in JSON format.
+            Less than limit facts means this is the last page.
+        """
+        range = from_dbus_range(dbus_range)
+        after = None
+        if after_start:
+            after = (dt.datetime.parse(after_start), after_id)
+        return [to_dbus_fact_json(fact)
+                for fact in self.get_facts_page(range, search_terms=search_terms,
+                                                after=after, limit=limit)]
+
+
+    @storage_method("readers",
+                    in_signature='sss',
+                    out_signature='s')
+    def GetTotalsJSON(self, dbus_range, group_by, search_terms):
+        """Sum the durations of the facts GetFactsJSON would return.
+
+        Args:
+            dbus_range (str): same as in GetFactsJSON.
+            group_by (str): "day", "week", "month",
+                            "category", "activity" or "tag".
+            search_terms (str): same as in GetFactsJSON.
+        Return:
+            JSON list of [key, minutes] pairs (cf. to_dbus_totals_json).
+            Period keys are the first day of the period, "YYYY-MM-DD".
+        """
+        range = from_dbus_range(dbus_range)
+        totals = self.get_totals(range, group_by=group_by, search_terms=search_terms)
+        return to_dbus_totals_json(totals)
+
+
+    @storage_method("writer",
+                    in_signature='s',
+                    out_signature='s')
+    def GetDailyTotalsJSON(self, dbus_range):
+        """Time spent per hamster day and activity.
+
+        Facts crossing the day start are split between the days.
+        Cheap even for long ranges, such as a year.
+
+        Args:
+            dbus_range (str): same as in GetFactsJSON.
+        Return:
+            JSON list of [day, activity, category, minutes]
+            (cf. to_dbus_daily_totals_json).
+        """
+        range = from_dbus_range(dbus_range)
+        return to_dbus_daily_totals_json(self.get_daily_totals(range))
+
+
+    @storage_method("writer",
+                    in_signature='i',
+                    out_signature='s')
+    def GetChangesSince(self, revision):
+        """Changes of the facts after the given revision.
+
+        The revision comes from the change signals, or a previous call.
+
+        Args:
+            revision (int)
+        Return:
+            JSON {"revision": current revision,
+                  "changes": [[revision, fact_id, op, range_start, range_end]]}
+            (cf. to_dbus_changes_json). op is "add", "update" or "remove".
+            changes is null if they are not known anymore,
+            then everything should be fetched again.
+        """
+        return to_dbus_changes_json(*self.get_changes_since(revision))
+
+
+    @storage_method("readers", out_signature='a{}'.format(fact_signature))
     def GetTodaysFacts(self):
         """Gets facts of today,
            respecting hamster midnight. See GetFacts for return info.
@@ -351,7 +675,7 @@ class Storage(db.Storage, dbus.service.Object):
         return [to_dbus_fact(fact) for fact in self.get_todays_facts()]
 
 
-    @dbus.service.method("org.gnome.Hamster", out_signature='as')
+    @storage_method("readers", out_signature='as')
     def GetTodaysFactsJSON(self):
         """Gets facts of the current hamster day.
 
@@ -361,41 +685,41 @@ class Storage(db.Storage, dbus.service.Object):
 
 
     # categories
-    @dbus.service.method("org.gnome.Hamster", in_signature='s', out_signature = 'i')
+    @storage_method("writer", in_signature='s', out_signature = 'i')
     def AddCategory(self, name):
         return self.add_category(name)
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='s', out_signature='i')
+    @storage_method("writer", in_signature='s', out_signature='i')
     def GetCategoryId(self, category):
         return self.get_category_id(category)
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='is')
+    @storage_method("writer", in_signature='is')
     def UpdateCategory(self, id, name):
         self.update_category(id, name)
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='i')
+    @storage_method("writer", in_signature='i')
     def RemoveCategory(self, id):
         self.remove_category(id)
 
-    @dbus.service.method("org.gnome.Hamster", out_signature='a(is)')
+    @storage_method("readers", out_signature='a(is)')
     def GetCategories(self):
         return [(category['id'], category['name']) for category in self.get_categories()]
 
 
     # activities
-    @dbus.service.method("org.gnome.Hamster", in_signature='si', out_signature = 'i')
+    @storage_method("writer", in_signature='si', out_signature = 'i')
     def AddActivity(self, name, category_id):
         return self.add_activity(name, category_id)
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='isi')
+    @storage_method("writer", in_signature='isi')
     def UpdateActivity(self, id, name, category_id):
         self.update_activity(id, name, category_id)
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='i')
+    @storage_method("writer", in_signature='i')
     def RemoveActivity(self, id):
         return self.remove_activity(id)
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='i', out_signature='a(isis)')
+    @storage_method("readers", in_signature='i', out_signature='a(isis)')
     def GetCategoryActivities(self, category_id):
         return [(row['id'],
                  row['name'],
@@ -404,17 +728,17 @@ class Storage(db.Storage, dbus.service.Object):
                       self.get_category_activities(category_id = category_id)]
 
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='s', out_signature='a(ss)')
+    @storage_method("readers", in_signature='s', out_signature='a(ss)')
     def GetActivities(self, search = ""):
         return [(row['name'], row['category'] or '') for row in self.get_activities(search)]
 
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='ii', out_signature = 'b')
+    @storage_method("writer", in_signature='ii', out_signature = 'b')
     def ChangeCategory(self, id, category_id):
         return self.change_category(id, category_id)
 
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='sib', out_signature='a{sv}')
+    @storage_method("writer", in_signature='sib', out_signature='a{sv}')
     def GetActivityByName(self, activity, category_id, resurrect = True):
         category_id = category_id or None
         if activity:
@@ -423,21 +747,74 @@ class Storage(db.Storage, dbus.service.Object):
             return {}
 
     # tags
-    @dbus.service.method("org.gnome.Hamster", in_signature='b', out_signature='a(isb)')
+    @storage_method("readers", in_signature='b', out_signature='a(isb)')
     def GetTags(self, only_autocomplete):
         return [(tag['id'], tag['name'], tag['autocomplete']) for tag in self.get_tags(only_autocomplete)]
 
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='as', out_signature='a(isb)')
+    @storage_method("writer", in_signature='as', out_signature='a(isb)')
     def GetTagIds(self, tags):
         return [(tag['id'], tag['name'], tag['autocomplete']) for tag in self.get_tag_ids(tags)]
 
 
-    @dbus.service.method("org.gnome.Hamster", in_signature='s')
+    @storage_method("writer", in_signature='s')
     def SetTagsAutocomplete(self, tags):
         self.update_autocomplete_tags(tags)
 
 
+    @storage_method("writer")
+    def RebuildIndex(self):
+        """Rebuild the full text search index."""
+        self.rebuild_index()
+
+
+    @storage_method("writer")
+    def RebuildDailyTotals(self):
+        """Rebuild the daily totals (cf. GetDailyTotalsJSON)."""
+        self.rebuild_daily_totals()
+
+
+    @storage_method("writer", out_signature='a(sd)')
+    def Maintenance(self):
+        """Run all the database maintenance tasks now.
+
+        They are run in small steps when the service is idle anyway,
+        this does them completely (e.g. after a large import).
+
+        Return:
+            list of (task name, duration in seconds).
+        """
+        # a complete round, any idle one in progress can be dropped
+        self.__maintenance_round = None
+        timings = self.maintenance()
+        self.__last_maintenance = time.monotonic()
+        return timings
+
+
+    @storage_method("writer", in_signature='i', out_signature='i')
+    def ArchiveFacts(self, dbus_day):
+        """Move the facts that ended before the given hamster day
+        to the archive database. They remain available to queries.
+
+        Args:
+            dbus_day (int): day, as a D-Bus date (cf. to_dbus_date).
+        Return:
+            number of archived facts.
+        """
+        day = dt.hday.from_pdt(from_dbus_date(dbus_day))
+        return self.archive_facts(day.start)
+
+
+    @dbus.service.method("org.gnome.Hamster", out_signature='s')
+    def GetStats(self):
+        """SQL statistics, if the service was started with --stats.
+
+        Return:
+            JSON (str) of db.Storage.get_stats, null when disabled.
+        """
+        return json.dumps(self.get_stats())
+
+
     @dbus.service.method("org.gnome.Hamster", out_signature='s')
     def Version(self):
         return hamster.__version__
@@ -452,6 +829,9 @@ if __name__ == '__main__':
                         choices=('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'),
                         default='WARNING',
                         help="Set the logging level (default: %(default)s)")
+    parser.add_argument("--stats", action="store_true",
+                        help="Record SQL statistics, cf. the GetStats D-Bus method. "
+                             "Slow statements are logged as warnings")
 
     args = parser.parse_args()
 
@@ -461,5 +841,5 @@ if __name__ == '__main__':
     hamster_logger.setLevel(args.log_level)
 
     print("hamster-service up")
-    storage = Storage(loop)
+    storage = Storage(loop, stats=args.stats)
     loop.run()
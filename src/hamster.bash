@@ -17,7 +17,7 @@ _hamster()
     #
     #  The basic options we'll complete.
     #
-    opts="activities categories current export list search start stop "
+    opts="activities archive categories current export import list maintenance rebuild search start stop "
 
 
     #
@@ -20,6 +20,7 @@
 
 
 import dbus
+import json
 import logging
 logger = logging.getLogger(__name__)   # noqa: E402
 import sys
@@ -31,7 +32,11 @@ from textwrap import dedent
 import hamster
 from hamster.lib.dbus import (
     DBusMainLoop,
+    from_dbus_changes_json,
+    from_dbus_daily_totals_json,
     from_dbus_fact_json,
+    from_dbus_facts_columns,
+    from_dbus_totals_json,
     to_dbus_date,
     to_dbus_fact,
     to_dbus_fact_json,
@@ -67,6 +72,8 @@ class Storage(gobject.GObject):
         DBusMainLoop(set_as_default=True)
         self.bus = dbus.SessionBus()
         self._connection = None # will be initiated on demand
+        # from the last change signal, cf. get_changes_since
+        self.revision = None
 
         self.bus.add_signal_receiver(self._on_tags_changed, 'TagsChanged', 'org.gnome.Hamster')
         self.bus.add_signal_receiver(self._on_facts_changed, 'FactsChanged', 'org.gnome.Hamster')
@@ -111,13 +118,17 @@ class Storage(gobject.GObject):
     def _on_dbus_connection_change(self, name, old, new):
         self._connection = None
 
-    def _on_tags_changed(self):
+    # older services sent no revision
+    def _on_tags_changed(self, revision=None):
+        self.revision = revision
         self.emit("tags-changed")
 
-    def _on_facts_changed(self):
+    def _on_facts_changed(self, revision=None):
+        self.revision = revision
         self.emit("facts-changed")
 
-    def _on_activities_changed(self):
+    def _on_activities_changed(self, revision=None):
+        self.revision = revision
         self.emit("activities-changed")
 
     def _on_toggle_called(self):
@@ -141,8 +152,51 @@ class Storage(gobject.GObject):
         """
         range = dt.Range.from_start_end(start, end)
         dbus_range = to_dbus_range(range)
-        return [from_dbus_fact_json(fact)
-                for fact in self.conn.GetFactsJSON(dbus_range, search_terms)]
+        return list(from_dbus_facts_columns(self.conn.GetFactsColumns(dbus_range, search_terms)))
+
+    def get_totals(self, start, end=None, group_by="category", search_terms=""):
+        """Sum the fact durations, grouped by day, week, month,
+           category, activity or tag.
+           Returns a list of (key, timedelta), cf. GetTotalsJSON.
+        """
+        range = dt.Range.from_start_end(start, end)
+        dbus_range = to_dbus_range(range)
+        dbus_totals = self.conn.GetTotalsJSON(dbus_range, group_by, search_terms)
+        return from_dbus_totals_json(dbus_totals, group_by)
+
+    def get_changes_since(self, revision):
+        """Changes of the facts after revision (e.g. a previous self.revision),
+           as (current revision, changes). changes is None if they are not known
+           anymore, cf. GetChangesSince.
+        """
+        return from_dbus_changes_json(self.conn.GetChangesSince(revision))
+
+    def get_daily_totals(self, start, end=None):
+        """Time spent per hamster day and activity,
+           as a list of (hday, activity, category, timedelta).
+           Cheap even for long ranges, cf. GetDailyTotalsJSON.
+        """
+        range = dt.Range.from_start_end(start, end)
+        return from_dbus_daily_totals_json(self.conn.GetDailyTotalsJSON(to_dbus_range(range)))
+
+    def iter_facts(self, start, end=None, search_terms="", page_size=500):
+        """Iterate over the facts returned by get_facts.
+
+        Facts are fetched page_size at a time (cf. GetFactsPage),
+        so that long ranges do not need to be held in memory,
+        nor sent in a single message.
+        """
+        range = dt.Range.from_start_end(start, end)
+        dbus_range = to_dbus_range(range)
+        after_start, after_id = "", 0
+        while True:
+            page = [from_dbus_fact_json(fact)
+                    for fact in self.conn.GetFactsPage(dbus_range, search_terms,
+                                                       after_start, after_id, page_size)]
+            yield from page
+            if len(page) < page_size:
+                return
+            after_start, after_id = str(page[-1].start_time), page[-1].id
 
     def get_activities(self, search = ""):
         """returns list of activities name matching search criteria.
@@ -210,6 +264,14 @@ class Storage(gobject.GObject):
 
         return new_id
 
+    def add_facts(self, facts, on_conflict="skip"):
+        """Add many facts (iterable of Fact) at once.
+           Returns the new ids, 0 for skipped facts.
+           Cf. Storage.add_facts for on_conflict.
+        """
+        dbus_facts = [to_dbus_fact_json(fact) for fact in facts]
+        return list(self.conn.AddFactsJSON(dbus_facts, on_conflict))
+
     def stop_tracking(self, end_time = None):
         """Stop tracking current activity. end_time can be passed in if the
         activity should have other end time than the current moment"""
@@ -224,6 +286,12 @@ class Storage(gobject.GObject):
         "delete fact from database"
         self.conn.RemoveFact(fact_id)
 
+    def remove_facts(self, fact_ids):
+        """Delete many facts at once.
+           Returns the error messages, in order, empty for removed facts.
+        """
+        return [str(error) for error in self.conn.RemoveFacts(fact_ids)]
+
     def update_fact(self, fact_id, fact, temporary_activity = False):
         """Update fact values. See add_fact for rules.
         Update is performed via remove/insert, so the
@@ -235,6 +303,16 @@ class Storage(gobject.GObject):
 
         return new_id
 
+    def update_facts(self, updates):
+        """Update many facts at once.
+           updates is an iterable of (fact_id, Fact).
+           Returns (new id, error message) for each update, in order.
+           Cf. Storage.update_facts.
+        """
+        dbus_updates = [(fact_id, to_dbus_fact_json(fact)) for fact_id, fact in updates]
+        return [(int(new_id), str(error))
+                for new_id, error in self.conn.UpdateFactsJSON(dbus_updates)]
+
 
     def get_category_activities(self, category_id = None):
         """Return activities for category. If category is not specified, will
@@ -275,3 +353,31 @@ class Storage(gobject.GObject):
 
     def add_category(self, name):
         return self.conn.AddCategory(name)
+
+    def get_stats(self):
+        """SQL statistics of the service (cf. db.Storage.get_stats),
+           None unless it was started with --stats.
+        """
+        return json.loads(self.conn.GetStats())
+
+    def rebuild_index(self):
+        """Rebuild the full text search index."""
+        self.conn.RebuildIndex()
+
+    def rebuild_daily_totals(self):
+        """Rebuild the daily totals."""
+        self.conn.RebuildDailyTotals()
+
+    def maintenance(self):
+        """Run the database maintenance tasks now.
+           Returns a list of (task name, seconds).
+        """
+        # a VACUUM can take longer than the default D-Bus timeout
+        return [(str(name), float(elapsed))
+                for name, elapsed in self.conn.Maintenance(timeout=600)]
+
+    def archive_facts(self, day):
+        """Move the facts that ended before the hamster day (dt.date)
+           to the archive database. Returns the number of archived facts.
+        """
+        return self.conn.ArchiveFacts(to_dbus_date(day))
@@ -3,6 +3,7 @@ import dbus
 from dbus.mainloop.glib import DBusGMainLoop as DBusMainLoop
 from json import dumps, loads
 from calendar import timegm
+import datetime as pdt  # standard datetime
 from hamster.lib import datetime as dt
 from hamster.lib.fact import Fact
 
@@ -14,6 +15,52 @@ from hamster.lib.fact import Fact
 # So back and forth conversions are close to one another.
 
 
+# changes
+
+def from_dbus_changes_json(dbus_changes):
+    """Convert D-Bus JSON to (revision, changes), cf. to_dbus_changes_json."""
+    d = loads(dbus_changes)
+    changes = d["changes"]
+    if changes is not None:
+        changes = [(revision, fact_id, op,
+                    dt.datetime.parse(start) if start else None,
+                    dt.datetime.parse(end) if end else None)
+                   for revision, fact_id, op, start, end in changes]
+    return d["revision"], changes
+
+
+def to_dbus_changes_json(revision, changes):
+    """Convert (revision, changes) to D-Bus JSON (str).
+
+    changes is a list of (revision, fact_id, op, range_start, range_end),
+    or None if they are not all known any more.
+    """
+    if changes is not None:
+        changes = [(change_revision, fact_id, op,
+                    str(start) if start else None,
+                    str(end) if end else None)
+                   for change_revision, fact_id, op, start, end in changes]
+    return dumps({"revision": revision, "changes": changes})
+
+
+# daily totals
+
+def from_dbus_daily_totals_json(dbus_daily_totals):
+    """Convert D-Bus JSON to a list of (dt.hday, activity, category, dt.timedelta)."""
+    return [(dt.hday(*(int(part) for part in day.split("-"))),
+             activity, category, dt.timedelta(minutes=minutes))
+            for day, activity, category, minutes in loads(dbus_daily_totals)]
+
+
+def to_dbus_daily_totals_json(daily_totals):
+    """Convert a list of (day, activity, category, dt.timedelta) to D-Bus JSON (str).
+
+    Days are sent as "YYYY-MM-DD", durations as integer minutes.
+    """
+    return dumps([(day.isoformat(), activity, category, int(delta.total_seconds() // 60))
+                  for day, activity, category, delta in daily_totals])
+
+
 # dates
 
 def from_dbus_date(dbus_date):
@@ -56,6 +103,85 @@ def to_dbus_fact_json(fact):
     return dumps(d)
 
 
+"""
+facts columns signature (cf. to_dbus_facts_columns), one array per field
+    ax ids
+    ax start times, in minutes since epoch (of the naive datetimes)
+    ax end times, same, NO_END for on-going facts
+    ax activity ids
+    ai activity names, as indexes in the names array below
+    ai category names, same
+    as descriptions
+    ai number of tags of each fact
+    ai tags of all the facts, one after the other, as indexes in names
+    as names
+"""
+facts_columns_signature = '(axaxaxaxaiaiasaiaias)'
+
+NO_END = -2 ** 63
+# naive, as the times of the columns
+EPOCH = dt.datetime(1970, 1, 1)
+
+
+def from_dbus_facts_columns(dbus_columns):
+    """Iterate over the facts of D-Bus facts columns.
+
+    Each Fact is built when its turn comes.
+    """
+    (ids, starts, ends, activity_ids, activities, categories,
+     descriptions, tag_counts, tags, names) = dbus_columns
+    names = [str(name) for name in names]
+    # adjacent facts share their times
+    datetimes = {}
+
+    def to_datetime(minutes):
+        t = datetimes.get(minutes)
+        if t is None:
+            t = datetimes[minutes] = EPOCH + pdt.timedelta(minutes=minutes)
+        return t
+
+    tag_start = 0
+    for i, fact_id in enumerate(ids):
+        tag_end = tag_start + tag_counts[i]
+        end = ends[i]
+        yield Fact(activity=names[activities[i]],
+                   category=names[categories[i]],
+                   description=str(descriptions[i]),
+                   tags=[names[code] for code in tags[tag_start:tag_end]],
+                   start_time=to_datetime(int(starts[i])),
+                   end_time=to_datetime(int(end)) if end != NO_END else None,
+                   id=int(fact_id),
+                   activity_id=int(activity_ids[i]))
+        tag_start = tag_end
+
+
+def to_dbus_facts_columns(facts):
+    """Convert Facts to D-Bus facts columns (cf. facts_columns_signature).
+
+    Activity, category and tag names are sent once,
+    facts refer to them by their index.
+    """
+    codes = {}  # name: index in names
+
+    def code(name):
+        return codes.setdefault(name, len(codes))
+
+    columns = tuple([] for __ in range(9))
+    (ids, starts, ends, activity_ids, activities, categories,
+     descriptions, tag_counts, tags) = columns
+    for fact in facts:
+        ids.append(fact.id or 0)
+        starts.append(timegm(fact.start_time.timetuple()) // 60)
+        ends.append(timegm(fact.end_time.timetuple()) // 60 if fact.end_time else NO_END)
+        activity_ids.append(fact.activity_id or 0)
+        activities.append(code(fact.activity or ""))
+        categories.append(code(fact.category or ""))
+        descriptions.append(fact.description or "")
+        tag_counts.append(len(fact.tags))
+        tags.extend(code(tag) for tag in fact.tags)
+    return columns + (list(codes), )
+
+
 # Range
 
 def from_dbus_range(dbus_range):
@@ -71,6 +197,34 @@ def to_dbus_range(range):
     return range.format(default_day=None)
 
 
+# totals
+
+def from_dbus_totals_json(dbus_totals, group_by):
+    """Convert D-Bus JSON to a list of (key, dt.timedelta).
+
+    group_by is the one passed to GetTotalsJSON.
+    """
+    totals = []
+    for key, minutes in loads(dbus_totals):
+        if group_by in ("day", "week", "month"):
+            key = dt.date(*(int(part) for part in key.split("-")))
+        totals.append((key, dt.timedelta(minutes=minutes)))
+    return totals
+
+
+def to_dbus_totals_json(totals):
+    """Convert a list of (key, dt.timedelta) to D-Bus JSON (str).
+
+    Dates are sent as "YYYY-MM-DD", durations as integer minutes.
+    """
+    dbus_totals = []
+    for key, delta in totals:
+        if isinstance(key, pdt.date):
+            key = key.isoformat()
+        dbus_totals.append((key, int(delta.total_seconds() // 60)))
+    return dumps(dbus_totals)
+
+
 # Legacy functions:
 
 """
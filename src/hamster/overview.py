@@ -317,6 +317,7 @@ class Totals(graphics.Scene):
 
 
     def set_facts(self, facts):
+        """Show the totals of facts, summed here as they are at hand."""
         totals = defaultdict(lambda: defaultdict(dt.timedelta))
         for fact in facts:
             for key in ('category', 'activity'):
@@ -325,9 +326,18 @@ class Totals(graphics.Scene):
             for tag in fact.tags:
                 totals["tag"][tag] += fact.delta
 
+        # same order as Storage.get_totals
+        self.set_totals({key: sorted(totals[key].items(), key=lambda x: (-x[1], x[0]))
+                         for key in ('category', 'activity', 'tag')})
 
-        for key, group in totals.items():
-            totals[key] = sorted(group.items(), key=lambda x: x[1], reverse=True)
+    def set_totals(self, totals):
+        """Show totals.
+
+        Args:
+            totals (dict): "category", "activity" and "tag" keys,
+                           each with a list of (name, timedelta),
+                           longest first (cf. Storage.get_totals).
+        """
         self.totals = totals
 
         self.activities_chart.set_values(totals['activity'])
@@ -528,7 +538,8 @@ class Overview(Controller):
         search_active = self.header_bar.search_button.get_active()
         search = "" if not search_active else self.filter_entry.get_text()
         search = "%s*" % search if search else "" # search anywhere
-        self.facts = self.storage.get_facts(start, end, search_terms=search)
+        # paged, long ranges would not fit in a single D-Bus message
+        self.facts = list(self.storage.iter_facts(start, end, search_terms=search))
         self.fact_tree.set_facts(self.facts, scroll_to_top=scroll_to_top)
         self.totals.set_facts(self.facts)
         self.header_bar.stop_button.set_sensitive(
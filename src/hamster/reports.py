@@ -21,6 +21,7 @@
 # along with Project Hamster.  If not, see <http://www.gnu.org/licenses/>.
 import os, sys
 from xml.dom.minidom import Document
+from xml.etree import ElementTree
 import csv
 import copy
 import itertools
@@ -33,6 +34,8 @@ from textwrap import dedent
 from hamster.lib import datetime as dt
 from hamster.lib.configuration import runtime
 from hamster.lib import stuff
+from hamster.lib.dbus import from_dbus_fact_json
+from hamster.lib.fact import Fact
 from hamster.lib.i18n import C_
 try:
     import json
@@ -47,7 +50,13 @@ from calendar import timegm
 from io import StringIO, IOBase
 
 def simple(facts, start_date, end_date, format, path = None):
-    facts = copy.deepcopy(facts) # dont want to do anything bad to the input
+    """Write a report.
+
+    facts can be any iterable (cf. Storage.iter_facts),
+    it is consumed once, one fact at a time.
+    """
+    # dont want to do anything bad to the input
+    facts = (copy.deepcopy(fact) for fact in facts)
     report_path = stuff.locale_from_utf8(path)
 
     if format == "tsv":
@@ -63,11 +72,84 @@ def simple(facts, start_date, end_date, format, path = None):
     return writer
 
 
+def read(path, format=None):
+    """Read facts back from a tsv, xml or json file.
+
+    format defaults to the file extension.
+    tsv and xml are the simple() reports,
+    json is a list of facts, either as GetFactsJSON returns them,
+    or as in the html report (cf. Fact.as_dict).
+    Returns an iterator of Fact.
+    """
+    if format is None:
+        format = os.path.splitext(path)[1][1:].lower()
+    readers = {"tsv": _read_tsv, "xml": _read_xml, "json": _read_json}
+    if format not in readers:
+        raise ValueError("cannot read {!r}, expected one of {}"
+                         .format(path, ", ".join(sorted(readers))))
+    return readers[format](path)
+
+
+def _report_fact(activity, start_time, end_time, category, description, tags):
+    """Fact from report columns, undoing the report defaults."""
+    if category == _("Unsorted"):
+        category = ""
+    return Fact(activity=activity,
+                category=category,
+                description=description,
+                tags=[tag.strip() for tag in tags.split(",") if tag.strip()],
+                start_time=_report_datetime(start_time),
+                end_time=_report_datetime(end_time))
+
+
+def _report_datetime(value):
+    """Parse a report datetime, missing end times are written as "" or "None"."""
+    if isinstance(value, str):
+        return dt.datetime.parse(value)
+    return value
+
+
+def _read_tsv(path):
+    with open(path, newline="") as f:
+        rows = csv.reader(f, dialect='excel-tab')
+        next(rows, None)  # headers
+        for activity, start_time, end_time, __, category, description, tags in rows:
+            yield _report_fact(activity, start_time, end_time,
+                               category, description, tags)
+
+
+def _read_xml(path):
+    for __, element in ElementTree.iterparse(path):
+        if element.tag == "activity":
+            yield _report_fact(element.get("name"),
+                               element.get("start_time"), element.get("end_time"),
+                               element.get("category"), element.get("description"),
+                               element.get("tags"))
+            element.clear()
+
+
+def _read_json(path):
+    with open(path) as f:
+        facts = json.load(f)
+    for fact in facts:
+        if isinstance(fact, str):
+            yield from_dbus_fact_json(fact)
+        elif "range" in fact:
+            yield from_dbus_fact_json(json_dumps(fact))
+        else:
+            # timestamps of the local time, cf. Fact.as_dict
+            times = [dt.datetime(1970, 1, 1) + dt.timedelta(seconds=t) if t else None
+                     for t in (fact["start_time"], fact["end_time"])]
+            yield _report_fact(fact["activity"], *times,
+                               fact["category"], fact["description"],
+                               ", ".join(fact["tags"]))
+
+
 class ReportWriter(object):
     #a tiny bit better than repeating the code all the time
     def __init__(self, path = None, datetime_format = "%Y-%m-%d %H:%M:%S"):
         # if path is empty or None, print to stdout
-        self.file = open(path, "w") if path else StringIO()
+        self.file = open(path, "w") if path else sys.stdout
         self.path = path
         self.datetime_format = datetime_format
 
@@ -79,12 +161,13 @@ class ReportWriter(object):
 
                 self._write_fact(fact)
 
-            self._finish(facts)
+            self._finish()
         finally:
-            if not self.path:
-                # print the full report to stdout
-                print(self.file.getvalue())
-            self.file.close()
+            if self.path:
+                self.file.close()
+            else:
+                # the report was printed as it went
+                print()
 
     def _start(self, facts):
         raise NotImplementedError
@@ -92,7 +175,7 @@ class ReportWriter(object):
     def _write_fact(self, fact):
         raise NotImplementedError
 
-    def _finish(self, facts):
+    def _finish(self):
         raise NotImplementedError
 
 
@@ -121,7 +204,7 @@ class ICalWriter(ReportWriter):
                     """.format(fact=fact)
         self.file.write(dedent(event_str))
 
-    def _finish(self, facts):
+    def _finish(self):
         self.file.write("END:VCALENDAR\n")
 
 
@@ -154,14 +237,17 @@ class TSVWriter(ReportWriter):
                                   fact.category,
                                   fact.description,
                                   ", ".join(fact.tags)])
-    def _finish(self, facts):
+    def _finish(self):
         pass
 
 class XMLWriter(ReportWriter):
     def __init__(self, path):
         ReportWriter.__init__(self, path)
         self.doc = Document()
-        self.activity_list = self.doc.createElement("activities")
+        # the <activities> list is written as it goes,
+        # instead of building the whole document first
+        self.header = '<?xml version="1.0" ?><activities'
+        self.empty = True
 
     def _write_fact(self, fact):
         activity = self.doc.createElement("activity")
@@ -172,11 +258,16 @@ class XMLWriter(ReportWriter):
         activity.setAttribute("category", fact.category)
         activity.setAttribute("description", fact.description)
         activity.setAttribute("tags", ", ".join(fact.tags))
-        self.activity_list.appendChild(activity)
-
-    def _finish(self, facts):
-        self.doc.appendChild(self.activity_list)
-        self.file.write(self.doc.toxml())
+        if self.empty:
+            self.file.write(self.header + ">")
+            self.empty = False
+        self.file.write(activity.toxml())
+
+    def _finish(self):
+        if self.empty:
+            self.file.write(self.header + "/>")
+        else:
+            self.file.write("</activities>")
 
 
 
@@ -217,6 +308,8 @@ class HTMLWriter(ReportWriter):
         self.by_date_template = self._extract_template('by_date')
 
         self.fact_rows = []
+        # (date, fact dict), for the totals
+        self.fact_dicts = []
 
     def _extract_template(self, name):
         pattern = re.compile('<%s>(.*)</%s>' % (name, name), re.DOTALL)
@@ -263,14 +356,15 @@ class HTMLWriter(ReportWriter):
             description = html.escape(fact.description).replace('\n', '<br />') or ""
         )
         self.fact_rows.append(Template(self.fact_row_template).safe_substitute(data))
+        self.fact_dicts.append((fact.date, fact.as_dict()))
 
 
-    def _finish(self, facts):
+    def _finish(self):
 
         # group by date
         by_date = []
-        for date, date_facts in itertools.groupby(facts, lambda fact:fact.date):
-            by_date.append((date, [fact.as_dict() for fact in date_facts]))
+        for date, date_facts in itertools.groupby(self.fact_dicts, lambda item: item[0]):
+            by_date.append((date, [fact for __, fact in date_facts]))
         by_date = dict(by_date)
 
         date_facts = []
@@ -312,7 +406,7 @@ class HTMLWriter(ReportWriter):
 
             start_date = timegm(self.start_date.timetuple()),
             end_date = timegm(self.end_date.timetuple()),
-            facts = json_dumps([fact.as_dict() for fact in facts]),
+            facts = json_dumps([fact for __, fact in self.fact_dicts]),
             date_facts = json_dumps(date_facts),
 
             all_activities_rows = "\n".join(self.fact_rows)
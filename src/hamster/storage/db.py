@@ -25,11 +25,17 @@ import logging
 logger = logging.getLogger(__name__)   # noqa: E402
 
 import os, time
-import itertools
+import collections
+import threading
+import datetime as pdt  # standard datetime
 import sqlite3 as sqlite
+from calendar import timegm
+from functools import lru_cache
 from shutil import copy as copyfile
+from urllib.parse import quote
 try:
     from gi.repository import Gio as gio
+    from gi.repository import GLib as glib
 except ImportError:
     print("Could not import gio - requires pygobject. File monitoring will be disabled")
     gio = None
@@ -41,13 +47,338 @@ from hamster.lib.fact import Fact
 from hamster.storage import storage
 
 
+# connection profile, applied each time the connection is opened.
+# Values can be overridden through the database-pragmas GSettings key,
+# or the pragmas argument of Storage.
+DEFAULT_PRAGMAS = {
+    # readers do not block the writer, and commits need no fsync
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    # negative means KiB instead of pages
+    "cache_size": -16000,
+    "mmap_size": 64 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    # milliseconds to wait for a lock held by another process
+    "busy_timeout": 5000,
+}
+
+
+# tags of a fact are fetched as a single group_concat column,
+# joined with the ASCII unit separator
+TAG_SEPARATOR = "\x1f"
+
+# columns of a fact row, shared by the fact queries.
+# The correlated tags subquery keeps one row per fact.
+def fact_columns(schema="main"):
+    """Return the columns to select for facts (a), with their tags from schema."""
+    return """
+                   a.id AS id,
+                   a.start_time AS start_time,
+                   a.end_time AS end_time,
+                   a.description as description,
+                   b.name AS name, b.id as activity_id,
+                   coalesce(c.name, ?) as category,
+                   (SELECT group_concat(e.name, char(31))
+                      FROM {table} d
+                      JOIN tags e ON e.id = d.tag_id
+                     WHERE d.fact_id = a.id) as tags
+""".format(table=qualified("fact_tags", schema))
+
+
+def qualified(table, schema="main"):
+    """Return the table name, prefixed with its schema if needed."""
+    return table if schema == "main" else "{}.{}".format(schema, table)
+
+
+FACT_COLUMNS = fact_columns()
+
+
+# archive of old facts, next to the main database file.
+# Attached as "archive" whenever the file exists.
+ARCHIVE_FILE = "hamster-archive.db"
+
+ARCHIVE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS archive.facts (id integer primary key,
+                                                  activity_id integer,
+                                                  start_time timestamp,
+                                                  end_time timestamp,
+                                                  description varchar2)""",
+    "CREATE TABLE IF NOT EXISTS archive.fact_tags (fact_id integer, tag_id integer)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_facts_start ON facts(start_time, end_time)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_facts_end ON facts(end_time, start_time)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_fact_tags_fact ON fact_tags(fact_id)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_fact_tags_tag ON fact_tags(tag_id)",
+]
+
+
+# milliseconds between a database file change and the data_version check
+DATA_VERSION_CHECK_DELAY = 500
+
+
+# journal of the fact changes (cf. __journal).
+# Only the latest change of each fact is kept, and at most JOURNAL_SIZE
+# of them, checked every JOURNAL_COMPACT_EVERY revisions.
+JOURNAL_SIZE = 10000
+JOURNAL_COMPACT_EVERY = 1000
+
+
+# maintenance (cf. __maintenance_steps), amount of work per step.
+# Segments merged in the search index, and pages given back by the vacuum.
+MAINTENANCE_MERGE_PAGES = 200
+MAINTENANCE_VACUUM_PAGES = 256
+
+
+# SQL statistics (cf. Storage.enable_stats).
+# Statements taking longer than SLOW_STATEMENT_TIME seconds are logged
+# with their query plan, the last SLOW_STATEMENTS_KEPT are kept.
+SLOW_STATEMENT_TIME = 0.1
+SLOW_STATEMENTS_KEPT = 50
+
+
+class QueryStats(object):
+    """Timing of the SQL statements, by statement and by storage method.
+
+    Statements are counted for the outermost storage method running
+    in the same thread (e.g. get_tag_ids within add_fact counts for add_fact).
+    Statements run while iterating over iter_facts come after the
+    method returned, they are only counted by statement.
+    """
+
+    def __init__(self):
+        self.statements = {}  # statement: [count, seconds, max seconds]
+        self.methods = {}  # method name: [calls, statements, seconds]
+        self.slow = collections.deque(maxlen=SLOW_STATEMENTS_KEPT)
+        self.lock = threading.Lock()  # guards the counters above
+        self.running = threading.local()
+
+    @property
+    def method(self):
+        """Outermost storage method running in the calling thread."""
+        return getattr(self.running, "method", None)
+
+    @method.setter
+    def method(self, name):
+        self.running.method = name
+
+    def wrap(self, name, method):
+        """Return method, counting its calls as name."""
+        def wrapper(*args, **kwds):
+            if self.method:
+                return method(*args, **kwds)
+            self.method = name
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwds)
+            finally:
+                self.method = None
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    calls = self.methods.setdefault(name, [0, 0, 0.0])
+                    calls[0] += 1
+                    calls[2] += elapsed
+        return wrapper
+
+    def run(self, con, statement, params, func):
+        """Return func(), timed as a run of statement with params."""
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            self.record(con, statement, params, time.perf_counter() - start)
+
+    def record(self, con, statement, params, elapsed):
+        statement = " ".join(statement.split())
+        with self.lock:
+            runs = self.statements.setdefault(statement, [0, 0.0, 0.0])
+            runs[0] += 1
+            runs[1] += elapsed
+            runs[2] = max(runs[2], elapsed)
+            if self.method:
+                self.methods.setdefault(self.method, [0, 0, 0.0])[1] += 1
+        if elapsed >= SLOW_STATEMENT_TIME:
+            try:
+                plan = [row[3] for row in con.execute("EXPLAIN QUERY PLAN " + statement,
+                                                      params or ())]
+            except sqlite.Error:
+                # e.g. PRAGMA, or statements that do not plan
+                plan = []
+            logger.warning("slow statement ({:.3f}s, in {}): {}\n{}"
+                           .format(elapsed, self.method, statement, "\n".join(plan)))
+            with self.lock:
+                self.slow.append({"statement": statement,
+                                  "params": [str(param) for param in params or ()],
+                                  "seconds": elapsed,
+                                  "method": self.method,
+                                  "plan": plan})
+
+    def as_dict(self):
+        """Return the statistics, slowest statements and methods first."""
+        with self.lock:
+            statements = [{"statement": statement, "count": count,
+                           "seconds": seconds, "max_seconds": max_seconds}
+                          for statement, (count, seconds, max_seconds) in self.statements.items()]
+            methods = [{"method": name, "calls": calls,
+                        "statements": statements_count, "seconds": seconds}
+                       for name, (calls, statements_count, seconds) in self.methods.items()]
+            slow = list(self.slow)
+        return {"statements": sorted(statements, key=lambda item: -item["seconds"]),
+                "methods": sorted(methods, key=lambda item: -item["seconds"]),
+                "slow": slow}
+
+
+# full text search.
+# fact_index is an fts5 index over the fact_index_source view (external
+# content), so it does not duplicate any data. Triggers keep it current:
+# the "before" ones remove the old values (they must be exactly
+# what was indexed), and the "after" ones add the new values.
+FACT_INDEX_SOURCE = """
+    CREATE VIEW fact_index_source AS
+         SELECT a.id AS id,
+                b.name AS name,
+                c.name AS category,
+                a.description AS description,
+                (SELECT group_concat(e.name, ' ')
+                   FROM fact_tags d
+                   JOIN tags e ON e.id = d.tag_id
+                  WHERE d.fact_id = a.id) AS tag
+           FROM facts a
+      LEFT JOIN activities b ON a.activity_id = b.id
+      LEFT JOIN categories c ON b.category_id = c.id
+"""
+
+FACT_INDEX = """
+    CREATE VIRTUAL TABLE fact_index
+                   USING fts5(id UNINDEXED, name, category, description, tag,
+                              content='fact_index_source', content_rowid='id')
+"""
+
+
+def fact_index_triggers():
+    """Return the statements creating the fact_index triggers."""
+    columns = "id, name, category, description, tag"
+    remove = ("INSERT INTO fact_index(fact_index, rowid, {columns}) "
+              "SELECT 'delete', id, {columns} FROM fact_index_source WHERE id {where};")
+    add = ("INSERT INTO fact_index(rowid, {columns}) "
+           "SELECT id, {columns} FROM fact_index_source WHERE id {where};")
+
+    activity_facts = "IN (SELECT id FROM facts WHERE activity_id = {}.id)"
+    category_facts = """IN (SELECT f.id
+                              FROM facts f
+                              JOIN activities b ON b.id = f.activity_id
+                             WHERE b.category_id = {}.id)"""
+
+    # (table, event, affected facts, row used before and after the change)
+    changes = [
+        ("facts", "INSERT", "= {}.id", None, "NEW"),
+        ("facts", "DELETE", "= {}.id", "OLD", None),
+        ("facts", "UPDATE OF activity_id, description", "= {}.id", "OLD", "NEW"),
+        ("activities", "UPDATE OF name, category_id", activity_facts, "OLD", "NEW"),
+        ("categories", "UPDATE OF name", category_facts, "OLD", "NEW"),
+        ("categories", "DELETE", category_facts, "OLD", "OLD"),
+        ("fact_tags", "INSERT", "= {}.fact_id", "NEW", "NEW"),
+        ("fact_tags", "DELETE", "= {}.fact_id", "OLD", "OLD"),
+    ]
+
+    triggers = []
+    for table, event, where, before, after in changes:
+        name = "fact_index_{}_{}".format(table, event.split()[0].lower())
+        statements = []
+        if before:
+            # indexed values are still there, take them out before the change
+            statements.append(("before", remove.format(columns=columns,
+                                                       where=where.format(before))))
+        if after:
+            # and put the new values back
+            statements.append(("after", add.format(columns=columns,
+                                                   where=where.format(after))))
+        for timing, statement in statements:
+            triggers.append("CREATE TRIGGER {name}_{timing} {timing} {event} ON {table} "
+                            "BEGIN {statement} END"
+                            .format(name=name, timing=timing, event=event,
+                                    table=table, statement=statement))
+    return triggers
+
+
+# activity usage.
+# activities.use_count, total_minutes and last_used follow the facts
+# through triggers, so that listing activities never reads the facts.
+# On-going facts count for 0 minutes until they are stopped.
+def fact_minutes(row):
+    """Return the SQL duration of a fact row (e.g. NEW), in whole minutes."""
+    return ("coalesce(CAST(round((julianday({row}.end_time) - julianday({row}.start_time))"
+            " * 1440) AS integer), 0)".format(row=row))
+
+
+def activity_usage_triggers():
+    """Return the statements creating the activity usage triggers."""
+    add = """UPDATE activities
+                SET use_count = use_count + 1,
+                    total_minutes = total_minutes + {minutes},
+                    last_used = max(coalesce(last_used, NEW.start_time), NEW.start_time)
+              WHERE id = NEW.activity_id;""".format(minutes=fact_minutes("NEW"))
+    # last_used only needs a lookup when the latest fact goes away.
+    # If the remaining facts are all archived, it is kept as is.
+    remove = """UPDATE activities
+                   SET use_count = use_count - 1,
+                       total_minutes = total_minutes - {minutes},
+                       last_used = CASE WHEN OLD.start_time < last_used THEN last_used
+                                        ELSE coalesce((SELECT max(start_time)
+                                                         FROM facts
+                                                        WHERE activity_id = OLD.activity_id),
+                                                      CASE WHEN use_count > 1 THEN last_used END)
+                                   END
+                 WHERE id = OLD.activity_id;""".format(minutes=fact_minutes("OLD"))
+    changes = [("insert", "INSERT", add),
+               ("delete", "DELETE", remove),
+               ("update", "UPDATE OF activity_id, start_time, end_time", remove + add)]
+    return ["CREATE TRIGGER activity_usage_{name} AFTER {event} ON facts "
+            "BEGIN {statements} END".format(name=name, event=event, statements=statements)
+            for name, event, statements in changes]
+
+
+# tags.use_count follows fact_tags the same way,
+# so that unused tags are found without counting.
+TAG_USAGE_TRIGGERS = [
+    """CREATE TRIGGER tag_usage_insert AFTER INSERT ON fact_tags
+       BEGIN UPDATE tags SET use_count = use_count + 1 WHERE id = NEW.tag_id; END""",
+    """CREATE TRIGGER tag_usage_delete AFTER DELETE ON fact_tags
+       BEGIN UPDATE tags SET use_count = use_count - 1 WHERE id = OLD.tag_id; END""",
+]
+
+
+def fts_query(search_terms):
+    """Convert hamster search terms to an fts5 MATCH expression.
+
+    Words are matched as whole tokens, a trailing * is a prefix search.
+    Space means AND, comma (or OR) means OR.
+    Any other fts5 syntax is escaped.
+
+    Return an empty string if there is nothing to search for.
+    """
+    groups = []
+    for group in search_terms.replace(" OR ", ",").split(","):
+        words = []
+        for word in group.split():
+            prefix = word.endswith("*")
+            word = word.rstrip("*")
+            if word:
+                words.append('"{}"{}'.format(word.replace('"', '""'),
+                                             "*" if prefix else ""))
+        if words:
+            groups.append(" AND ".join(words))
+    return " OR ".join("({})".format(group) for group in groups)
+
 # note: "zero id means failure" is quite standard,
 #       and that kind of convention will be mandatory for the dbus interface
 #       (None cannot pass through an integer signature).
 
 class Storage(storage.Storage):
     con = None # Connection will be created on demand
-    def __init__(self, unsorted_localized="Unsorted", database_dir=None):
+    # thread allowed to write (threading.get_ident), None for any.
+    # Reads from other threads only use their own read-only connection.
+    writer_thread = None
+    def __init__(self, unsorted_localized="Unsorted", database_dir=None,
+                 pragmas=None, epoch_minutes=None, stats=False):
         """Database storage.
 
         Args:
@@ -60,6 +391,16 @@ class Storage(storage.Storage):
             database_dir (path):
                 Directory holding the database file,
                 or None to use the default location.
+            pragmas (dict):
+                SQLite PRAGMA values, overriding DEFAULT_PRAGMAS and
+                the database-pragmas GSettings key
+                (e.g. {"cache_size": -64000}).
+            epoch_minutes (bool):
+                Add integer start_minute and end_minute columns to facts,
+                if not there yet (cf. __add_epoch_minutes).
+                None to use the database-epoch-minutes GSettings key.
+            stats (bool):
+                Record SQL statistics from the start (cf. enable_stats).
 
         Note: Zero id means failure.
               Unsorted category id is hard-coded as -1
@@ -68,38 +409,117 @@ class Storage(storage.Storage):
 
         self._unsorted_localized = unsorted_localized
 
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(conf.get("database-pragmas"))
+        self.pragmas.update(pragmas or {})
+
+        if epoch_minutes is None:
+            epoch_minutes = conf.get("database-epoch-minutes")
+        self.epoch_minutes = epoch_minutes
+        # whether the integer columns are there, found in run_fixtures
+        self.__has_epoch_minutes = False
+
         self.__con = None
         self.__cur = None
-        self.__last_etag = None
+        # PRAGMA data_version last seen, None for a new connection.
+        # It changes when other connections commit, not for our own writes.
+        self.__data_version = None
+        self.__data_version_check = None  # pending glib timeout
+        # read-only connections, one per thread (cf. get_read_connection),
+        # reopened when the generation changes
+        self.__readers = threading.local()
+        self.__readers_generation = 0
+
+        # name lookups, cleared on changes and on external modifications
+        self.__category_ids = {}  # name: id, 0 if not found
+        self.__activities = {}  # (name, category_id): activity dict or None
+        self.__tags = {}  # name: tag dict, autocompleted tags only
+        # day start daily_totals were computed with, None if unknown
+        self.__daily_totals_day_start = None
+        # statements executed so far, invalidates the last fact below
+        self.__writes = 0
+        # latest fact of the hamster day, for start and stop
+        self.__last_fact = None
+        self.__last_fact_key = None  # (writes, hday) when fetched
+        self.__stats = None  # QueryStats, if enabled
 
 
         self.db_path = self.__init_db_file(database_dir)
         logger.info("database: '{}'".format(self.db_path))
+        self.archive_path = os.path.join(os.path.dirname(self.db_path), ARCHIVE_FILE)
+        # latest end_time in the archive, None if there is no archive
+        self.__archive_end = None
+        # revision of the last journal compaction (cf. __journal)
+        self.__compacted_revision = 0
 
         if gio:
             # add file monitoring so the app does not have to be restarted
             # when db file is rewritten
             def on_db_file_change(monitor, gio_file, event_uri, event):
                 logger.debug(event)
-                if event == gio.FileMonitorEvent.CHANGES_DONE_HINT:
-                    if gio_file.query_info(gio.FILE_ATTRIBUTE_ETAG_VALUE,
-                                           gio.FileQueryInfoFlags.NONE,
-                                           None).get_etag() == self.__last_etag:
-                        # ours
-                        logger.info("database updated")
-                        return
-                elif event == gio.FileMonitorEvent.DELETED:
-                    self.con = None
-
-                if event == gio.FileMonitorEvent.CHANGES_DONE_HINT:
-                    logger.warning("DB file has been modified externally. Calling all stations")
-                    self.dispatch_overwrite()
-
-            self.__database_file = gio.File.new_for_path(self.db_path)
-            self.__db_monitor = self.__database_file.monitor_file(gio.FileMonitorFlags.WATCH_MOUNTS, None)
-            self.__db_monitor.connect("changed", on_db_file_change)
+                if event == gio.FileMonitorEvent.DELETED and gio_file.get_path() == self.db_path:
+                    self.call_in_writer(on_deleted)
+                elif event == gio.FileMonitorEvent.CHANGES_DONE_HINT:
+                    # our own writes end up here as well,
+                    # check once after a burst of changes.
+                    if self.__data_version_check is None:
+                        self.__data_version_check = glib.timeout_add(DATA_VERSION_CHECK_DELAY,
+                                                                     on_check)
+
+            def on_deleted():
+                self.con = None
+                self.__readers_generation += 1
+                self.__clear_caches()
+
+            def on_check():
+                self.__data_version_check = None
+                self.call_in_writer(self.__check_data_version)
+                return False
+
+            # with the write-ahead log, other writers might only change the -wal file
+            self.__db_monitors = []
+            for path in (self.db_path, self.db_path + "-wal"):
+                monitor = gio.File.new_for_path(path).monitor_file(gio.FileMonitorFlags.WATCH_MOUNTS, None)
+                monitor.connect("changed", on_db_file_change)
+                self.__db_monitors.append(monitor)
 
         self.run_fixtures()
+        if stats:
+            self.enable_stats()
+
+    def enable_stats(self, enabled=True):
+        """Start or stop recording SQL statistics, cf. get_stats.
+
+        Statements run without any bookkeeping while disabled.
+        Enabling again starts from scratch.
+        """
+        if self.__stats:
+            # back to the class methods
+            for name in self.__stats_methods():
+                delattr(self, name)
+            self.__stats = None
+        if enabled:
+            self.__stats = QueryStats()
+            for name in self.__stats_methods():
+                setattr(self, name, self.__stats.wrap(name, getattr(self, name)))
+
+    def get_stats(self):
+        """SQL statistics, or None if disabled.
+
+        Returns:
+            dict with "statements" (statement, count, seconds, max_seconds),
+            "methods" (method, calls, statements, seconds), slowest first,
+            and "slow", the latest slow statements
+            (statement, params, seconds, method, plan).
+        """
+        return self.__stats.as_dict() if self.__stats else None
+
+    def __stats_methods(self):
+        """Names of the storage methods counted by the statistics."""
+        return [name for name, value in vars(storage.Storage).items()
+                if callable(value) and not name.startswith("_")
+                and not name.endswith("_changed")
+                and name not in ("run_fixtures", "dispatch_overwrite")]
 
     def __init_db_file(self, database_dir):
         from gi.repository import GLib
@@ -151,26 +571,51 @@ class Storage(storage.Storage):
         return db_path
 
 
-    def register_modification(self):
-        if gio:
-            # db.execute calls this so we know that we were the ones
-            # that modified the DB and no extra refesh is not needed
-            self.__last_etag = self.__database_file.query_info(gio.FILE_ATTRIBUTE_ETAG_VALUE,
-                                                               gio.FileQueryInfoFlags.NONE,
-                                                               None).get_etag()
+    def __clear_caches(self):
+        self.__category_ids.clear()
+        self.__activities.clear()
+        self.__tags.clear()
+        self.__daily_totals_day_start = None
+        self.__last_fact_key = None
+
+    def __check_data_version(self):
+        """Tell everybody if the database was changed by another connection
+        (e.g. another hamster version, or the sqlite3 shell).
+
+        Cheap, checked before reads, and after database file changes.
+        """
+        version = self.__fetchall(self.connection, "PRAGMA data_version", None)[0][0]
+        if version == self.__data_version:
+            return
+        known = self.__data_version is not None
+        self.__data_version = version
+        if known:
+            logger.warning("DB file has been modified externally. Calling all stations")
+            self.__clear_caches()
+            # whatever changed is not in the journal
+            self.__forget_changes()
+            self.dispatch_overwrite()
 
     #tags, here we come!
     def __get_tags(self, only_autocomplete = False):
         if only_autocomplete:
-            return self.fetchall("select * from tags where autocomplete != 'false' order by name")
+            return self.fetchall_snapshot("select * from tags where autocomplete != 'false' order by name")
         else:
-            return self.fetchall("select * from tags order by name")
+            return self.fetchall_snapshot("select * from tags order by name")
 
     def __get_tag_ids(self, tags):
         """look up tags by their name. create if not found"""
 
+        cached = [self.__tags.get(tag) for tag in tags]
+        if all(cached):
+            # no query, and no duplicates, as from the query below
+            return list({tag["id"]: tag for tag in cached}.values()), False
+
         db_tags = self.fetchall("select * from tags where name in (%s)"
                                             % ",".join(["?"] * len(tags)), tags) # bit of magic here - using sqlites bind variables
+        db_tags = [dict(tag) for tag in db_tags]
+        self.__tags.update((tag["name"], tag) for tag in db_tags
+                           if tag["autocomplete"] not in (0, "false"))
 
         changes = False
 
@@ -183,48 +628,44 @@ class Storage(storage.Storage):
 
         found_tags = [tag["name"] for tag in db_tags]
 
-        add = set(tags) - set(found_tags)
+        add = list(set(tags) - set(found_tags))
         if add:
             statement = "insert into tags(name) values(?)"
 
             self.execute([statement] * len(add), [(tag,) for tag in add])
 
-            return self.__get_tag_ids(tags)[0], True # all done, recurse
+            # only the new ones need to be read back
+            new_tags = self.fetchall("select * from tags where name in (%s)"
+                                     % ",".join(["?"] * len(add)), add)
+            new_tags = [dict(tag) for tag in new_tags]
+            self.__tags.update((tag["name"], tag) for tag in new_tags)
+            return db_tags + new_tags, True
         else:
             return db_tags, changes
 
     def __update_autocomplete_tags(self, tags):
         tags = [tag.strip() for tag in tags.split(",") if tag.strip()]  # split by comma
+        self.__tags.clear()
 
         #first we will create new ones
         tags, changes = self.__get_tag_ids(tags)
         tags = [tag["id"] for tag in tags]
 
-        #now we will find which ones are gone from the list
-        query = """
-                    SELECT b.id as id, b.autocomplete, count(a.fact_id) as occurences
-                      FROM tags b
-                 LEFT JOIN fact_tags a on a.tag_id = b.id
-                     WHERE b.id not in (%s)
-                  GROUP BY b.id
-                """ % ",".join(["?"] * len(tags)) # bit of magic here - using sqlites bind variables
-
-        gone = self.fetchall(query, tags)
+        #now the ones that are gone from the list are deleted if unused,
+        #or just left out of the autocompletion (cf. tags.use_count)
+        gone = "id not in (%s)" % ",".join(["?"] * len(tags))
+        total_changes = self.connection.total_changes
+        self.execute(["delete from tags where use_count = 0 and %s" % gone,
+                      """update tags set autocomplete='false'
+                          where use_count > 0 and autocomplete in (1, 'true') and %s""" % gone],
+                     [tags, tags])
 
-        to_delete = [str(tag["id"]) for tag in gone if tag["occurences"] == 0]
-        to_uncomplete = [str(tag["id"]) for tag in gone
-                         if tag["occurences"] > 0 and tag["autocomplete"] in (1, "true")]
+        self.__tags.clear()
 
-        if to_delete:
-            self.execute("delete from tags where id in (%s)" % ", ".join(to_delete))
-
-        if to_uncomplete:
-            self.execute("update tags set autocomplete='false' where id in (%s)" % ", ".join(to_uncomplete))
-
-        return changes or len(to_delete + to_uncomplete) > 0
+        return changes or self.connection.total_changes > total_changes
 
     def __get_categories(self):
-        return self.fetchall("SELECT id, name FROM categories ORDER BY lower(name)")
+        return self.fetchall_snapshot("SELECT id, name FROM categories ORDER BY lower(name)")
 
     def __update_activity(self, id, name, category_id):
         query = """
@@ -235,9 +676,7 @@ class Storage(storage.Storage):
                      WHERE id = ?
         """
         self.execute(query, (name, name.lower(), category_id, id))
-
-        affected_ids = [res[0] for res in self.fetchall("select id from facts where activity_id = ?", (id,))]
-        self.__remove_index(affected_ids)
+        self.__activities.clear()
 
 
     def __change_category(self, id, category_id):
@@ -260,6 +699,8 @@ class Storage(storage.Storage):
         if existing_activity and id == existing_activity['id']: # we are already there, go home
             return False
 
+        self.__activities.clear()
+
         if existing_activity: #ooh, we have something here!
             # first move all facts that belong to movable activity to the new one
             update = """
@@ -269,6 +710,17 @@ class Storage(storage.Storage):
             """
 
             self.execute(update, (existing_activity['id'], id))
+            if self.__archive_end:
+                self.execute(update.replace("facts", "archive.facts"),
+                             (existing_activity['id'], id))
+            self.execute("""INSERT INTO changes (fact_id, op, range_start, range_end)
+                                 SELECT id, 'update', start_time, end_time
+                                   FROM %s
+                                  WHERE activity_id = ?""" % self.__all_facts(),
+                         (existing_activity['id'], ))
+            self.__merge_daily_totals(id, existing_activity['id'])
+            # the triggers do not see the archive
+            self.__update_activity_usage([id, existing_activity['id']])
 
             # and now get rid of our friend
             self.__remove_activity(id)
@@ -282,11 +734,6 @@ class Storage(storage.Storage):
 
             self.execute(statement, (category_id, id))
 
-        affected_ids = [res[0] for res in self.fetchall("select id from facts where activity_id = ?", (id,))]
-        if existing_activity:
-            affected_ids.extend([res[0] for res in self.fetchall("select id from facts where activity_id = ?", (existing_activity['id'],))])
-        self.__remove_index(affected_ids)
-
         return True
 
     def __add_category(self, name):
@@ -295,7 +742,11 @@ class Storage(storage.Storage):
                         VALUES (?, ?)
         """
         self.execute(query, (name, name.lower()))
-        return self.__last_insert_rowid()
+        category_id = self.__last_insert_rowid()
+        # the newest category wins the lookups, cf. __get_category_id
+        self.__category_ids.clear()
+        self.__category_ids[name] = category_id
+        return category_id
 
     def __update_category(self, id,  name):
         if id > -1: # Update, and ignore unsorted, if that was somehow triggered
@@ -305,14 +756,8 @@ class Storage(storage.Storage):
                          WHERE id = ?
             """
             self.execute(update, (name, name.lower(), id))
-
-        affected_query = """
-            SELECT id
-              FROM facts
-             WHERE activity_id in (SELECT id FROM activities where category_id=?)
-        """
-        affected_ids = [res[0] for res in self.fetchall(affected_query, (id,))]
-        self.__remove_index(affected_ids)
+            self.__category_ids.clear()
+            self.__activities.clear()  # they hold the category name
 
 
     def __get_activity_by_name(self, name, category_id = None, resurrect = True):
@@ -321,6 +766,29 @@ class Storage(storage.Storage):
         Otherwise, filter on the specified category.
         """
 
+        key = (name, category_id or None)
+        if key in self.__activities:
+            res = self.__activities[key]
+        else:
+            res = self.__fetch_activity_by_name(name, category_id)
+            self.__activities[key] = res
+
+        if res:
+            res = dict(res)
+            # if the activity was marked as deleted, resurrect on first call
+            # and put in the unsorted category
+            if res['deleted'] and resurrect:
+                update = """
+                            UPDATE activities
+                               SET deleted = null, category_id = -1
+                             WHERE id = ?
+                        """
+                self.execute(update, (res['id'], ))
+                self.__activities.clear()
+
+        return res
+
+    def __fetch_activity_by_name(self, name, category_id):
         if category_id:
             query = """
                        SELECT a.id, a.name, a.deleted, coalesce(b.name, ?) as category
@@ -348,17 +816,6 @@ class Storage(storage.Storage):
             keys = ('id', 'name', 'deleted', 'category')
             res = dict([(key, res[key]) for key in keys])
             res['deleted'] = res['deleted'] or False
-
-            # if the activity was marked as deleted, resurrect on first call
-            # and put in the unsorted category
-            if res['deleted'] and resurrect:
-                update = """
-                            UPDATE activities
-                               SET deleted = null, category_id = -1
-                             WHERE id = ?
-                        """
-                self.execute(update, (res['id'], ))
-
             return res
 
         return None
@@ -372,6 +829,9 @@ class Storage(storage.Storage):
             # Unsorted
             return -1
 
+        if name in self.__category_ids:
+            return self.__category_ids[name]
+
         query = """
                    SELECT id from categories
                     WHERE lower(name) = lower(?)
@@ -381,17 +841,17 @@ class Storage(storage.Storage):
 
         res = self.fetchone(query, (name, ))
 
-        if res:
-            return res['id']
-
-        return 0
+        category_id = res['id'] if res else 0
+        self.__category_ids[name] = category_id
+        return category_id
 
     def _dbfact_to_libfact(self, db_fact):
-        """Convert a db fact (coming from __group_facts) to Fact."""
+        """Convert a db fact row (cf. FACT_COLUMNS) to Fact."""
+        tags = db_fact["tags"]
         return Fact(activity=db_fact["name"],
                     category=db_fact["category"],
                     description=db_fact["description"],
-                    tags=db_fact["tags"],
+                    tags=sorted(tags.split(TAG_SEPARATOR)) if tags else [],
                     start_time=db_fact["start_time"],
                     end_time=db_fact["end_time"],
                     id=db_fact["id"],
@@ -399,49 +859,35 @@ class Storage(storage.Storage):
 
     def __get_fact(self, id):
         query = """
-                   SELECT a.id AS id,
-                          a.start_time AS start_time,
-                          a.end_time AS end_time,
-                          a.description as description,
-                          b.name AS name, b.id as activity_id,
-                          coalesce(c.name, ?) as category, coalesce(c.id, -1) as category_id,
-                          e.name as tag
+                   SELECT %s
                      FROM facts a
                 LEFT JOIN activities b ON a.activity_id = b.id
                 LEFT JOIN categories c ON b.category_id = c.id
-                LEFT JOIN fact_tags d ON d.fact_id = a.id
-                LEFT JOIN tags e ON e.id = d.tag_id
                     WHERE a.id = ?
-                 ORDER BY e.name
-        """
+        """ % FACT_COLUMNS
 
-        fact_rows = self.fetchall(query, (self._unsorted_localized, id))
-        assert len(fact_rows) > 0, "No fact with id {}".format(id)
-        dbfact = self.__group_tags(fact_rows)[0]
+        dbfact = self.fetchone(query, (self._unsorted_localized, id))
+        if not dbfact and self.__archive_end:
+            query = """
+                       SELECT %s
+                         FROM archive.facts a
+                    LEFT JOIN activities b ON a.activity_id = b.id
+                    LEFT JOIN categories c ON b.category_id = c.id
+                        WHERE a.id = ?
+            """ % fact_columns("archive")
+            dbfact = self.fetchone(query, (self._unsorted_localized, id))
+        assert dbfact, "No fact with id {}".format(id)
         fact = self._dbfact_to_libfact(dbfact)
         logger.info("got fact {}".format(fact))
         return fact
 
-    def __group_tags(self, facts):
-        """put the fact back together and move all the unique tags to an array"""
-        if not facts: return facts  #be it None or whatever
-
-        grouped_facts = []
-        for fact_id, fact_tags in itertools.groupby(facts, lambda f: f["id"]):
-            fact_tags = list(fact_tags)
-
-            # first one is as good as the last one
-            grouped_fact = fact_tags[0]
-
-            # we need dict so we can modify it (sqlite.Row is read only)
-            # in python 2.5, sqlite does not have keys() yet, so we hardcode them (yay!)
-            keys = ["id", "start_time", "end_time", "description", "name",
-                    "activity_id", "category", "tag"]
-            grouped_fact = dict([(key, grouped_fact[key]) for key in keys])
-
-            grouped_fact["tags"] = [ft["tag"] for ft in fact_tags if ft["tag"]]
-            grouped_facts.append(grouped_fact)
-        return grouped_facts
+    def __fact_exists(self, id):
+        """Whether there is a fact with this id, archived or not."""
+        query = "SELECT 1 FROM facts WHERE id = ?"
+        if self.__archive_end:
+            query += " UNION ALL SELECT 1 FROM archive.facts WHERE id = ?"
+            return bool(self.fetchone(query, (id, id)))
+        return bool(self.fetchone(query, (id, )))
 
 
     def __touch_fact(self, fact, end_time = None):
@@ -455,7 +901,10 @@ class Storage(storage.Storage):
                           SET end_time = ?
                         WHERE id = ?
             """
+            self.__rollup([fact.id], -1)
             self.execute(query, (end_time, fact.id))
+            self.__rollup([fact.id], 1)
+            self.__journal([fact.id], "update")
 
     def __squeeze_in(self, start_time):
         """ tries to put task in the given date
@@ -469,22 +918,26 @@ class Storage(storage.Storage):
                    SELECT a.*, b.name
                      FROM facts a
                 LEFT JOIN activities b on b.id = a.activity_id
-                    WHERE ((start_time < ? and end_time > ?)
-                           OR (start_time > ? and start_time < ? and end_time is null)
-                           OR (start_time > ? and start_time < ?))
-                 ORDER BY start_time
+                    WHERE (({start} < ? and {end} > ?)
+                           OR ({start} > ? and {start} < ? and {end} is null)
+                           OR ({start} > ? and {start} < ?))
+                 ORDER BY {start}
                     LIMIT 1
-                """
-        fact = self.fetchone(query, (start_time, start_time,
-                                     start_time - dt.timedelta(hours = 12),
-                                     start_time, start_time,
-                                     start_time + dt.timedelta(hours = 12)))
+                """.format(**self.__time_columns())
+        params = (start_time, start_time,
+                  start_time - dt.timedelta(hours = 12),
+                  start_time, start_time,
+                  start_time + dt.timedelta(hours = 12))
+        fact = self.fetchone(query, self.__time_params(params))
         end_time = None
         if fact:
             if start_time > fact["start_time"]:
                 #we are in middle of a fact - truncate it to our start
+                self.__rollup([fact["id"]], -1)
                 self.execute("UPDATE facts SET end_time=? WHERE id=?",
                              (start_time, fact["id"]))
+                self.__rollup([fact["id"]], 1)
+                self.__journal([fact["id"]], "update")
 
             else: #otherwise we have found a task that is after us
                 end_time = fact["start_time"]
@@ -504,22 +957,24 @@ class Storage(storage.Storage):
         #      |--- old --- 1|   |2 --- old --- 1|   |2 --- old ---|
         # |3 -----------------------  big old   ------------------------ 3|
         query = """
-                   SELECT a.*, b.name, c.name as category
-                     FROM facts a
-                LEFT JOIN activities b on b.id = a.activity_id
-                LEFT JOIN categories c on b.category_id = c.id
-                    WHERE (end_time > ? and end_time < ?)
-                       OR (start_time > ? and start_time < ?)
-                       OR (start_time < ? and end_time > ?)
-                 ORDER BY start_time
-                """
-        conflicts = self.fetchall(query, (start_time, end_time,
-                                          start_time, end_time,
-                                          start_time, end_time))
-
+                   SELECT id, start_time, end_time
+                     FROM facts
+                    WHERE ({end} > ? and {end} < ?)
+                       OR ({start} > ? and {start} < ?)
+                       OR ({start} < ? and {end} > ?)
+                """.format(**self.__time_columns())
+        params = (start_time, end_time) * 3
+        conflicts = self.fetchall(query, self.__time_params(params))
+        # sorted here, an ORDER BY would keep sqlite from using the indexes
+        conflicts.sort(key=lambda fact: (fact["start_time"], fact["id"]))
+
+        now = dt.datetime.now()
+        # (fact id, column, new value, end of the split off part or None),
+        # in the conflicts order
+        changes = []
         for fact in conflicts:
             # fact is a sqlite.Row, indexable by column name
-            fact_end_time = fact["end_time"] or dt.datetime.now()
+            fact_end_time = fact["end_time"] or now
 
             # won't eliminate as it is better to have overlapping entries than loosing data
             if start_time < fact["start_time"] and end_time > fact_end_time:
@@ -528,41 +983,60 @@ class Storage(storage.Storage):
             # split - truncate until beginning of new entry and create new activity for end
             if fact["start_time"] < start_time < fact_end_time and \
                fact["start_time"] < end_time < fact_end_time:
-
-                logger.info("splitting %s" % fact["name"])
-                # truncate until beginning of the new entry
-                self.execute("""UPDATE facts
-                                   SET end_time = ?
-                                 WHERE id = ?""", (start_time, fact["id"]))
-                fact_name = fact["name"]
-
-                # create new fact for the end
-                new_fact = Fact(activity=fact["name"],
-                                category=fact["category"],
-                                description=fact["description"],
-                                start_time=end_time,
-                                end_time=fact_end_time)
-                storage.Storage.check_fact(new_fact)
-                new_fact_id = self.__add_fact(new_fact)
-
-                # copy tags
-                tag_update = """INSERT INTO fact_tags(fact_id, tag_id)
-                                     SELECT ?, tag_id
-                                       FROM fact_tags
-                                      WHERE fact_id = ?"""
-                self.execute(tag_update, (new_fact_id, fact["id"])) #clone tags
+                changes.append((fact["id"], "end_time", start_time, fact_end_time))
 
             # overlap start
             elif start_time < fact["start_time"] < end_time:
-                logger.info("Overlapping start of %s" % fact["name"])
-                self.execute("UPDATE facts SET start_time=? WHERE id=?",
-                             (end_time, fact["id"]))
+                changes.append((fact["id"], "start_time", end_time, None))
 
             # overlap end
             elif start_time < fact_end_time < end_time:
-                logger.info("Overlapping end of %s" % fact["name"])
-                self.execute("UPDATE facts SET end_time=? WHERE id=?",
-                             (start_time, fact["id"]))
+                changes.append((fact["id"], "end_time", start_time, None))
+
+        if not changes:
+            return
+        logger.info("solving overlaps: {}".format(changes))
+        if not any(split_end for __, __, __, split_end in changes):
+            # all at once
+            changed = [fact_id for fact_id, __, __, __ in changes]
+            self.__rollup(changed, -1)
+            statements, params = [], []
+            for column, value in (("end_time", start_time), ("start_time", end_time)):
+                fact_ids = tuple(fact_id for fact_id, change_column, __, __ in changes
+                                 if change_column == column)
+                if fact_ids:
+                    statements.append("UPDATE facts SET {} = ? WHERE id IN ({})"
+                                      .format(column, ",".join("?" * len(fact_ids))))
+                    params.append((value, ) + fact_ids)
+            self.execute(statements, params)
+            self.__rollup(changed, 1)
+            self.__journal(changed, "update")
+            return
+
+        # The end of a split fact becomes a new fact, with the same tags.
+        # On-going facts end now. Like any added fact, it first makes room
+        # for itself, which might move the next conflicts: one at a time,
+        # in order, as add_fact always did.
+        for fact_id, column, value, split_end in changes:
+            self.__rollup([fact_id], -1)
+            self.execute("UPDATE facts SET {} = ? WHERE id = ?".format(column),
+                         (value, fact_id))
+            self.__rollup([fact_id], 1)
+            self.__journal([fact_id], "update")
+            if not split_end:
+                continue
+            self.__solve_overlaps(end_time, split_end)
+            self.execute("""INSERT INTO facts (activity_id, start_time, end_time, description)
+                                 SELECT activity_id, ?, ?, description
+                                   FROM facts
+                                  WHERE id = ?""", (end_time, split_end, fact_id))
+            new_id = self.__last_insert_rowid()
+            self.execute("""INSERT INTO fact_tags(fact_id, tag_id)
+                                 SELECT ?, tag_id
+                                   FROM fact_tags
+                                  WHERE fact_id = ?""", (new_id, fact_id))
+            self.__rollup([new_id], 1)
+            self.__journal([new_id], "add")
 
 
     def __add_fact(self, fact, temporary=False):
@@ -603,12 +1077,9 @@ class Storage(storage.Storage):
 
         # if we are working on +/- current day - check the last_activity
         if (dt.timedelta(days=-1) <= dt.datetime.now() - start_time <= dt.timedelta(days=1)):
-            # pull in previous facts
-            facts = self.__get_todays_facts()
-
-            previous = None
-            if facts and facts[-1].end_time is None:
-                previous = facts[-1]
+            previous = self.__get_last_fact()
+            if previous and previous.end_time is not None:
+                previous = None
 
             if previous and previous.start_time <= start_time:
                 # check if maybe that is the same one, in that case no need to restart
@@ -629,8 +1100,9 @@ class Storage(storage.Storage):
                     # now that we removed the previous one, see if maybe the one
                     # before that is actually same as the one we want to start
                     # (glueing)
-                    if len(facts) > 1 and 60 >= (start_time - facts[-2].end_time).seconds >= 0:
-                        before = facts[-2]
+                    before = self.__get_last_fact()
+                    if (before and before.end_time
+                        and 60 >= (start_time - before.end_time).seconds >= 0):
                         if (before.activity_id == activity_id
                             and set(before.tags) == set([tag[1] for tag in tags])
                            ):
@@ -640,7 +1112,10 @@ class Storage(storage.Storage):
                                           SET end_time = null
                                         WHERE id = ?
                             """
+                            # on-going again, out of daily_totals
+                            self.__rollup([before.id], -1)
                             self.execute(update, (before.id,))
+                            self.__journal([before.id], "update")
 
                             return before.id
                 else:
@@ -651,6 +1126,8 @@ class Storage(storage.Storage):
                                 WHERE id = ?
                     """
                     self.execute(update, (start_time, previous.id))
+                    self.__rollup([previous.id], 1)
+                    self.__journal([previous.id], "update")
 
 
         # done with the current activity, now we can solve overlaps
@@ -668,16 +1145,152 @@ class Storage(storage.Storage):
         self.execute(insert, (activity_id, start_time, end_time, fact.description))
 
         fact_id = self.__last_insert_rowid()
+        self.__rollup([fact_id], 1)
+        self.__journal([fact_id], "add")
 
         #now link tags
         insert = ["insert into fact_tags(fact_id, tag_id) values(?, ?)"] * len(tags)
         params = [(fact_id, tag[0]) for tag in tags]
         self.execute(insert, params)
 
-        self.__remove_index([fact_id])
         logger.info("fact successfully added, with id #{}".format(fact_id))
         return fact_id
 
+    def __add_facts(self, facts, on_conflict="skip", batch_size=500):
+        """Add facts in bulk, as they are.
+
+        Names are resolved once per distinct value, and the facts
+        are inserted batch_size at a time, with explicit ids.
+        There is no on-going fact handling (cf. __add_fact).
+
+        Archived facts are left as they are: unless on_conflict is "keep",
+        the facts overlapping them are skipped.
+
+        Args:
+            facts (list of Fact): checked already.
+            on_conflict (str): cf. storage.ADD_FACTS_CONFLICTS.
+        Returns:
+            list of the new fact ids, 0 for the skipped facts.
+        """
+        logger.info("adding {} facts".format(len(facts)))
+
+        tag_ids = {}
+        names = sorted({tag for fact in facts for tag in fact.tags})
+        for i in range(0, len(names), batch_size):
+            tags = self.get_tag_ids(names[i:i + batch_size])
+            tag_ids.update((tag["name"], tag["id"]) for tag in tags)
+
+        category_ids = {}
+        for category in {fact.category for fact in facts}:
+            category_ids[category] = (self.__get_category_id(category)
+                                      or self.__add_category(category))
+
+        activity_ids = {}
+        for key in {(fact.activity, category_ids[fact.category]) for fact in facts}:
+            activity = self.__get_activity_by_name(*key)
+            activity_ids[key] = activity["id"] if activity else self.__add_activity(*key)
+
+        next_id = self.__next_fact_id()
+
+        # overlaps with existing facts. A finished fact overlapping
+        # can not start earlier than the longest one before the new fact,
+        # which bounds the lookup on the start index.
+        # The few on-going facts last until now, they are checked apart.
+        overlap_query = """
+                   SELECT id
+                     FROM facts
+                    WHERE {start} > ? AND {start} < ? AND {end} > ?
+                    LIMIT 1
+        """.format(**self.__time_columns())
+        longest = self.__longest_fact()
+        ongoing_starts = [row["start_time"] for row in
+                          self.fetchall("SELECT start_time FROM facts WHERE end_time IS NULL")]
+        # archived facts are finished, and have no epoch minutes columns
+        archive_query = """
+                   SELECT id
+                     FROM archive.facts
+                    WHERE start_time > ? AND start_time < ? AND end_time > ?
+                    LIMIT 1
+        """
+        archive_end = self.__archive_end
+        archive_longest = self.__longest_fact("archive") if archive_end else None
+
+        fact_rows, tag_rows, ids = [], [], []
+
+        def flush():
+            if not fact_rows:
+                return
+            self.executemany("""INSERT INTO facts (id, activity_id, start_time, end_time, description)
+                                     VALUES (?, ?, ?, ?, ?)""", fact_rows)
+            self.executemany("INSERT INTO fact_tags(fact_id, tag_id) VALUES (?, ?)", tag_rows)
+            self.__rollup([row[0] for row in fact_rows], 1)
+            self.__journal([row[0] for row in fact_rows], "add")
+            del fact_rows[:], tag_rows[:]
+
+        # in chronological order, conflicts within the batch
+        # are found by the latest end so far
+        latest_end = None
+        now = dt.datetime.now()
+        for fact in sorted(facts, key=lambda fact: fact.start_time):
+            start_time, end_time = fact.start_time, fact.end_time
+            if (on_conflict != "keep" and archive_end and start_time < archive_end
+                and self.fetchone(archive_query, (start_time - archive_longest,
+                                                  end_time or now, start_time))):
+                ids.append(0)
+                continue
+            if on_conflict == "skip":
+                # on-going facts last until now
+                params = (start_time - longest, end_time or now, start_time)
+                if ((latest_end and start_time < latest_end)
+                    or any(start < (end_time or now) and start_time < now
+                           for start in ongoing_starts)
+                    or self.fetchone(overlap_query, self.__time_params(params))):
+                    ids.append(0)
+                    continue
+                latest_end = max(latest_end or start_time, end_time or now)
+            elif on_conflict == "solve":
+                # same as __add_fact, including the facts added so far
+                flush()
+                if end_time:
+                    self.__solve_overlaps(start_time, end_time)
+                else:
+                    end_time = self.__squeeze_in(start_time)
+                # splits take new ids
+                next_id = max(next_id, self.__next_fact_id())
+
+            activity_id = activity_ids[(fact.activity, category_ids[fact.category])]
+            fact_rows.append((next_id, activity_id, start_time, end_time, fact.description))
+            tag_rows.extend((next_id, tag_ids[tag]) for tag in set(fact.tags))
+            ids.append(next_id)
+            next_id += 1
+            if len(fact_rows) >= batch_size:
+                flush()
+        flush()
+
+        # back to the given order
+        order = sorted(range(len(facts)), key=lambda i: facts[i].start_time)
+        result = [0] * len(facts)
+        for i, fact_id in zip(order, ids):
+            result[i] = fact_id
+        logger.info("{} facts added".format(len([i for i in ids if i])))
+        return result
+
+    def __longest_fact(self, schema="main"):
+        """Return the duration of the longest finished fact, a minute more.
+
+        Overlapping facts do not start earlier than that before a fact.
+        """
+        row = self.fetchone("""SELECT MAX(julianday(end_time) - julianday(start_time)) AS days
+                                 FROM {}""".format(qualified("facts", schema)))
+        # a minute more, against rounding
+        return dt.timedelta(days=row["days"] or 0, minutes=1)
+
+    def __next_fact_id(self):
+        # ids are never reused (AUTOINCREMENT), archived ones included
+        # (the default database comes with a NULL seq)
+        row = self.fetchone("SELECT seq FROM sqlite_sequence WHERE name = 'facts'")
+        return ((row and row["seq"]) or 0) + 1
+
     def __last_insert_rowid(self):
         return self.fetchone("SELECT last_insert_rowid();")[0] or 0
 
@@ -685,67 +1298,377 @@ class Storage(storage.Storage):
     def __get_todays_facts(self):
         return self.__get_facts(dt.Range.today())
 
+    def __get_last_fact(self):
+        """Return the last of __get_todays_facts, or None.
+
+        Kept until the next write, or the next hamster day,
+        so that starting and stopping do not need all the facts of the day.
+        External changes clear it (cf. __check_data_version).
+        """
+        if not self.__con:
+            # within a transaction, it was checked at the start
+            self.__check_data_version()
+        key = (self.__writes, dt.hday.today())
+        if key != self.__last_fact_key:
+            conditions, params = self.__facts_conditions(dt.Range.today())
+            query = """
+                       SELECT {columns}
+                         FROM facts a
+                    LEFT JOIN activities b ON a.activity_id = b.id
+                    LEFT JOIN categories c ON b.category_id = c.id
+                        WHERE {conditions}
+                     ORDER BY a.{start} DESC, a.id DESC
+                        LIMIT 1
+            """.format(columns=FACT_COLUMNS, conditions=conditions,
+                       **self.__time_columns())
+            row = self.fetchone(query, (self._unsorted_localized, ) + params)
+            self.__last_fact = self._dbfact_to_libfact(row) if row else None
+            self.__last_fact_key = key
+        return self.__last_fact
+
     def __get_facts(self, range, search_terms=""):
+        query, params = self.__facts_query(range, search_terms)
+        fact_rows = self.fetchall_snapshot(query, params)
+        return [self._dbfact_to_libfact(row) for row in fact_rows]
+
+    def __iter_facts(self, range, search_terms="", batch_size=500):
+        query, params = self.__facts_query(range, search_terms)
+        logger.debug("%s %s", query, params)
+        if self.__in_writer():
+            self.__check_data_version()
+        # the snapshot lasts until the cursor is done
+        con = self.__transaction_connection() or self.read_connection
+        cur = con.cursor()
+        try:
+            if self.__stats:
+                # the rows are fetched later on
+                self.__stats.run(con, query, params, lambda: cur.execute(query, params))
+            else:
+                cur.execute(query, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self._dbfact_to_libfact(row)
+        finally:
+            cur.close()
+
+    def __get_facts_page(self, range, search_terms, after, limit):
+        query, params = self.__facts_query(range, search_terms, after, limit)
+        fact_rows = self.fetchall_snapshot(query, params)
+        return [self._dbfact_to_libfact(row) for row in fact_rows]
+
+    def __facts_query(self, range, search_terms="", after=None, limit=None):
+        """Return the facts query and its parameters.
+
+        after: (start_time, id) of a fact, to get only the facts
+               coming after it in the query order (keyset pagination,
+               the lower bound keeps the lookup on the start index).
+        limit: maximum number of facts, None for all.
+        """
+        parts, params = [], ()
+        for schema in self.__schemas(range):
+            conditions, schema_params = self.__facts_conditions(range, search_terms, schema)
+            if after:
+                after_start, after_id = after
+                if schema == "main":
+                    start = self.__time_columns()["start"]
+                    schema_params += self.__time_params((after_start, after_start))
+                else:
+                    start = "start_time"
+                    schema_params += (after_start, after_start)
+                conditions += """
+                    AND a.{start} >= ? AND (a.{start} > ? OR a.id > ?)
+                """.format(start=start)
+                schema_params += (after_id, )
+            parts.append("""
+                   SELECT {columns}
+                     FROM {facts} a
+                LEFT JOIN activities b ON a.activity_id = b.id
+                LEFT JOIN categories c ON b.category_id = c.id
+                    WHERE {conditions}
+            """.format(columns=fact_columns(schema), facts=qualified("facts", schema),
+                       conditions=conditions))
+            params += (self._unsorted_localized, ) + schema_params
+        if len(parts) == 1:
+            order = " ORDER BY a.{start}, a.id".format(**self.__time_columns())
+        else:
+            # compound select, ordered by result columns
+            order = " ORDER BY start_time, id"
+        if limit is not None:
+            order += " LIMIT ?"
+            params += (limit, )
+        return " UNION ALL ".join(parts) + order, params
+
+    def __schemas(self, range):
+        """Return the databases holding facts for the range."""
+        if self.__archive_end and range.start <= self.__archive_end:
+            return ("main", "archive")
+        return ("main", )
+
+    def __facts_conditions(self, range, search_terms="", schema="main"):
+        """Return the WHERE conditions on facts (a) and their parameters."""
         datetime_from = range.start
         datetime_to = range.end
 
         logger.info("searching for facts from {} to {}".format(datetime_from, datetime_to))
 
-        query = """
-                   SELECT a.id AS id,
-                          a.start_time AS start_time,
-                          a.end_time AS end_time,
-                          a.description as description,
-                          b.name AS name, b.id as activity_id,
-                          coalesce(c.name, ?) as category,
-                          e.name as tag
-                     FROM facts a
-                LEFT JOIN activities b ON a.activity_id = b.id
-                LEFT JOIN categories c ON b.category_id = c.id
-                LEFT JOIN fact_tags d ON d.fact_id = a.id
-                LEFT JOIN tags e ON e.id = d.tag_id
-                    WHERE (a.end_time >= ? OR a.end_time IS NULL) AND a.start_time <= ?
-        """
+        # ignore old on-going facts.
+        # Bounding start_time on both sides keeps the lookup
+        # on the idx_facts_start index.
+        earliest_start = datetime_from - dt.timedelta(days=30)
 
-        if search_terms:
-            # check if we need changes to the index
-            self.__check_index(datetime_from, datetime_to)
+        if schema == "main":
+            time_columns = self.__time_columns()
+            params = self.__time_params((earliest_start, datetime_to, datetime_from))
+        else:
+            # archived facts are finished, and have no epoch minutes columns
+            time_columns = {"start": "start_time", "end": "end_time"}
+            params = (earliest_start, datetime_to, datetime_from)
+
+        conditions = """
+                    a.{start} >= ? AND a.{start} <= ?
+                    AND (a.{end} >= ? OR a.{end} IS NULL)
+        """.format(**time_columns)
 
+        if search_terms:
             # flip the query around when it starts with "not "
             reverse_search_terms = search_terms.lower().startswith("not ")
             if reverse_search_terms:
                 search_terms = search_terms[4:]
 
-            search_terms = search_terms.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_').replace("'", "''")
-            query += """ AND a.id %s IN (SELECT id
-                                         FROM fact_index
-                                         WHERE fact_index MATCH '%s')""" % ('NOT' if reverse_search_terms else '',
-                                                                            search_terms)
+            match = fts_query(search_terms)
+            if match:
+                if schema == "main":
+                    index = "fact_index"
+                else:
+                    index = "temp.archive_index"
+                    self.__index_archive(conditions, params)
+                conditions += """ AND a.id %s IN (SELECT rowid
+                                                  FROM %s
+                                                  WHERE %s MATCH ?)""" % ('NOT' if reverse_search_terms else '',
+                                                                          index, index.split(".")[-1])
+                params += (match, )
+
+        return conditions, params
+
+    def __index_archive(self, conditions, params):
+        """Fill the temporary archive search index with the matching archived facts.
+
+        Archive searches are rare, and restricted to a range,
+        so indexing on the fly keeps the names current for free.
+        The temp schema belongs to the connection that runs the search,
+        the read-only one outside of transactions.
+        """
+        transaction = self.__transaction_connection()
+        con = transaction or self.read_connection
+        statements = [
+            """CREATE VIRTUAL TABLE IF NOT EXISTS temp.archive_index
+                                  USING fts5(name, category, description, tag)""",
+            "DELETE FROM temp.archive_index",
+            """INSERT INTO temp.archive_index(rowid, name, category, description, tag)
+                    SELECT a.id, b.name, c.name, a.description,
+                           (SELECT group_concat(e.name, ' ')
+                              FROM archive.fact_tags d
+                              JOIN tags e ON e.id = d.tag_id
+                             WHERE d.fact_id = a.id)
+                      FROM archive.facts a
+                 LEFT JOIN activities b ON a.activity_id = b.id
+                 LEFT JOIN categories c ON b.category_id = c.id
+                     WHERE {}""".format(conditions),
+        ]
+        for statement, statement_params in zip(statements, [(), (), params]):
+            self.__fetchall(con, statement, statement_params)
+        if not transaction:
+            # do not keep the snapshot
+            con.commit()
 
-        query += " ORDER BY a.start_time, e.name"
+    def __all_facts(self):
+        """Return the facts table, joined with the archived facts if any."""
+        if not self.__archive_end:
+            return "facts"
+        return """(SELECT id, activity_id, start_time, end_time FROM facts
+                   UNION ALL
+                   SELECT id, activity_id, start_time, end_time FROM archive.facts)"""
+
+    def __all_fact_tags(self):
+        """Return the fact_tags table, joined with the archived ones if any."""
+        if not self.__archive_end:
+            return "fact_tags"
+        return """(SELECT fact_id, tag_id FROM fact_tags
+                   UNION ALL
+                   SELECT fact_id, tag_id FROM archive.fact_tags)"""
+
+    def __archive_facts(self, before):
+        """Move the facts that ended before `before` to the archive database.
+
+        The archive is attached as a separate file, so that the main
+        database stays small. Both are not committed atomically:
+        facts are copied first, then removed from the main database,
+        so that an interruption leaves duplicates (fixed by archiving again)
+        rather than losing facts.
+        daily_totals are left untouched, they still count archived facts.
 
-        fact_rows = self.fetchall(query, (self._unsorted_localized,
-                                          datetime_from,
-                                          datetime_to))
-        #first let's put all tags in an array
-        dbfacts = self.__group_tags(fact_rows)
-        # ignore old on-going facts
-        return [self._dbfact_to_libfact(dbfact) for dbfact in dbfacts
-                if dbfact["start_time"] >= datetime_from - dt.timedelta(days=30)]
+        Returns:
+            int: number of archived facts.
+        """
+        if not self.__archive_attached():
+            # ATTACH is not allowed within a transaction
+            self.__attach_archive(self.connection)
+            # reopened with the archive when needed
+            self.__readers_generation += 1
+
+        archived = "SELECT id FROM facts WHERE end_time IS NOT NULL AND end_time < ?"
+        count = self.fetchone("SELECT count(*) AS count FROM (%s)" % archived,
+                              (before, ))["count"]
+        if not count:
+            return 0
+        logger.info("archiving {} facts ended before {}".format(count, before))
+        activity_ids = [row["activity_id"] for row in self.fetchall(
+            "SELECT DISTINCT activity_id FROM facts WHERE id IN (%s)" % archived, (before, ))]
+        tag_ids = [row["tag_id"] for row in self.fetchall(
+            "SELECT DISTINCT tag_id FROM fact_tags WHERE fact_id IN (%s)" % archived, (before, ))]
+
+        self.execute([
+            """INSERT OR REPLACE INTO archive.facts (id, activity_id, start_time, end_time, description)
+                    SELECT id, activity_id, start_time, end_time, description
+                      FROM facts WHERE id IN (%s)""" % archived,
+            "DELETE FROM archive.fact_tags WHERE fact_id IN (%s)" % archived,
+            """INSERT INTO archive.fact_tags (fact_id, tag_id)
+                    SELECT fact_id, tag_id
+                      FROM fact_tags WHERE fact_id IN (%s)""" % archived,
+        ], [(before, )] * 3)
+        self.execute(["DELETE FROM fact_tags WHERE fact_id IN (%s)" % archived,
+                      "DELETE FROM facts WHERE id IN (%s)" % archived],
+                     [(before, )] * 2)
+        self.__update_archive_end()
+        # the usage triggers took the archived facts out
+        self.__update_activity_usage(activity_ids)
+        self.__update_tag_usage(tag_ids)
+        return count
+
+    def __archive_attached(self):
+        databases = self.fetchall("PRAGMA database_list")
+        return any(row["name"] == "archive" for row in databases)
+
+    def __attach_archive(self, con):
+        """Attach the archive database, creating it if needed."""
+        logger.info("archive: '{}'".format(self.archive_path))
+        con.execute("ATTACH DATABASE ? AS archive", (self.archive_path, ))
+        for statement in ARCHIVE_SCHEMA:
+            con.execute(statement)
+        con.commit()
+        self.__update_archive_end()
+
+    def __update_archive_end(self):
+        # max() would lose the column type, hence the timestamp conversion
+        row = self.fetchone("SELECT end_time FROM archive.facts ORDER BY end_time DESC LIMIT 1")
+        self.__archive_end = row["end_time"] if row else None
+
+    def __get_totals(self, range, group_by, search_terms=""):
+        # hamster day of the fact start
+        day_start = conf.day_start
+        day = "date(a.start_time, '-{} minutes'".format(day_start.hour * 60 + day_start.minute)
+        keys = {
+            "day": day + ")",
+            "week": day + ", '-6 days', 'weekday 1')",
+            "month": day + ", 'start of month')",
+            "category": "coalesce(c.name, ?)",
+            "activity": "b.name",
+            "tag": "e.name",
+        }
+        key_params = (self._unsorted_localized, ) if group_by == "category" else ()
+
+        if group_by in ("day", "week", "month"):
+            order = "key"
+        else:
+            order = "minutes DESC, key"
+
+        # on-going facts last until now
+        now = dt.datetime.now()
+
+        schemas = self.__schemas(range)
+        # with a single database, aggregate straight from facts,
+        # a subquery would hide the indexes
+        single = len(schemas) == 1
+        parts, params = [], ()
+        for schema in schemas:
+            conditions, schema_params = self.__facts_conditions(range, search_terms, schema)
+
+            tag_join = ""
+            if group_by == "tag":
+                tag_join = """
+                         JOIN {} d ON d.fact_id = a.id
+                         JOIN tags e ON e.id = d.tag_id
+                """.format(qualified("fact_tags", schema))
+
+            if schema == "main" and self.__has_epoch_minutes:
+                minutes = "coalesce(a.end_minute, ?) - a.start_minute"
+                now_param = to_epoch_minutes(now)
+            else:
+                minutes = """CAST(round((julianday(coalesce(a.end_time, ?))
+                                         - julianday(a.start_time)) * 1440) AS INTEGER)"""
+                now_param = now
+            if single:
+                minutes = "sum({})".format(minutes)
+
+            parts.append("""
+                   SELECT {key} AS key, {minutes} AS minutes
+                     FROM {facts} a
+                LEFT JOIN activities b ON a.activity_id = b.id
+                LEFT JOIN categories c ON b.category_id = c.id
+                {tag_join}
+                    WHERE {conditions}
+            """.format(key=keys[group_by], minutes=minutes, facts=qualified("facts", schema),
+                       tag_join=tag_join, conditions=conditions))
+            params += key_params + (now_param, ) + schema_params
+
+        if single:
+            query = parts[0] + " GROUP BY 1 ORDER BY {}".format(order)
+        else:
+            query = """
+                   SELECT key, sum(minutes) AS minutes
+                     FROM ({})
+                 GROUP BY key
+                 ORDER BY {}
+            """.format(" UNION ALL ".join(parts), order)
+
+        rows = self.fetchall_snapshot(query, params)
+        totals = []
+        for row in rows:
+            key = row["key"]
+            if order == "key":
+                key = dt.date(*(int(part) for part in key.split("-")))
+            totals.append((key, dt.timedelta(minutes=row["minutes"])))
+        return totals
 
     def __remove_fact(self, fact_id):
         logger.info("removing fact #{}".format(fact_id))
+        self.__rollup([fact_id], -1)
+        self.__journal([fact_id], "remove")
         statements = ["DELETE FROM fact_tags where fact_id = ?",
                       "DELETE FROM facts where id = ?"]
-        self.execute(statements, [(fact_id,)] * 2)
-
-        self.__remove_index([fact_id])
+        archived, archived_tags = None, []
+        if self.__archive_end:
+            archived = self.fetchone("SELECT activity_id FROM archive.facts WHERE id = ?",
+                                     (fact_id, ))
+            archived_tags = [row["tag_id"] for row in self.fetchall(
+                "SELECT tag_id FROM archive.fact_tags WHERE fact_id = ?", (fact_id, ))]
+            statements += ["DELETE FROM archive.fact_tags where fact_id = ?",
+                           "DELETE FROM archive.facts where id = ?"]
+        self.execute(statements, [(fact_id,)] * len(statements))
+        if archived:
+            # the usage triggers do not see the archive
+            self.__update_activity_usage([archived["activity_id"]])
+            self.__update_tag_usage(archived_tags)
 
     def __get_category_activities(self, category_id):
         """returns list of activities, if category is specified, order by name
            otherwise - by activity_order"""
         query = """
-                   SELECT a.id, a.name, a.category_id, b.name as category
+                   SELECT a.id, a.name, a.category_id, b.name as category,
+                          a.use_count, a.total_minutes, a.last_used
                      FROM activities a
                 LEFT JOIN categories b on coalesce(b.id, -1) = a.category_id
                     WHERE category_id = ?
@@ -753,7 +1676,7 @@ class Storage(storage.Storage):
                  ORDER BY lower(a.name)
         """
 
-        return self.fetchall(query, (category_id, ))
+        return self.fetchall_snapshot(query, (category_id, ))
 
 
     def __get_activities(self, search):
@@ -764,16 +1687,14 @@ class Storage(storage.Storage):
                    SELECT a.name AS name, b.name AS category
                      FROM activities a
                 LEFT JOIN categories b ON coalesce(b.id, -1) = a.category_id
-                LEFT JOIN facts f ON a.id = f.activity_id
-                    WHERE deleted IS NULL
+                    WHERE a.deleted IS NULL
                       AND a.search_name LIKE ? ESCAPE '\\'
-                 GROUP BY a.id
-                 ORDER BY max(f.start_time) DESC, lower(a.name)
+                 ORDER BY a.last_used DESC, lower(a.name)
                     LIMIT 50
         """
         search = search.lower()
         search = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
-        activities = self.fetchall(query, ('%s%%' % search, ))
+        activities = self.fetchall_snapshot(query, ('%s%%' % search, ))
 
         return activities
 
@@ -782,31 +1703,25 @@ class Storage(storage.Storage):
             if there are facts - sets activity to deleted = True
             else, just remove it"""
 
-        query = "select count(*) as count from facts where activity_id = ?"
+        query = "select count(*) as count from %s where activity_id = ?" % self.__all_facts()
         bound_facts = self.fetchone(query, (id,))['count']
 
         if bound_facts > 0:
             self.execute("UPDATE activities SET deleted = 1 WHERE id = ?", (id,))
         else:
             self.execute("delete from activities where id = ?", (id,))
+        self.__activities.clear()
 
 
     def __remove_category(self, id):
         """move all activities to unsorted and remove category"""
 
-        affected_query = """
-            SELECT id
-              FROM facts
-             WHERE activity_id in (SELECT id FROM activities where category_id=?)
-        """
-        affected_ids = [res[0] for res in self.fetchall(affected_query, (id,))]
-
         update = "update activities set category_id = -1 where category_id = ?"
         self.execute(update, (id, ))
 
         self.execute("delete from categories where id = ?", (id, ))
-
-        self.__remove_index(affected_ids)
+        self.__category_ids.clear()
+        self.__activities.clear()
 
 
     def __add_activity(self, name, category_id = None, temporary = False):
@@ -828,63 +1743,452 @@ class Storage(storage.Storage):
                         VALUES (?, ?, ?, ?)
         """
         self.execute(query, (name, name.lower(), category_id, deleted))
+        self.__activities.clear()
         return self.__last_insert_rowid()
 
-    def __remove_index(self, ids):
-        """remove affected ids from the index"""
-        if not ids:
+    def __journal(self, fact_ids, op):
+        """Record changes of facts, cf. __get_changes_since.
+
+        op is "add" or "update", after the change, or "remove", before it,
+        so that the recorded range is where the fact is, or was.
+        """
+        if not fact_ids:
             return
-        ids = ",".join((str(id) for id in ids))
-        logger.info("removing fact #{} from index".format(ids))
-        self.execute("DELETE FROM fact_index where id in (%s)" % ids)
+        self.execute("""INSERT INTO changes (fact_id, op, range_start, range_end)
+                             SELECT id, ?, start_time, end_time
+                               FROM {}
+                              WHERE id IN ({})
+                     """.format(self.__all_facts(), ",".join("?" * len(fact_ids))),
+                     (op, ) + tuple(fact_ids))
+        if self.__last_insert_rowid() - self.__compacted_revision >= JOURNAL_COMPACT_EVERY:
+            self.__compact_journal()
+
+    def __compact_journal(self):
+        """Keep the latest change of each fact, and at most JOURNAL_SIZE changes."""
+        statements = ["""DELETE FROM changes
+                          WHERE revision < (SELECT max(revision)
+                                              FROM changes c
+                                             WHERE c.fact_id = changes.fact_id)"""]
+        params = [()]
+        row = self.fetchone("SELECT revision FROM changes ORDER BY revision DESC LIMIT 1 OFFSET ?",
+                            (JOURNAL_SIZE, ))
+        if row:
+            # the changes up to there are gone
+            statements += ["DELETE FROM changes WHERE revision <= ?",
+                           "UPDATE changes_floor SET revision = max(revision, ?)"]
+            params += [(row["revision"], ), (row["revision"], )]
+        self.execute(statements, params)
+        self.__compacted_revision = self.__get_revision()
+
+    def __get_revision(self):
+        # the AUTOINCREMENT sequence survives compaction
+        row = self.fetchone("SELECT seq FROM sqlite_sequence WHERE name = 'changes'")
+        return row["seq"] if row else 0
+
+    def __get_changes_since(self, revision):
+        latest = self.__get_revision()
+        floor = self.fetchone("SELECT revision FROM changes_floor")["revision"]
+        if not floor <= revision <= latest:
+            return latest, None
+        query = """
+                   SELECT revision, fact_id, op, range_start, range_end
+                     FROM changes
+                    WHERE revision > ?
+                      AND revision = (SELECT max(revision)
+                                        FROM changes c
+                                       WHERE c.fact_id = changes.fact_id)
+                 ORDER BY revision
+        """
+        changes = [tuple(row) for row in self.fetchall(query, (revision, ))]
+        return latest, changes
 
+    def __forget_changes(self):
+        """Mark the journal as incomplete, e.g. after an external change.
 
-    def __check_index(self, start_date, end_date):
-        """check if maybe index needs rebuilding in the time span"""
-        index_query = """SELECT id
-                           FROM facts
-                          WHERE (end_time >= ? OR end_time IS NULL)
-                            AND start_time <= ?
-                            AND id not in(select id from fact_index)"""
+        Takes a new revision, so that the clients notice.
+        """
+        self.execute(["INSERT INTO changes (fact_id, op) VALUES (0, 'reset')",
+                      "UPDATE changes_floor SET revision = last_insert_rowid()"],
+                     [(), ()])
 
-        rebuild_ids = ",".join([str(res[0]) for res in self.fetchall(index_query, (start_date, end_date))])
+    def __rebuild_index(self):
+        """Rebuild the full text search index from scratch.
 
-        if rebuild_ids:
-            query = """
-                       SELECT a.id AS id,
-                              a.start_time AS start_time,
-                              a.end_time AS end_time,
-                              a.description as description,
-                              b.name AS name, b.id as activity_id,
-                              coalesce(c.name, ?) as category,
-                              e.name as tag
-                         FROM facts a
-                    LEFT JOIN activities b ON a.activity_id = b.id
-                    LEFT JOIN categories c ON b.category_id = c.id
-                    LEFT JOIN fact_tags d ON d.fact_id = a.id
-                    LEFT JOIN tags e ON e.id = d.tag_id
-                        WHERE a.id in (%s)
-                     ORDER BY a.id
-            """ % rebuild_ids
+        Triggers keep the index current, this is only needed
+        if the database was modified by an older hamster version.
+        """
+        logger.info("rebuilding the full text search index")
+        self.execute("INSERT INTO fact_index(fact_index) VALUES('rebuild')")
+
+    def __maintenance_steps(self, full=False):
+        """Generator running the maintenance tasks, one small step per next().
+
+        Yields (task name, step duration in seconds).
+        The time spent on each task is logged once it is done.
+        full runs each task completely in one step instead (e.g. a whole
+        ANALYZE rather than PRAGMA optimize), and turns the incremental
+        vacuum on if needed, which takes a full VACUUM once.
+        """
+        tasks = [("statistics", self.__maintain_statistics),
+                 ("search index", self.__maintain_index),
+                 ("journal", self.__maintain_journal),
+                 ("vacuum", self.__maintain_vacuum)]
+        for name, task in tasks:
+            total = 0
+            start = time.monotonic()
+            for __ in task(full):
+                elapsed = time.monotonic() - start
+                total += elapsed
+                yield name, elapsed
+                start = time.monotonic()
+            total += time.monotonic() - start
+            logger.info("maintenance: {} done in {:.3f}s".format(name, total))
+
+    def __maintain_statistics(self, full):
+        # the query planner statistics (sqlite_stat1)
+        self.execute("ANALYZE" if full else "PRAGMA optimize")
+        yield
+
+    def __maintain_index(self, full):
+        if full:
+            self.execute("INSERT INTO fact_index(fact_index) VALUES('optimize')")
+            yield
+            return
+        # merge until there is nothing left to merge,
+        # i.e. a merge changes less than 2 rows (cf. fts5 documentation)
+        con = self.connection
+        while True:
+            changes = con.total_changes
+            self.execute("INSERT INTO fact_index(fact_index, rank) VALUES('merge', ?)",
+                         (MAINTENANCE_MERGE_PAGES, ))
+            yield
+            if con.total_changes - changes < 2:
+                return
+
+    def __maintain_journal(self, full):
+        self.__compact_journal()
+        yield
+
+    def __maintain_vacuum(self, full):
+        # auto_vacuum: 0 NONE, 1 FULL, 2 INCREMENTAL
+        auto_vacuum = self.fetchone("PRAGMA auto_vacuum")[0]
+        if auto_vacuum != 2:
+            if full:
+                # switching the mode needs a VACUUM, outside of any transaction
+                logger.info("maintenance: switching to incremental vacuum")
+                self.execute(["PRAGMA auto_vacuum = INCREMENTAL", "VACUUM"], [(), ()])
+                yield
+            return
+        free_pages = self.fetchone("PRAGMA freelist_count")[0]
+        con = self.connection
+        script = "PRAGMA incremental_vacuum({:d})".format(0 if full else MAINTENANCE_VACUUM_PAGES)
+        while free_pages:
+            # frees one page per step of the statement, and the sqlite3 module
+            # only steps once through statements that return no rows,
+            # even when they are fetched or iterated over
+            logger.debug(script)
+            if self.__stats:
+                self.__stats.run(con, script, (), lambda: con.executescript(script))
+            else:
+                con.executescript(script)
+            yield
+            previous, free_pages = free_pages, self.fetchone("PRAGMA freelist_count")[0]
+            if free_pages >= previous:
+                return
+
+    def __time_columns(self):
+        """Names of the facts columns to be used in time comparisons.
+
+        To be used with str.format, as {start} and {end}.
+        """
+        if self.__has_epoch_minutes:
+            return {"start": "start_minute", "end": "end_minute"}
+        else:
+            return {"start": "start_time", "end": "end_time"}
+
+    def __time_params(self, params):
+        """Convert datetimes to the type of the __time_columns columns."""
+        if self.__has_epoch_minutes:
+            return tuple(to_epoch_minutes(t) for t in params)
+        else:
+            return tuple(params)
+
+    def __check_daily_totals(self):
+        """Rebuild daily_totals if the day start setting changed.
 
-            dbfacts = self.__group_tags(self.fetchall(query, (self._unsorted_localized, )))
-            facts = [self._dbfact_to_libfact(dbfact) for dbfact in dbfacts]
+        Return whether a rebuild was needed.
+        """
+        day_start = conf.get("day-start-minutes")
+        if self.__daily_totals_day_start is None:
+            row = self.fetchone("SELECT minutes FROM daily_totals_day_start")
+            self.__daily_totals_day_start = row["minutes"] if row else -1
+        if self.__daily_totals_day_start == day_start:
+            return False
+        self.__rebuild_daily_totals()
+        return True
+
+    def __rebuild_daily_totals(self):
+        """Compute daily_totals from scratch."""
+        logger.info("rebuilding daily totals")
+        day_start = conf.get("day-start-minutes")
+        query = """
+                   SELECT activity_id, start_time, end_time
+                     FROM %s
+                    WHERE end_time IS NOT NULL
+        """ % self.__all_facts()
+        totals = {}
+        for fact in self.fetchall(query):
+            for day, minutes in split_days(fact["start_time"], fact["end_time"], day_start):
+                key = (day.isoformat(), fact["activity_id"])
+                totals[key] = totals.get(key, 0) + minutes
+
+        rows = [key + (minutes, ) for key, minutes in totals.items() if minutes]
+        statements = ["DELETE FROM daily_totals",
+                      "DELETE FROM daily_totals_day_start",
+                      "INSERT INTO daily_totals_day_start (minutes) VALUES (?)"]
+        statements += ["INSERT INTO daily_totals (hday, activity_id, minutes) VALUES (?, ?, ?)"] * len(rows)
+        self.execute(statements, [(), (), (day_start, )] + rows)
+        self.__daily_totals_day_start = day_start
+
+    def __update_activity_usage(self, activity_ids=None):
+        """Compute the activities usage columns from the facts, archive included.
+
+        The triggers keep them current otherwise (cf. activity_usage_triggers).
+        Args:
+            activity_ids (list): activities to update, None for all.
+        """
+        where, params = "", ()
+        if activity_ids is not None:
+            if not activity_ids:
+                return
+            where = "WHERE id IN ({})".format(",".join("?" * len(activity_ids)))
+            params = tuple(activity_ids)
+        usage = "(SELECT {} FROM %s f WHERE f.activity_id = activities.id)" % self.__all_facts()
+        self.execute("""UPDATE activities
+                           SET use_count = {count},
+                               total_minutes = {minutes},
+                               last_used = {last_used}
+                         {where}""".format(count=usage.format("count(*)"),
+                                           minutes=usage.format("coalesce(sum({}), 0)"
+                                                                .format(fact_minutes("f"))),
+                                           last_used=usage.format("max(f.start_time)"),
+                                           where=where),
+                     params)
+
+    def __update_tag_usage(self, tag_ids=None):
+        """Compute tags.use_count from fact_tags, archive included.
+
+        Args:
+            tag_ids (list): tags to update, None for all.
+        """
+        where, params = "", ()
+        if tag_ids is not None:
+            if not tag_ids:
+                return
+            where = "WHERE id IN ({})".format(",".join("?" * len(tag_ids)))
+            params = tuple(tag_ids)
+        self.execute("""UPDATE tags
+                           SET use_count = (SELECT count(*)
+                                              FROM {} f
+                                             WHERE f.tag_id = tags.id)
+                         {}""".format(self.__all_fact_tags(), where),
+                     params)
+
+    def __rollup(self, fact_ids, sign):
+        """Add (sign=1) or remove (sign=-1) facts from daily_totals.
+
+        Removal must happen before the facts change, and addition after,
+        so that daily_totals always match the facts table.
+        On-going facts are left out (cf. __get_daily_totals).
+        """
+        if self.__check_daily_totals() and sign > 0:
+            # just rebuilt from the facts, as they are after the change
+            return
+
+        query = """
+                   SELECT activity_id, start_time, end_time
+                     FROM {}
+                    WHERE id IN ({}) AND end_time IS NOT NULL
+        """.format(self.__all_facts(), ",".join("?" * len(fact_ids)))
+        totals = {}
+        for fact in self.fetchall(query, fact_ids):
+            for day, minutes in split_days(fact["start_time"], fact["end_time"],
+                                           self.__daily_totals_day_start):
+                key = (day.isoformat(), fact["activity_id"])
+                totals[key] = totals.get(key, 0) + sign * minutes
+        if not totals:
+            return
 
-            insert = """INSERT INTO fact_index (id, name, category, description, tag)
-                             VALUES (?, ?, ?, ?, ?)"""
-            params = [(fact.id, fact.activity, fact.category, fact.description, " ".join(fact.tags)) for fact in facts]
+        upsert = """
+                    INSERT INTO daily_totals (hday, activity_id, minutes)
+                         VALUES (?, ?, ?)
+                    ON CONFLICT (hday, activity_id)
+                      DO UPDATE SET minutes = minutes + excluded.minutes
+        """
+        cleanup = "DELETE FROM daily_totals WHERE hday = ? AND activity_id = ? AND minutes = 0"
+        self.execute([upsert, cleanup] * len(totals),
+                     [param for key, minutes in totals.items()
+                      for param in (key + (minutes, ), key)])
+
+    def __merge_daily_totals(self, activity_id, target_id):
+        """Move the daily_totals of activity_id to target_id."""
+        self.__check_daily_totals()
+        statements = ["""
+                         INSERT INTO daily_totals (hday, activity_id, minutes)
+                              SELECT hday, ?, minutes
+                                FROM daily_totals
+                               WHERE activity_id = ?
+                         ON CONFLICT (hday, activity_id)
+                           DO UPDATE SET minutes = minutes + excluded.minutes
+                      """,
+                      "DELETE FROM daily_totals WHERE activity_id = ?"]
+        self.execute(statements, [(target_id, activity_id), (activity_id, )])
+
+    def __get_daily_totals(self, range):
+        first_day = range.start.hday()
+        # range ends are included, except for the next day start
+        last_day = (range.end - dt.timedelta(minutes=1)).hday()
+        self.__check_daily_totals()
 
-            self.executemany(insert, params)
+        query = """
+                   SELECT t.hday AS hday, t.activity_id AS activity_id,
+                          b.name AS name, coalesce(c.name, ?) AS category,
+                          t.minutes AS minutes
+                     FROM daily_totals t
+                     JOIN activities b ON b.id = t.activity_id
+                LEFT JOIN categories c ON c.id = b.category_id
+                    WHERE t.hday >= ? AND t.hday <= ?
+        """
+        rows = self.fetchall_snapshot(query, (self._unsorted_localized,
+                                              first_day.isoformat(), last_day.isoformat()))
+        totals = {}
+        for row in rows:
+            totals[(row["hday"], row["activity_id"])] = [row["name"], row["category"],
+                                                         row["minutes"]]
+
+        # on-going facts, until now
+        query = """
+                   SELECT a.activity_id AS activity_id, a.start_time AS start_time,
+                          b.name AS name, coalesce(c.name, ?) AS category
+                     FROM facts a
+                     JOIN activities b ON b.id = a.activity_id
+                LEFT JOIN categories c ON c.id = b.category_id
+                    WHERE a.end_time IS NULL AND a.start_time <= ?
+        """
+        ongoing = self.fetchall_snapshot(query, (self._unsorted_localized, range.end))
+        now = dt.datetime.now()
+        for fact in ongoing:
+            for day, minutes in split_days(fact["start_time"], now,
+                                           self.__daily_totals_day_start):
+                if first_day <= day <= last_day:
+                    key = (day.isoformat(), fact["activity_id"])
+                    total = totals.setdefault(key, [fact["name"], fact["category"], 0])
+                    total[2] += minutes
+
+        return [(dt.hday(*(int(part) for part in day.split("-"))),
+                 name, category, dt.timedelta(minutes=minutes))
+                for (day, __), (name, category, minutes)
+                in sorted(totals.items(), key=lambda item: (item[0][0], item[1][0]))]
+
+    def __add_epoch_minutes(self):
+        """Add integer copies of the facts start_time and end_time.
+
+        Minutes since epoch (of the local naive datetimes) compare and
+        subtract as plain integers, without any datetime conversion.
+        The text columns stay the reference, and triggers keep the
+        integer ones in sync, even if the file is written to by an
+        older hamster version.
+        """
+        logger.info("adding epoch minutes columns to facts")
+        minutes = "CAST(strftime('%s', {}) AS INTEGER) / 60"
+        set_minutes = "start_minute = {}, end_minute = {}".format(
+            minutes.format("start_time"), minutes.format("end_time"))
+        new_minutes = "start_minute = {}, end_minute = {}".format(
+            minutes.format("NEW.start_time"), minutes.format("NEW.end_time"))
+        self.execute("ALTER TABLE facts ADD COLUMN start_minute integer")
+        self.execute("ALTER TABLE facts ADD COLUMN end_minute integer")
+        self.execute("UPDATE facts SET {}".format(set_minutes))
+        self.execute("CREATE INDEX idx_facts_start_minute ON facts(start_minute, end_minute)")
+        self.execute("CREATE INDEX idx_facts_end_minute ON facts(end_minute, start_minute)")
+        for name, event in (("insert", "INSERT"),
+                            ("update", "UPDATE OF start_time, end_time")):
+            self.execute("""
+                CREATE TRIGGER facts_epoch_minutes_{name} AFTER {event} ON facts
+                BEGIN
+                    UPDATE facts SET {minutes} WHERE id = NEW.id;
+                END""".format(name=name, event=event, minutes=new_minutes))
 
     """ Here be dragons (lame connection/cursor wrappers) """
     def get_connection(self):
         if self.con is None:
-            self.con = sqlite.connect(self.db_path, detect_types=sqlite.PARSE_DECLTYPES|sqlite.PARSE_COLNAMES)
+            # opened by one thread, and maybe used by the writer thread after
+            self.con = sqlite.connect(self.db_path, check_same_thread=False,
+                                      detect_types=sqlite.PARSE_DECLTYPES|sqlite.PARSE_COLNAMES)
             self.con.row_factory = sqlite.Row
+            self.__data_version = None
+            self.__apply_pragmas(self.con)
+            if os.path.exists(self.archive_path):
+                self.__attach_archive(self.con)
 
         return self.con
 
+    def get_read_connection(self):
+        """Return the read-only connection of the calling thread."""
+        readers = self.__readers
+        if getattr(readers, "generation", None) != self.__readers_generation:
+            # in WAL mode, its reads see the last commit before they started,
+            # and neither block the writes of the main connection nor wait for them
+            con = sqlite.connect("file:{}?mode=ro".format(quote(self.db_path)),
+                                 uri=True,
+                                 detect_types=sqlite.PARSE_DECLTYPES|sqlite.PARSE_COLNAMES)
+            con.row_factory = sqlite.Row
+            self.__apply_pragmas(con, read_only=True)
+            if os.path.exists(self.archive_path):
+                con.execute("ATTACH DATABASE ? AS archive",
+                            ("file:{}?mode=ro".format(quote(self.archive_path)), ))
+            readers.con, readers.generation = con, self.__readers_generation
+        return readers.con
+
+    def call_in_writer(self, func, *args):
+        """Call func(*args) on the thread allowed to write.
+
+        Used for the file monitoring callbacks. Called right away here,
+        to be overridden along with writer_thread.
+        """
+        func(*args)
+
+    def __in_writer(self):
+        return self.writer_thread is None or threading.get_ident() == self.writer_thread
+
+    def __transaction_connection(self):
+        """Return the connection of the running transaction, if any.
+
+        Transactions belong to the writer thread.
+        """
+        if self.__in_writer():
+            return self.__con
+        return None
+
+    def __apply_pragmas(self, con, read_only=False):
+        for name, value in self.pragmas.items():
+            if read_only and name in ("journal_mode", "synchronous"):
+                # up to the writer
+                continue
+            # pragmas do not take bound parameters
+            if name not in DEFAULT_PRAGMAS:
+                logger.warning("ignoring unknown pragma {}".format(name))
+                continue
+            if not isinstance(value, int) and not str(value).isalnum():
+                logger.warning("ignoring invalid {} pragma: {!r}".format(name, value))
+                continue
+            res = con.execute("PRAGMA {} = {}".format(name, value)).fetchone()
+            if name == "journal_mode" and res and res[0].lower() != str(value).lower():
+                # e.g. WAL is not available on network file systems
+                logger.warning("could not set journal_mode to {}, using {}"
+                               .format(value, res[0]))
+
     connection = property(get_connection, None)
+    read_connection = property(get_read_connection, None)
 
     def fetchall(self, query, params = None):
         """Execute query.
@@ -892,17 +2196,39 @@ class Storage(storage.Storage):
         Returns:
             list(sqlite.Row)
         """
-        con = self.connection
+        if not self.__con:
+            # within a transaction, it was checked at the start
+            self.__check_data_version()
+        return self.__fetchall(self.connection, query, params)
+
+    def fetchall_snapshot(self, query, params = None):
+        """Execute query on the read-only connection.
+
+        For the plain reads (e.g. get_facts), so that long ones do not hold
+        the main connection. Within a transaction, same as fetchall,
+        so that its changes are seen.
+        Safe to call from any thread (cf. writer_thread).
+
+        Returns:
+            list(sqlite.Row)
+        """
+        if self.__in_writer():
+            if self.__con:
+                return self.fetchall(query, params)
+            # other threads rely on the writer checks
+            self.__check_data_version()
+        return self.__fetchall(self.read_connection, query, params)
+
+    def __fetchall(self, con, query, params):
         cur = con.cursor()
 
-        logger.debug("%s %s" % (query, params))
+        logger.debug("%s %s", query, params)
 
-        if params:
-            cur.execute(query, params)
+        if self.__stats:
+            res = self.__stats.run(con, query, params,
+                                   lambda: cur.execute(query, params or ()).fetchall())
         else:
-            cur.execute(query)
-
-        res = cur.fetchall()
+            res = cur.execute(query, params or ()).fetchall()
         cur.close()
 
         return res
@@ -925,31 +2251,41 @@ class Storage(storage.Storage):
         if isinstance(statement, list) == False: # we expect to receive instructions in list
             statement = [statement]
             params = [params]
+        self.__writes += 1
 
         for state, param in zip(statement, params):
-            logger.debug("%s %s" % (state, param))
-            cur.execute(state, param)
+            logger.debug("%s %s", state, param)
+            if self.__stats:
+                self.__stats.run(con, state, param, lambda: cur.execute(state, param))
+            else:
+                cur.execute(state, param)
 
         if not self.__con:
             con.commit()
             cur.close()
-            self.register_modification()
 
     def executemany(self, statement, params = []):
         con = self.__con or self.connection
         cur = self.__cur or con.cursor()
 
-        logger.debug("%s %s" % (statement, params))
-        cur.executemany(statement, params)
+        logger.debug("%s %s", statement, params)
+        self.__writes += 1
+        if self.__stats:
+            # one run, planned with the first parameters
+            params = list(params)
+            self.__stats.run(con, statement, params[0] if params else (),
+                             lambda: cur.executemany(statement, params))
+        else:
+            cur.executemany(statement, params)
 
         if not self.__con:
             con.commit()
             cur.close()
-            self.register_modification()
 
 
 
     def start_transaction(self):
+        self.__check_data_version()
         # will give some hints to execute not to close or commit anything
         self.__con = self.connection
         self.__cur = self.__con.cursor()
@@ -958,14 +2294,13 @@ class Storage(storage.Storage):
         self.__con.commit()
         self.__cur.close()
         self.__con, self.__cur = None, None
-        self.register_modification()
 
     def run_fixtures(self):
         self.start_transaction()
 
         """upgrade DB to hamster version"""
         version = self.fetchone("SELECT version FROM version")["version"]
-        current_version = 9
+        current_version = 15
 
         if version < 8:
             # working around sqlite's utf-f case sensitivity (bug 624438)
@@ -989,6 +2324,104 @@ class Storage(storage.Storage):
             self.execute("""CREATE VIRTUAL TABLE fact_index
                                            USING fts3(id, name, category, description, tag)""")
 
+        if version < 10:
+            # time range and activity lookups were full table scans
+            self.execute("CREATE INDEX IF NOT EXISTS idx_facts_start ON facts(start_time, end_time)")
+            self.execute("CREATE INDEX IF NOT EXISTS idx_facts_end ON facts(end_time, start_time)")
+            self.execute("CREATE INDEX IF NOT EXISTS idx_facts_activity ON facts(activity_id)")
+
+        if version < 11:
+            # the fts3 index was rebuilt lazily before each search,
+            # keep an fts5 index current with triggers instead
+            self.execute("DROP TABLE IF EXISTS fact_index")
+            self.execute(FACT_INDEX_SOURCE)
+            self.execute(FACT_INDEX)
+            for trigger in fact_index_triggers():
+                self.execute(trigger)
+            self.__rebuild_index()
+
+        if version < 12:
+            # time per hamster day and activity, of the finished facts.
+            # Kept up to date by hand (cf. __rollup), since splitting facts
+            # between days depends on the day start setting.
+            self.execute("""
+                CREATE TABLE daily_totals (
+                    hday text NOT NULL,
+                    activity_id integer NOT NULL,
+                    minutes integer NOT NULL,
+                    PRIMARY KEY (hday, activity_id)
+                ) WITHOUT ROWID""")
+            # single row, day start (minutes after midnight) used for daily_totals
+            self.execute("CREATE TABLE daily_totals_day_start (minutes integer NOT NULL)")
+            self.__rebuild_daily_totals()
+
+        if version < 13:
+            # journal of the fact changes, cf. __journal
+            self.execute("""
+                CREATE TABLE changes (
+                    revision integer PRIMARY KEY AUTOINCREMENT,
+                    fact_id integer NOT NULL,
+                    op text NOT NULL,
+                    range_start timestamp,
+                    range_end timestamp
+                )""")
+            self.execute("CREATE INDEX idx_changes_fact ON changes(fact_id, revision)")
+            # single row, changes up to that revision were compacted away
+            self.execute("CREATE TABLE changes_floor (revision integer NOT NULL)")
+            self.execute("INSERT INTO changes_floor (revision) VALUES (0)")
+
+        if version < 14:
+            # autocomplete grouped all the facts by activity to sort on the
+            # last use, keep usage numbers on the activities instead
+            self.execute("ALTER TABLE activities ADD COLUMN last_used timestamp")
+            self.execute("ALTER TABLE activities ADD COLUMN use_count integer NOT NULL DEFAULT 0")
+            self.execute("ALTER TABLE activities ADD COLUMN total_minutes integer NOT NULL DEFAULT 0")
+            # search_name is lowercase already, NOCASE lets LIKE use the index
+            self.execute("""CREATE INDEX idx_activities_search
+                                      ON activities(deleted, search_name COLLATE NOCASE)""")
+            for trigger in activity_usage_triggers():
+                self.execute(trigger)
+            self.__update_activity_usage()
+
+        if version < 15:
+            # fact_tags had no key, and duplicates inflated the tag counts.
+            # Rebuild it, without the fts view and triggers that read it
+            # (renaming a table checks them).
+            for trigger in fact_index_triggers():
+                self.execute("DROP TRIGGER IF EXISTS {}".format(trigger.split()[2]))
+            self.execute("DROP VIEW IF EXISTS fact_index_source")
+            self.execute("""
+                CREATE TABLE fact_tags_new (
+                    fact_id integer NOT NULL,
+                    tag_id integer NOT NULL,
+                    PRIMARY KEY (fact_id, tag_id)
+                ) WITHOUT ROWID""")
+            self.execute("""INSERT OR IGNORE INTO fact_tags_new (fact_id, tag_id)
+                                 SELECT fact_id, tag_id
+                                   FROM fact_tags
+                                  WHERE fact_id IS NOT NULL AND tag_id IS NOT NULL""")
+            self.execute("DROP TABLE fact_tags")
+            self.execute("ALTER TABLE fact_tags_new RENAME TO fact_tags")
+            self.execute("CREATE INDEX idx_fact_tags_tag ON fact_tags(tag_id)")
+            self.execute(FACT_INDEX_SOURCE)
+            for trigger in fact_index_triggers():
+                self.execute(trigger)
+            # the indexed tags had the duplicates
+            self.__rebuild_index()
+
+            self.execute("ALTER TABLE tags ADD COLUMN use_count integer NOT NULL DEFAULT 0")
+            for trigger in TAG_USAGE_TRIGGERS:
+                self.execute(trigger)
+            self.__update_tag_usage()
+
+        # opt-in, independent of the version
+        columns = [row["name"] for row in self.fetchall("PRAGMA table_info(facts)")]
+        self.__has_epoch_minutes = "start_minute" in columns
+        if self.epoch_minutes and not self.__has_epoch_minutes:
+            self.__add_epoch_minutes()
+            self.__has_epoch_minutes = True
+
+        self.__compact_journal()
 
         # at the happy end, update version number
         if version < current_version:
@@ -1003,24 +2436,64 @@ class Storage(storage.Storage):
 
 DATETIME_LOCAL_FMT = "%Y-%m-%d %H:%M:%S"
 
+# bypass the hamster datetime constructor, seconds are zeroed explicitly
+_new_datetime = pdt.datetime.__new__
 
+
+# Both conversions are memoized: the same values come back all the time
+# (adjacent facts share boundaries, range limits are bound repeatedly).
+# Cached values are immutable, so they can be safely shared.
+
+@lru_cache(maxsize=4096)
 def adapt_datetime(t):
     """Convert datetime t to the suitable sql representation."""
     return t.isoformat(" ")
 
 
+@lru_cache(maxsize=4096)
 def convert_datetime(s):
     """Convert the sql timestamp to datetime.
 
-    s is in bytes.
+    s is in bytes, as YYYY-MM-DD HH:MM:SS.
     """
 
-    # convert s from bytes to utf-8, and keep only data up to seconds
-    # 10 chars for YYYY-MM-DD, 1 space, 8 chars for HH:MM:SS
-    # note: let's leave any further rounding to dt.datetime.
-    datetime_string = s.decode('utf-8')[0:19]
+    # fixed layout, slice fields directly.
+    # Keep only data up to minutes, as dt.datetime would.
+    try:
+        return _new_datetime(dt.datetime,
+                             int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                             int(s[11:13]), int(s[14:16]))
+    except ValueError:
+        # unexpected layout, let strptime sort it out (or complain)
+        datetime_string = s.decode('utf-8')[0:19]
+        return dt.datetime.strptime(datetime_string, DATETIME_LOCAL_FMT)
+
 
-    return dt.datetime.strptime(datetime_string, DATETIME_LOCAL_FMT)
+def to_epoch_minutes(t):
+    """Convert datetime t to minutes since epoch (no timezone involved).
+
+    Same as the facts start_minute and end_minute columns.
+    """
+    return timegm(t.timetuple()) // 60 if t else None
+
+
+def split_days(start_time, end_time, day_start_minutes):
+    """Split a time range between the hamster days it covers.
+
+    Yield (date, minutes) pairs, in chronological order.
+    day_start_minutes is the day start, in minutes after midnight.
+    Computed without any configuration lookup, to be cheap in loops.
+    """
+    shift = pdt.timedelta(minutes=day_start_minutes)
+    # in shifted time, hamster days start at midnight
+    start = pdt.datetime.combine(start_time.date(), start_time.time()) - shift
+    end = pdt.datetime.combine(end_time.date(), end_time.time()) - shift
+    while start < end:
+        day = start.date()
+        next_day = pdt.datetime.combine(day + pdt.timedelta(days=1), pdt.time())
+        segment_end = min(end, next_day)
+        yield day, (segment_end - start) // pdt.timedelta(minutes=1)
+        start = segment_end
 
 
 sqlite.register_adapter(dt.datetime, adapt_datetime)
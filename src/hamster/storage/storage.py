@@ -28,6 +28,13 @@ from textwrap import dedent
 from hamster.lib.fact import Fact, FactError
 
 
+# possible get_totals group_by values
+TOTALS_GROUPS = ("day", "week", "month", "category", "activity", "tag")
+
+# possible add_facts on_conflict values
+ADD_FACTS_CONFLICTS = ("skip", "solve", "keep")
+
+
 class Storage(object):
     """Abstract storage.
 
@@ -117,6 +124,38 @@ class Storage(object):
             self.facts_changed()
         return result
 
+    def add_facts(self, facts, on_conflict="skip"):
+        """Add many facts at once, e.g. when importing from another tracker.
+
+        All the facts are added in a single transaction, and added as they
+        are: unlike add_fact, nothing is done about the on-going fact.
+
+        Args:
+            facts: iterable of Fact.
+            on_conflict (str): one of ADD_FACTS_CONFLICTS. What to do with
+                facts overlapping existing ones, or earlier ones in facts.
+                "skip" leaves them out (so importing twice is harmless),
+                "solve" makes room for them as add_fact does,
+                but skips those overlapping archived facts,
+                "keep" adds them anyway.
+        Returns:
+            list of the new fact ids, in the facts order, 0 for skipped facts.
+        """
+        if on_conflict not in ADD_FACTS_CONFLICTS:
+            raise ValueError("on_conflict should be one of {}, got {!r}"
+                             .format(", ".join(ADD_FACTS_CONFLICTS), on_conflict))
+        facts = list(facts)
+        # better fail before opening the transaction
+        for fact in facts:
+            self.check_fact(fact)
+        self.start_transaction()
+        result = self.__add_facts(facts, on_conflict)
+        self.end_transaction()
+
+        if any(result):
+            self.facts_changed()
+        return result
+
     def get_fact(self, fact_id):
         """Get fact by id. For output format see GetFacts"""
         return self.__get_fact(fact_id)
@@ -138,23 +177,62 @@ class Storage(object):
             self.facts_changed()
         return result
 
+    def update_facts(self, updates):
+        """Update many facts at once, e.g. when retagging.
+
+        All the updates are done in a single transaction,
+        with a single facts_changed call.
+        Failed updates do not prevent the others.
+
+        Args:
+            updates: iterable of (fact_id, Fact).
+        Returns:
+            list of (new id, error message), in the updates order.
+            The message is empty on success, the id is 0 on failure.
+        """
+        results = []
+        changed = False
+        self.start_transaction()
+        for fact_id, fact in updates:
+            try:
+                self.check_fact(fact)
+            except FactError as error:
+                results.append((0, str(error)))
+                continue
+            if not self.__fact_exists(fact_id):
+                results.append((0, "no fact with id {}".format(fact_id)))
+                continue
+            self.__remove_fact(fact_id)
+            changed = True
+            new_id = self.__add_fact(fact, False)
+            if new_id:
+                results.append((new_id, ""))
+            else:
+                logger.warning("failed to update fact {} ({})".format(fact_id, fact))
+                results.append((0, "failed to update fact {}".format(fact_id)))
+        self.end_transaction()
+
+        if changed:
+            self.facts_changed()
+        return results
+
     def stop_tracking(self, end_time):
         """Stops tracking the current activity"""
-        facts = self.__get_todays_facts()
-        if facts and not facts[-1].end_time:
-            self.__touch_fact(facts[-1], end_time)
+        fact = self.__get_last_fact()
+        if fact and not fact.end_time:
+            self.__touch_fact(fact, end_time)
             self.facts_changed()
 
 
     def stop_or_restart_tracking(self):
         """Stops or restarts tracking the last activity"""
-        facts = self.__get_todays_facts()
-        if facts:
-            if facts[-1].end_time:
-                self.add_fact(facts[-1].copy(start_time=dt.datetime.now(),
-                                             end_time = None))
+        fact = self.__get_last_fact()
+        if fact:
+            if fact.end_time:
+                self.add_fact(fact.copy(start_time=dt.datetime.now(),
+                                        end_time = None))
             else:
-                self.__touch_fact(facts[-1], end_time=dt.datetime.now())
+                self.__touch_fact(fact, end_time=dt.datetime.now())
             self.facts_changed()
 
 
@@ -168,17 +246,182 @@ class Storage(object):
         self.end_transaction()
 
 
+    def remove_facts(self, fact_ids):
+        """Remove many facts at once, in a single transaction.
+
+        Returns:
+            list of error messages, in the fact_ids order,
+            empty for the removed facts.
+        """
+        errors = []
+        self.start_transaction()
+        for fact_id in fact_ids:
+            if self.__fact_exists(fact_id):
+                self.__remove_fact(fact_id)
+                errors.append("")
+            else:
+                errors.append("no fact with id {}".format(fact_id))
+        self.end_transaction()
+
+        if not all(errors):
+            self.facts_changed()
+        return errors
+
+
     def get_facts(self, start, end=None, search_terms=""):
         range = dt.Range.from_start_end(start, end)
         return self.__get_facts(range, search_terms)
 
 
+    def iter_facts(self, start, end=None, search_terms="", batch_size=500):
+        """Iterate over facts, as returned by get_facts.
+
+        Rows are fetched batch_size at a time,
+        so that long ranges do not need to be held in memory.
+        Do not change the storage while iterating.
+        """
+        range = dt.Range.from_start_end(start, end)
+        return self.__iter_facts(range, search_terms, batch_size)
+
+
+    def get_facts_page(self, start, end=None, search_terms="", after=None, limit=500):
+        """Return a page of the facts returned by get_facts.
+
+        Args:
+            after: (start_time, id) of the last fact of the previous page,
+                None for the first page.
+            limit (int): maximum number of facts in the page.
+        Returns:
+            list of Fact, in the get_facts order.
+            Less than limit facts means there are no more.
+        Pages are found through the index, wherever they are in the range.
+        """
+        range = dt.Range.from_start_end(start, end)
+        return self.__get_facts_page(range, search_terms, after, limit)
+
+
+    def get_totals(self, start, end=None, group_by="category", search_terms=""):
+        """Sum the durations of the facts returned by get_facts.
+
+        Args:
+            group_by (str): one of TOTALS_GROUPS.
+                "day", "week" and "month" group by the hamster day
+                of the fact start. The key is the first day of the period
+                (dt.date), weeks start on monday.
+                Otherwise the key is the category, activity or tag name.
+                Facts without tags are left out of the "tag" totals.
+        Returns:
+            list of (key, dt.timedelta), in chronological order for periods,
+            longest first otherwise.
+            On-going facts count until now.
+        """
+        if group_by not in TOTALS_GROUPS:
+            raise ValueError("group_by should be one of {}, got {!r}"
+                             .format(", ".join(TOTALS_GROUPS), group_by))
+        range = dt.Range.from_start_end(start, end)
+        return self.__get_totals(range, group_by, search_terms)
+
+
+    def get_daily_totals(self, start, end=None):
+        """Time spent per hamster day and activity.
+
+        Unlike get_totals, facts crossing the day start are split
+        between the days, and the answer comes from a rollup table,
+        so that long ranges (e.g. a whole year) stay cheap.
+
+        Returns:
+            list of (dt.hday, activity, category, dt.timedelta),
+            by day, then activity name.
+            On-going facts count until now.
+        """
+        range = dt.Range.from_start_end(start, end)
+        return self.__get_daily_totals(range)
+
+
+    def get_revision(self):
+        """Revision of the last change of the facts, cf. get_changes_since."""
+        return self.__get_revision()
+
+
+    def get_changes_since(self, revision):
+        """Changes of the facts after the given revision.
+
+        Returns:
+            (revision, changes): the current revision,
+            and a list of (revision, fact_id, op, range_start, range_end),
+            oldest first.
+            op is "add", "update" or "remove", and the range is where the
+            fact is, after the change (where it was, for removals).
+            Only the latest change of each fact is listed.
+            changes is None if the changes since then are not known anymore
+            (e.g. too old, or external changes of the database);
+            everything should be fetched again.
+        """
+        return self.__get_changes_since(revision)
+
+
     def get_todays_facts(self):
         """Gets facts of today, respecting hamster midnight. See GetFacts for
         return info"""
         return self.__get_todays_facts()
 
 
+    def rebuild_index(self):
+        """Rebuild the full text search index from scratch.
+
+        Only needed if the index got out of sync,
+        e.g. after running an older hamster version on the same database.
+        """
+        self.__rebuild_index()
+
+    def rebuild_daily_totals(self):
+        """Rebuild the daily totals (cf. get_daily_totals) from scratch.
+
+        A change of the day start is detected and handled automatically,
+        this is only needed after running an older hamster version
+        on the same database.
+        """
+        self.__rebuild_daily_totals()
+
+    def maintenance_steps(self):
+        """Database maintenance, in small steps.
+
+        Returns an iterator, each next() runs a step short enough
+        to be done between two requests (e.g. when idle),
+        and returns (task name, step duration in seconds).
+        """
+        return self.__maintenance_steps()
+
+    def maintenance(self):
+        """Run all the database maintenance tasks at once.
+
+        Same tasks as maintenance_steps, but complete (e.g. a whole
+        ANALYZE and search index optimization).
+
+        Returns:
+            list of (task name, duration in seconds), in order.
+        """
+        totals = {}
+        for name, elapsed in self.__maintenance_steps(full=True):
+            totals[name] = totals.get(name, 0) + elapsed
+        return list(totals.items())
+
+
+    def archive_facts(self, before):
+        """Move the facts that ended before `before` (dt.datetime)
+        to the archive database.
+
+        Archived facts are still returned by get_facts, search and totals,
+        the archive is only queried for ranges that reach its period.
+
+        Returns the number of archived facts.
+        """
+        count = self.__archive_facts(before)
+        if count:
+            self.facts_changed()
+        return count
+
+
     # categories
     def add_category(self, name):
         res = self.__add_category(name)
@@ -0,0 +1,153 @@
+"""Storage micro-benchmarks.
+
+Not part of the test suite, run manually:
+    python3 tests/benchmarks.py
+"""
+
+import sys, os.path
+# a convoluted line to add hamster module to absolute path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import itertools
+import tempfile
+import timeit
+from hamster.lib import datetime as dt
+from hamster.lib import dbus as hamster_dbus
+from hamster.storage import db
+
+
+def synthetic_storage(database_dir, days=365, facts_per_day=10, tags_per_fact=5):
+    """Return a db.Storage filled with short facts, each with tags_per_fact tags."""
+    storage = db.Storage(unsorted_localized="", database_dir=database_dir)
+    storage.start_transaction()
+    storage.executemany("INSERT INTO categories (id, name, search_name) VALUES (?, ?, ?)",
+                        [(i, "category {}".format(i), "category {}".format(i))
+                         for i in range(1, 6)])
+    storage.executemany("INSERT INTO activities (id, name, search_name, category_id) VALUES (?, ?, ?, ?)",
+                        [(i, "activity {}".format(i), "activity {}".format(i), i % 5 + 1)
+                         for i in range(1, 51)])
+    storage.executemany("INSERT INTO tags (id, name) VALUES (?, ?)",
+                        [(i, "tag {}".format(i)) for i in range(1, 31)])
+    start = dt.datetime(2020, 1, 1, 8)
+    facts, fact_tags = [], []
+    fact_id = 0
+    for day in range(days):
+        for n in range(facts_per_day):
+            fact_id += 1
+            fact_start = start + dt.timedelta(days=day, minutes=50 * n)
+            facts.append((fact_id, fact_id % 50 + 1,
+                          fact_start, fact_start + dt.timedelta(minutes=45),
+                          "description {}".format(fact_id)))
+            fact_tags.extend((fact_id, (fact_id + k) % 30 + 1)
+                             for k in range(tags_per_fact))
+    storage.executemany("INSERT INTO facts (id, activity_id, start_time, end_time, description) VALUES (?, ?, ?, ?, ?)",
+                        facts)
+    storage.executemany("INSERT INTO fact_tags (fact_id, tag_id) VALUES (?, ?)",
+                        fact_tags)
+    storage.end_transaction()
+    return storage
+
+
+# baselines, kept here to compare against the previous implementations
+
+def legacy_get_facts(storage, range):
+    """Fact query with one row per tag, glued back with itertools.groupby."""
+    query = """
+               SELECT a.id AS id,
+                      a.start_time AS start_time,
+                      a.end_time AS end_time,
+                      a.description as description,
+                      b.name AS name, b.id as activity_id,
+                      coalesce(c.name, ?) as category,
+                      e.name as tag
+                 FROM facts a
+            LEFT JOIN activities b ON a.activity_id = b.id
+            LEFT JOIN categories c ON b.category_id = c.id
+            LEFT JOIN fact_tags d ON d.fact_id = a.id
+            LEFT JOIN tags e ON e.id = d.tag_id
+                WHERE (a.end_time >= ? OR a.end_time IS NULL) AND a.start_time <= ?
+             ORDER BY a.start_time, e.name
+    """
+    rows = storage.fetchall(query, ("", range.start, range.end))
+    facts = []
+    for fact_id, fact_tags in itertools.groupby(rows, lambda f: f["id"]):
+        fact_tags = list(fact_tags)
+        keys = ["id", "start_time", "end_time", "description", "name",
+                "activity_id", "category"]
+        fact = dict([(key, fact_tags[0][key]) for key in keys])
+        fact["tags"] = [ft["tag"] for ft in fact_tags if ft["tag"]]
+        facts.append(fact)
+    return facts
+
+
+def legacy_convert_datetime(s):
+    """strptime based timestamp converter."""
+    return dt.datetime.strptime(s.decode('utf-8')[0:19], db.DATETIME_LOCAL_FMT)
+
+
+def bench(label, func, number=5):
+    best = min(timeit.repeat(func, number=1, repeat=number))
+    print("    {:<40} {:8.1f} ms".format(label, best * 1000))
+    return best
+
+
+def bench_get_facts(storage):
+    print("get_facts, one year, 5 tags per fact")
+    range = dt.Range(dt.datetime(2020, 1, 1), dt.datetime(2020, 12, 31, 23, 59))
+    legacy = bench("row per tag + groupby", lambda: legacy_get_facts(storage, range))
+    current = bench("row per fact", lambda: storage.get_facts(range))
+    print("    speedup: {:.1f}x".format(legacy / current))
+
+
+def bench_timestamp_codec():
+    print("timestamp codec, 20000 distinct values, read twice in a row")
+    # as for adjacent facts, where an end is the next start
+    start = dt.datetime(2020, 1, 1)
+    values = [db.adapt_datetime(start + dt.timedelta(minutes=15 * i)).encode()
+              for i in range(20000) for __ in range(2)]
+
+    def fast():
+        db.convert_datetime.cache_clear()
+        for s in values:
+            db.convert_datetime(s)
+
+    def legacy():
+        for s in values:
+            legacy_convert_datetime(s)
+
+    for s in values:
+        assert db.convert_datetime(s) == legacy_convert_datetime(s), s
+    legacy = bench("strptime", legacy)
+    current = bench("slicing + memo", fast)
+    print("    speedup: {:.1f}x".format(legacy / current))
+
+
+def bench_dbus_facts(storage):
+    print("D-Bus fact conversions, 10000 facts, service and client sides")
+    print("    (the bus marshalling itself is left out)")
+    facts = storage.get_facts(dt.datetime(2020, 1, 1), dt.datetime(2022, 9, 26, 23, 59))
+    assert len(facts) == 10000, len(facts)
+
+    def json_strings():
+        dbus_facts = [hamster_dbus.to_dbus_fact_json(fact) for fact in facts]
+        return [hamster_dbus.from_dbus_fact_json(fact) for fact in dbus_facts]
+
+    def columns():
+        dbus_columns = hamster_dbus.to_dbus_facts_columns(facts)
+        return list(hamster_dbus.from_dbus_facts_columns(dbus_columns))
+
+    assert ([fact.serialized() for fact in columns()]
+            == [fact.serialized() for fact in json_strings()])
+    legacy = bench("JSON string per fact", json_strings)
+    current = bench("columns", columns)
+    print("    speedup: {:.1f}x".format(legacy / current))
+
+
+if __name__ == '__main__':
+    bench_timestamp_codec()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = synthetic_storage(tmp_dir)
+        bench_get_facts(storage)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = synthetic_storage(tmp_dir, days=1000)
+        bench_dbus_facts(storage)
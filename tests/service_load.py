@@ -0,0 +1,79 @@
+"""Load test of hamster-service.
+
+Not part of the test suite, run manually against a running service
+(preferably on a scratch database):
+    python3 tests/service_load.py [clients] [seconds]
+
+Client processes keep reading facts and adding some, meanwhile
+the latency of Version (answered by the main loop) is measured.
+"""
+
+import sys
+import datetime
+import json
+import multiprocessing
+import time
+
+import dbus
+
+
+def service():
+    obj = dbus.SessionBus().get_object("org.gnome.Hamster", "/org/gnome/Hamster")
+    return dbus.Interface(obj, dbus_interface="org.gnome.Hamster")
+
+
+def client(number, deadline, counts):
+    hamster = service()
+    calls = 0
+    while time.time() < deadline:
+        if calls % 10 == 0:
+            # far away from real facts, one minute each
+            start = datetime.datetime(2001, 1, 1 + number) + datetime.timedelta(minutes=calls)
+            end = start + datetime.timedelta(minutes=1)
+            hamster.AddFactJSON(json.dumps({"activity": "load test {}".format(number),
+                                            "category": "load",
+                                            "description": "",
+                                            "tags": ["load"],
+                                            "range": {"start": str(start)[:16],
+                                                      "end": str(end)[:16]}}),
+                                timeout=60)
+        else:
+            hamster.GetFactsJSON("2000-01-01 - 2030-12-31", "", timeout=60)
+        calls += 1
+    counts[number] = calls
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main(clients=8, seconds=10):
+    hamster = service()
+    deadline = time.time() + seconds
+    # forked clients would share the bus connection of this process
+    context = multiprocessing.get_context("spawn")
+    counts = context.Array("i", clients)
+    processes = [context.Process(target=client, args=(n, deadline, counts))
+                 for n in range(clients)]
+    for process in processes:
+        process.start()
+
+    latencies = []
+    while time.time() < deadline:
+        start = time.perf_counter()
+        hamster.Version()
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.01)
+
+    for process in processes:
+        process.join()
+    print("{} clients, {} s: {} storage calls".format(clients, seconds, sum(counts)))
+    print("Version latency: median {:.1f} ms, 99th percentile {:.1f} ms, max {:.1f} ms"
+          .format(percentile(latencies, 0.5) * 1000,
+                  percentile(latencies, 0.99) * 1000,
+                  max(latencies) * 1000))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,98 @@
+"""hamster-service, called over a private session bus.
+
+Skipped without dbus-python or dbus-daemon.
+"""
+
+import sys, os.path
+# a convoluted line to add hamster module to absolute path
+SRC_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), "../src"))
+sys.path.insert(0, SRC_DIR)
+
+import json
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+try:
+    import dbus
+    import dbus.lowlevel
+except ImportError:
+    dbus = None
+
+
+def dbus_fact(activity, start, end):
+    return json.dumps({"activity": activity, "category": "", "description": "",
+                       "tags": [], "range": {"start": start, "end": end}})
+
+
+@unittest.skipUnless(dbus and shutil.which("dbus-daemon"),
+                     "needs dbus-python and dbus-daemon")
+class TestService(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        bus_daemon = subprocess.Popen(["dbus-daemon", "--session", "--nofork",
+                                       "--print-address"],
+                                      stdout=subprocess.PIPE, text=True)
+        self.addCleanup(self.stop, bus_daemon)
+        address = bus_daemon.stdout.readline().strip()
+        env = dict(os.environ, DBUS_SESSION_BUS_ADDRESS=address,
+                   XDG_DATA_HOME=tmp_dir.name, GSETTINGS_BACKEND="memory")
+        service = subprocess.Popen([sys.executable,
+                                    os.path.join(SRC_DIR, "hamster-service.py")],
+                                   env=env)
+        self.addCleanup(self.stop, service)
+        self.bus = dbus.bus.BusConnection(address)
+        self.addCleanup(self.bus.close)
+        deadline = time.time() + 30
+        while not self.bus.name_has_owner("org.gnome.Hamster"):
+            if service.poll() is not None or time.time() > deadline:
+                self.fail("hamster-service did not start")
+            time.sleep(0.1)
+        obj = self.bus.get_object("org.gnome.Hamster", "/org/gnome/Hamster")
+        self.hamster = dbus.Interface(obj, dbus_interface="org.gnome.Hamster")
+
+    @staticmethod
+    def stop(process):
+        process.terminate()
+        process.wait()
+        if process.stdout:
+            process.stdout.close()
+
+    def test_method_calls(self):
+        # answered by the main loop, and by the worker threads,
+        # with the request counting message filter in place
+        self.assertTrue(self.hamster.Version(timeout=5))
+        fact_id = self.hamster.AddFactJSON(dbus_fact("coding", "2020-03-02 10:00",
+                                                     "2020-03-02 11:00"), timeout=5)
+        self.assertTrue(fact_id)
+        facts = [json.loads(fact) for fact in
+                 self.hamster.GetFactsJSON("2020-03-02", "", timeout=5)]
+        self.assertEqual([fact["id"] for fact in facts], [fact_id])
+
+    def test_update_facts(self):
+        ids = [self.hamster.AddFactJSON(dbus_fact("fact {}".format(hour),
+                                                  "2020-03-02 {:02d}:00".format(hour),
+                                                  "2020-03-02 {:02d}:30".format(hour)),
+                                        timeout=5)
+               for hour in (10, 11)]
+        results = self.hamster.UpdateFactsJSON(
+            [(ids[0], dbus_fact("updated", "2020-03-02 10:00", "2020-03-02 10:30")),
+             (ids[1], "{}"),
+             (ids[1], "not json")],
+            timeout=5)
+        self.assertTrue(results[0][0])
+        self.assertFalse(results[0][1])
+        self.assertEqual([new_id for new_id, __ in results[1:]], [0, 0])
+        self.assertTrue(all(error for __, error in results[1:]))
+        facts = [json.loads(fact) for fact in
+                 self.hamster.GetFactsJSON("2020-03-02", "", timeout=5)]
+        self.assertEqual([(fact["id"], fact["activity"]) for fact in facts],
+                         [(results[0][0], "updated"), (ids[1], "fact 11")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,1006 @@
+import sys, os.path
+# a convoluted line to add hamster module to absolute path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import concurrent.futures
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from hamster.lib import datetime as dt
+from hamster.lib.fact import Fact
+from hamster.storage import db
+
+
+class TestDatetimeCodec(unittest.TestCase):
+
+    def test_round_trip(self):
+        start = dt.datetime(1999, 12, 31, 23, 59)
+        for minutes in range(0, 60 * 24 * 400, 37):
+            t = start + dt.timedelta(minutes=minutes)
+            s = db.adapt_datetime(t).encode()
+            converted = db.convert_datetime(s)
+            self.assertEqual(converted, t)
+            self.assertEqual(type(converted), dt.datetime)
+            self.assertEqual(db.adapt_datetime(converted).encode(), s)
+
+    def test_rounding(self):
+        # seconds and microseconds, from old databases, are dropped
+        self.assertEqual(db.convert_datetime(b"2020-03-02 05:07:59.123456"),
+                         dt.datetime(2020, 3, 2, 5, 7))
+        self.assertEqual(db.convert_datetime(b"2020-03-02 05:07"),
+                         dt.datetime(2020, 3, 2, 5, 7))
+
+    def test_invalid(self):
+        for s in (b"2020-03-02", b"2020-13-02 05:07:00", b"garbage"):
+            with self.assertRaises(ValueError):
+                db.convert_datetime(s)
+
+
+class StorageTestCase(unittest.TestCase):
+    """Base class, providing a fresh database for each test."""
+
+    # extra db.Storage arguments
+    storage_kwds = {"epoch_minutes": False}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.storage = db.Storage(unsorted_localized="",
+                                  database_dir=self.tmp_dir.name,
+                                  **self.storage_kwds)
+        self.day = dt.hday(2020, 3, 2)
+
+    def tearDown(self):
+        self.storage.connection.close()
+        self.tmp_dir.cleanup()
+
+    def add(self, activity, start_hours, end_hours=None, **kwds):
+        """Add a fact starting start_hours after self.day start."""
+        start = self.day.start + dt.timedelta(hours=start_hours)
+        end = None
+        if end_hours is not None:
+            end = self.day.start + dt.timedelta(hours=end_hours)
+        fact = Fact(activity=activity, start_time=start, end_time=end, **kwds)
+        return self.storage.add_fact(fact)
+
+
+class TestConnection(StorageTestCase):
+
+    def pragma(self, name):
+        return self.storage.connection.execute("PRAGMA {}".format(name)).fetchone()[0]
+
+    def test_default_profile(self):
+        self.assertEqual(self.pragma("journal_mode"), "wal")
+        self.assertEqual(self.pragma("synchronous"), 1)  # NORMAL
+        self.assertEqual(self.pragma("temp_store"), 2)  # MEMORY
+        self.assertEqual(self.pragma("busy_timeout"), db.DEFAULT_PRAGMAS["busy_timeout"])
+
+    def test_override(self):
+        self.storage.connection.close()
+        self.storage = db.Storage(database_dir=self.tmp_dir.name,
+                                  pragmas={"cache_size": -1234,
+                                           "busy_timeout": 42,
+                                           "cache_size; drop table facts": 1})
+        self.assertEqual(self.pragma("cache_size"), -1234)
+        self.assertEqual(self.pragma("busy_timeout"), 42)
+        self.assertEqual(self.storage.get_facts(self.day), [])
+
+    def test_external_changes(self):
+        self.assertEqual(self.storage.get_category_id("external"), 0)
+        with mock.patch.object(self.storage, "dispatch_overwrite") as dispatch:
+            self.add("ours", 1, 2)
+            self.storage.get_facts(self.day)
+            dispatch.assert_not_called()
+
+            revision = self.storage.get_revision()
+            other = sqlite3.connect(self.storage.db_path)
+            with other:
+                other.execute("INSERT INTO categories (name, search_name) VALUES ('external', 'external')")
+            other.close()
+            # noticed by the next query, and the caches are cleared
+            self.assertIn("external", [row["name"] for row in self.storage.get_categories()])
+            dispatch.assert_called_once_with()
+            self.assertNotEqual(self.storage.get_category_id("external"), 0)
+        # the journal does not know what happened
+        self.assertIsNone(self.storage.get_changes_since(revision)[1])
+
+    def test_external_stop(self):
+        start = max(dt.datetime.now() - dt.timedelta(minutes=10), dt.hday.today().start)
+        fact_id = self.storage.add_fact(Fact(activity="ours", start_time=start,
+                                             end_time=start + dt.timedelta(minutes=1)))
+        # the last fact is known, and finished
+        self.storage.stop_tracking(dt.datetime.now())
+        other = sqlite3.connect(self.storage.db_path)
+        with other:
+            other.execute("UPDATE facts SET end_time = NULL WHERE id = ?", (fact_id, ))
+        other.close()
+        end = start + dt.timedelta(minutes=5)
+        self.storage.stop_tracking(end)
+        self.assertEqual(self.storage.get_fact(fact_id).end_time, end)
+
+    def test_read_snapshot(self):
+        for i in range(6):
+            self.add("fact {}".format(i), i, i + 1)
+        facts = self.storage.iter_facts(self.day, batch_size=2)
+        self.assertEqual(next(facts).activity, "fact 0")
+        # the read is still going on, short timeout: the write must not wait for the read
+        self.storage.connection.execute("PRAGMA busy_timeout = 10")
+        new_id = self.add("during the read", 7, 8)
+        self.assertTrue(new_id)
+        # the read goes on with the data as of its start
+        self.assertEqual([fact.activity for fact in facts],
+                         ["fact {}".format(i) for i in range(1, 6)])
+        self.assertEqual(self.storage.get_facts(self.day)[-1].id, new_id)
+        self.assertEqual(self.storage.get_fact(new_id).activity, "during the read")
+
+    def test_reader_threads(self):
+        def categories_in_thread():
+            with concurrent.futures.ThreadPoolExecutor(1) as executor:
+                return executor.submit(self.storage.get_categories).result(timeout=5)
+
+        self.storage.writer_thread = threading.get_ident()
+        self.storage.start_transaction()
+        self.storage.execute("INSERT INTO categories (name, search_name) VALUES ('new', 'new')")
+        # the transaction belongs to the writer
+        self.assertIn("new", [row["name"] for row in self.storage.get_categories()])
+        # others read the last commit, without waiting
+        self.assertNotIn("new", [row["name"] for row in categories_in_thread()])
+        self.storage.end_transaction()
+        self.assertIn("new", [row["name"] for row in categories_in_thread()])
+
+
+class TestFacts(StorageTestCase):
+
+    def test_one_fact_per_row(self):
+        self.add("tagged", 1, 2, tags=["b", "a", "c"])
+        self.add("untagged", 2, 3)
+        self.add("same start", 2, 3, tags=["z"])
+        facts = self.storage.get_facts(self.day)
+        self.assertEqual([fact.activity for fact in facts],
+                         ["tagged", "untagged", "same start"])
+        self.assertEqual([fact.tags for fact in facts],
+                         [["a", "b", "c"], [], ["z"]])
+        fact = self.storage.get_fact(facts[0].id)
+        self.assertEqual(fact.tags, ["a", "b", "c"])
+
+    def test_iter_facts(self):
+        for i in range(7):
+            self.add("activity {}".format(i % 2), i, i + 1, tags=["tag{}".format(i)])
+        hours = dt.Range(self.day.start + dt.timedelta(hours=2),
+                         self.day.start + dt.timedelta(hours=5))
+        for search_terms in ("", "activity*", "not tag3"):
+            expected = self.storage.get_facts(hours, search_terms=search_terms)
+            self.assertTrue(expected)
+            facts = self.storage.iter_facts(hours, search_terms=search_terms,
+                                            batch_size=2)
+            self.assertEqual([(fact.id, fact.tags) for fact in facts],
+                             [(fact.id, fact.tags) for fact in expected])
+
+    def test_facts_page(self):
+        for i in range(7):
+            # pairs of facts starting at the same time
+            self.add("activity {}".format(i), i // 2, i // 2 + 0.5, tags=["tag{}".format(i % 2)])
+        for search_terms in ("", "tag1"):
+            expected = self.storage.get_facts(self.day, search_terms=search_terms)
+            facts, after = [], None
+            while True:
+                page = self.storage.get_facts_page(self.day, search_terms=search_terms,
+                                                   after=after, limit=2)
+                facts += page
+                if len(page) < 2:
+                    break
+                after = (page[-1].start_time, page[-1].id)
+            self.assertEqual([fact.id for fact in facts],
+                             [fact.id for fact in expected])
+
+    def test_start_stop(self):
+        now = dt.datetime.now()
+        self.storage.add_fact(Fact(activity="first", start_time=now - dt.timedelta(minutes=30)))
+        fact_id = self.storage.add_fact(Fact(activity="second",
+                                             start_time=now - dt.timedelta(minutes=10)))
+        facts = self.storage.get_todays_facts()
+        self.assertEqual([(fact.activity, fact.end_time) for fact in facts],
+                         [("first", now - dt.timedelta(minutes=10)), ("second", None)])
+
+        self.storage.stop_tracking(now)
+        self.assertEqual(self.storage.get_fact(fact_id).end_time, now)
+        self.storage.stop_tracking(now)
+        # nothing changed since, the last fact is known:
+        # only external changes are checked
+        statements = []
+        self.storage.connection.set_trace_callback(statements.append)
+        try:
+            self.storage.stop_tracking(now)
+        finally:
+            self.storage.connection.set_trace_callback(None)
+        self.assertEqual(statements, ["PRAGMA data_version"])
+
+        self.storage.stop_or_restart_tracking()
+        facts = self.storage.get_todays_facts()
+        self.assertEqual([(fact.activity, fact.end_time) for fact in facts[1:]],
+                         [("second", now), ("second", None)])
+
+    def test_overlaps(self):
+        self.add("truncated", 1, 3, tags=["x"])
+        self.add("kept", 3.5, 4)
+        self.add("shifted", 5, 7)
+        self.add("split", 10, 14, description="long", tags=["y", "z"])
+        self.add("new", 2, 6)
+        self.add("inside", 11, 12)
+        facts = self.storage.get_facts(self.day)
+        hours = lambda time: (time - self.day.start).total_seconds() / 3600
+        self.assertEqual([(fact.activity, hours(fact.start_time), hours(fact.end_time),
+                           fact.description, fact.tags) for fact in facts],
+                         [("truncated", 1, 2, "", ["x"]),
+                          ("new", 2, 6, "", []),
+                          ("kept", 3.5, 4, "", []),
+                          ("shifted", 6, 7, "", []),
+                          ("split", 10, 11, "long", ["y", "z"]),
+                          ("inside", 11, 12, "", []),
+                          ("split", 12, 14, "long", ["y", "z"])])
+        totals = self.storage.get_daily_totals(self.day)
+        self.storage.rebuild_daily_totals()
+        self.assertEqual(self.storage.get_daily_totals(self.day), totals)
+
+    def test_epoch_minutes_migration(self):
+        self.add("before", 1, 2)
+        self.storage.connection.close()
+        self.storage = db.Storage(database_dir=self.tmp_dir.name,
+                                  epoch_minutes=True)
+        row = self.storage.fetchone("SELECT * FROM facts")
+        self.assertEqual(row["end_minute"] - row["start_minute"], 60)
+        self.add("after", 3)
+        facts = self.storage.get_facts(self.day)
+        self.assertEqual([fact.activity for fact in facts], ["before", "after"])
+        self.assertEqual(facts[0].end_time, self.day.start + dt.timedelta(hours=2))
+
+
+class TestLookupCaches(StorageTestCase):
+
+    def lookups(self, func, *args, **kwds):
+        """Run func and return the name lookup queries."""
+        statements = []
+        self.storage.connection.set_trace_callback(statements.append)
+        try:
+            func(*args, **kwds)
+        finally:
+            self.storage.connection.set_trace_callback(None)
+        lookup = re.compile(r"^\s*select\b.*\bfrom\s+(activities|categories|tags)\b",
+                            flags=re.IGNORECASE | re.DOTALL)
+        return [statement for statement in statements if lookup.match(statement)]
+
+    def test_steady_state(self):
+        # creating the names clears the caches, warm them up again
+        self.add("coding", 1, 2, category="work", tags=["a", "b"])
+        self.add("coding", 2, 3, category="work", tags=["a"])
+        self.assertEqual(self.lookups(self.add, "coding", 3, 4,
+                                      category="work", tags=["b", "a"]), [])
+
+    def test_invalidation(self):
+        self.add("coding", 1, 2, category="work", tags=["a"])
+        activity = self.storage.get_activity_by_name("coding", None)
+        self.storage.update_activity(activity["id"], "hacking", -1)
+        self.storage.update_category(self.storage.get_category_id("work"), "job")
+        self.assertEqual(self.storage.get_category_id("work"), 0)
+        self.add("coding", 3, 4, category="work", tags=["a"])
+        facts = self.storage.get_facts(self.day)
+        self.assertEqual([(fact.activity, fact.category) for fact in facts],
+                         [("hacking", ""), ("coding", "work")])
+        self.assertNotEqual(facts[0].activity_id, facts[1].activity_id)
+
+        self.storage.update_autocomplete_tags("b")
+        self.assertEqual(self.storage.get_tags(only_autocomplete=True)[0]["name"], "b")
+        tag = self.storage.get_tag_ids(["a"])[0]
+        self.assertIn(tag["autocomplete"], (0, "false"))
+        self.storage.remove_activity(activity["id"])
+        self.assertTrue(self.storage.get_activity_by_name("hacking", None, False)["deleted"])
+
+
+class TestActivityUsage(StorageTestCase):
+
+    def usage(self, activity, category=None):
+        activity_id = self.storage.get_activity_by_name(activity, self.storage.get_category_id(category))["id"]
+        row = self.storage.fetchone("SELECT use_count, total_minutes, last_used FROM activities WHERE id = ?",
+                                    (activity_id, ))
+        return tuple(row)
+
+    def hours(self, hours):
+        return self.day.start + dt.timedelta(hours=hours)
+
+    def test_usage(self):
+        first = self.add("coding", 1, 2)
+        ongoing = self.add("coding", 3)
+        # on-going facts count once stopped
+        self.assertEqual(self.usage("coding"), (2, 60, self.hours(3)))
+        self.storage.execute("UPDATE facts SET end_time = ? WHERE id = ?",
+                             (self.hours(3.5), ongoing))
+        self.assertEqual(self.usage("coding"), (2, 90, self.hours(3)))
+
+        fact = self.storage.get_fact(first)
+        self.storage.update_fact(first, fact.copy(activity="reading"))
+        self.assertEqual(self.usage("reading"), (1, 60, self.hours(1)))
+        self.assertEqual(self.usage("coding"), (1, 30, self.hours(3)))
+
+        # the latest fact goes away
+        self.add("reading", 4, 5)
+        latest = self.storage.get_facts(self.day)[-1]
+        self.storage.remove_fact(latest.id)
+        self.assertEqual(self.usage("reading"), (1, 60, self.hours(1)))
+
+    def test_get_activities(self):
+        self.add("alpha", 1, 2)
+        self.add("beta", 2, 3)
+        self.storage.add_activity("beta unused")
+        self.assertEqual([row["name"] for row in self.storage.get_activities("")],
+                         ["beta", "alpha", "beta unused"])
+        self.assertEqual([row["name"] for row in self.storage.get_activities("be")],
+                         ["beta", "beta unused"])
+
+    def test_archive(self):
+        self.add("coding", 1, 2)
+        self.add("coding", 25, 26)
+        self.storage.archive_facts(self.hours(24))
+        self.assertEqual(self.usage("coding"), (2, 120, self.hours(25)))
+        self.storage.remove_fact(self.storage.get_facts(self.day, self.day + dt.timedelta(days=1))[-1].id)
+        # the archived fact is not looked up, but still counts
+        self.assertEqual(self.usage("coding"), (1, 60, self.hours(25)))
+        self.storage.remove_fact(self.storage.get_facts(self.day)[0].id)
+        self.assertEqual(self.usage("coding"), (0, 0, None))
+
+
+class TestTagUsage(StorageTestCase):
+
+    def use_counts(self):
+        return {row["name"]: row["use_count"] for row in self.storage.get_tags(False)}
+
+    def test_use_count(self):
+        first = self.add("coding", 1, 2, tags=["a", "b"])
+        self.add("coding", 2, 3, tags=["a"])
+        self.assertEqual(self.use_counts(), {"a": 2, "b": 1})
+        self.storage.remove_fact(first)
+        self.assertEqual(self.use_counts(), {"a": 1, "b": 0})
+
+    def test_archive(self):
+        self.add("coding", 1, 2, tags=["a"])
+        self.storage.archive_facts(self.day.end)
+        self.assertEqual(self.use_counts(), {"a": 1})
+        self.storage.remove_fact(self.storage.get_facts(self.day)[0].id)
+        self.assertEqual(self.use_counts(), {"a": 0})
+
+    def test_update_autocomplete_tags(self):
+        self.add("coding", 1, 2, tags=["used"])
+        self.storage.get_tag_ids(["unused"])
+        with mock.patch.object(self.storage, "tags_changed") as tags_changed:
+            self.storage.update_autocomplete_tags("kept")
+            self.assertEqual(tags_changed.call_count, 1)
+            tags = {row["name"]: row["autocomplete"] for row in self.storage.get_tags(False)}
+            self.assertEqual(sorted(tags), ["kept", "used"])
+            self.assertIn(tags["kept"], (1, "true"))
+            self.assertIn(tags["used"], (0, "false"))
+            # nothing left to change
+            self.storage.update_autocomplete_tags("kept")
+            self.assertEqual(tags_changed.call_count, 1)
+
+    def test_migration(self):
+        # version 9 database, with a duplicate fact tag
+        self.storage.connection.close()
+        self.tmp_dir.cleanup()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp_dir.name, "hamster.db")
+        shutil.copy(os.path.join(os.path.dirname(__file__), "../data/hamster.db"), path)
+        con = sqlite3.connect(path)
+        con.execute("INSERT INTO activities (id, name, search_name, category_id) VALUES (1, 'coding', 'coding', -1)")
+        con.execute("INSERT INTO facts (id, activity_id, start_time, end_time) VALUES (1, 1, ?, ?)",
+                    (db.adapt_datetime(self.day.start), db.adapt_datetime(self.day.end)))
+        con.execute("INSERT INTO tags (id, name) VALUES (1, 'a')")
+        con.executemany("INSERT INTO fact_tags (fact_id, tag_id) VALUES (1, 1)", [(), ()])
+        con.commit()
+        con.close()
+
+        self.storage = db.Storage(unsorted_localized="", database_dir=self.tmp_dir.name,
+                                  **self.storage_kwds)
+        self.assertEqual(self.use_counts(), {"a": 1})
+        facts = self.storage.get_facts(self.day, search_terms="a")
+        self.assertEqual([fact.tags for fact in facts], [["a"]])
+        self.storage.remove_fact(facts[0].id)
+        self.assertEqual(self.storage.get_facts(self.day, search_terms="a"), [])
+        self.assertEqual(self.use_counts(), {"a": 0})
+
+
+class TestStats(StorageTestCase):
+
+    def test_disabled(self):
+        self.assertIsNone(self.storage.get_stats())
+        self.storage.enable_stats()
+        self.storage.enable_stats(False)
+        self.assertIsNone(self.storage.get_stats())
+        self.assertNotIn("add_fact", vars(self.storage))
+
+    def test_methods(self):
+        self.storage.enable_stats()
+        self.add("coding", 1, 2, tags=["a"])
+        self.add("coding", 2, 3, tags=["a"])
+        self.storage.get_facts(self.day)
+        stats = self.storage.get_stats()
+        methods = {item["method"]: item for item in stats["methods"]}
+        self.assertEqual(sorted(methods), ["add_fact", "get_facts"])
+        self.assertEqual(methods["add_fact"]["calls"], 2)
+        # the data version check, and the facts query
+        self.assertEqual(methods["get_facts"]["statements"], 2)
+        self.assertEqual(sum(item["count"] for item in stats["statements"]),
+                         sum(item["statements"] for item in methods.values()))
+        self.assertEqual(stats["slow"], [])
+
+    def test_slow(self):
+        self.storage.enable_stats()
+        with mock.patch.object(db, "SLOW_STATEMENT_TIME", 0), \
+             self.assertLogs(db.logger, "WARNING"):
+            self.storage.get_facts(self.day)
+        slow = [item for item in self.storage.get_stats()["slow"]
+                if not item["statement"].startswith("PRAGMA")]
+        self.assertEqual(len(slow), 1)
+        self.assertEqual(slow[0]["method"], "get_facts")
+        self.assertTrue(any("idx_facts" in detail for detail in slow[0]["plan"]))
+
+
+class TestTotals(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add("coding", 1, 2, category="work", tags=["a", "b"])
+        self.add("coding", 2, 4.5, category="work", tags=["b"])
+        self.add("reading", 23, 25)  # early morning, same hamster day
+        self.add("reading", 24 * 8 + 1, 24 * 8 + 2)  # next week
+        self.add("cooking", 24 * 40, description="dinner")  # on-going
+
+    def expected(self, group_by, facts):
+        totals = {}
+        for fact in facts:
+            if group_by == "tag":
+                keys = fact.tags
+            elif group_by == "day":
+                keys = [fact.date]
+            elif group_by == "month":
+                keys = [fact.date.replace(day=1)]
+            else:
+                keys = [getattr(fact, group_by)]
+            for key in keys:
+                totals[key] = totals.get(key, dt.timedelta()) + fact.delta
+        return totals
+
+    def test_groups(self):
+        hours = dt.Range(self.day.start, self.day.start + dt.timedelta(days=41))
+        facts = self.storage.get_facts(hours)
+        for group_by in ("day", "month", "category", "activity", "tag"):
+            totals = self.storage.get_totals(hours, group_by=group_by)
+            self.assertEqual(dict(totals), self.expected(group_by, facts), group_by)
+            durations = [delta for __, delta in totals]
+            if group_by in ("day", "month"):
+                self.assertEqual([key for key, __ in totals],
+                                 sorted(key for key, __ in totals))
+            else:
+                self.assertEqual(durations, sorted(durations, reverse=True))
+
+    def test_weeks(self):
+        totals = self.storage.get_totals(self.day.start, self.day.start + dt.timedelta(days=9),
+                                         group_by="week")
+        # 2020-03-02 is a monday
+        self.assertEqual(totals, [(dt.date(2020, 3, 2), dt.timedelta(hours=5.5)),
+                                  (dt.date(2020, 3, 9), dt.timedelta(hours=1))])
+
+    def test_search(self):
+        totals = self.storage.get_totals(self.day, group_by="activity", search_terms="b")
+        self.assertEqual(totals, [("coding", dt.timedelta(hours=3.5))])
+
+    def test_invalid_group(self):
+        with self.assertRaises(ValueError):
+            self.storage.get_totals(self.day, group_by="description")
+
+
+class TestDailyTotals(StorageTestCase):
+
+    def table(self):
+        return self.storage.fetchall("SELECT * FROM daily_totals ORDER BY hday, activity_id")
+
+    def assertConsistent(self):
+        """Incremental updates should match a rebuild from scratch."""
+        table = [tuple(row) for row in self.table()]
+        self.storage.rebuild_daily_totals()
+        self.assertEqual(table, [tuple(row) for row in self.table()])
+
+    def test_split_days(self):
+        start = dt.datetime(2020, 3, 2, 22, 0)
+        self.assertEqual(list(db.split_days(start, start + dt.timedelta(hours=32), 330)),
+                         [(dt.date(2020, 3, 2), 450),
+                          (dt.date(2020, 3, 3), 1440),
+                          (dt.date(2020, 3, 4), 30)])
+        self.assertEqual(list(db.split_days(start, start, 330)), [])
+
+    def test_changes(self):
+        # the day starts at 5:30 (cf. self.day.start)
+        self.add("night", 18, 25, category="sleep")  # crosses the day start
+        self.add("coding", 1, 3, category="work", tags=["a"])
+        self.add("reading", 2, 2.5)  # split coding in two
+        self.add("reading", 26, 28)  # next day
+        self.add("cooking", 27.5, 29)  # overlaps reading end
+        self.assertConsistent()
+
+        facts = self.storage.get_facts(self.day, self.day + dt.timedelta(days=1))
+        fact = facts[-1]
+        self.storage.update_fact(fact.id, fact.copy(start_time=fact.start_time + dt.timedelta(hours=1)))
+        self.storage.remove_fact(facts[0].id)
+        activity = self.storage.get_activity_by_name("night", self.storage.get_category_id("sleep"))
+        self.storage.change_category(activity["id"], -1)
+        self.add("night", 40, 41)
+        self.assertConsistent()
+
+        days = [self.day, self.day + dt.timedelta(days=1)]
+        expected = {}
+        for fact in self.storage.get_facts(days[0], days[-1]):
+            for day in days:
+                overlap = min(fact.end_time, day.end) - max(fact.start_time, day.start)
+                if overlap > dt.timedelta():
+                    key = (day, fact.activity, fact.category)
+                    expected[key] = expected.get(key, dt.timedelta()) + overlap
+        totals = self.storage.get_daily_totals(days[0], days[-1])
+        self.assertEqual({total[:3]: total[3] for total in totals}, expected)
+        self.assertEqual(totals, sorted(totals, key=lambda total: total[:2]))
+        # 18 - 24 on the first day, the last hour is on the next one
+        self.assertIn((self.day, "night", "", dt.timedelta(hours=6)), totals)
+
+    def test_ongoing(self):
+        self.add("closed", 1, 2)
+        self.add("ongoing", 3)
+        self.assertEqual([row["activity_id"] for row in self.table()],
+                         [self.storage.get_activity_by_name("closed", None)["id"]])
+        totals = self.storage.get_daily_totals(self.day)
+        self.assertEqual([(activity, delta) for __, activity, __, delta in totals],
+                         [("closed", dt.timedelta(hours=1)),
+                          ("ongoing", dt.timedelta(hours=21))])
+
+    def test_day_start_change(self):
+        self.add("late", 18, 20)  # 23:30 - 1:30
+        get = db.conf.get
+
+        def get_midnight(key):
+            return 0 if key == "day-start-minutes" else get(key)
+
+        with mock.patch.object(db.conf, "get", get_midnight):
+            totals = self.storage.get_daily_totals(dt.date(2020, 3, 2), dt.date(2020, 3, 3))
+        self.assertEqual([(day, delta) for day, __, __, delta in totals],
+                         [(dt.date(2020, 3, 2), dt.timedelta(hours=0.5)),
+                          (dt.date(2020, 3, 3), dt.timedelta(hours=1.5))])
+        # and back
+        totals = self.storage.get_daily_totals(self.day)
+        self.assertEqual([(day, delta) for day, __, __, delta in totals],
+                         [(self.day, dt.timedelta(hours=2))])
+
+
+class TestSearch(StorageTestCase):
+
+    def search(self, terms):
+        facts = self.storage.get_facts(self.day, search_terms=terms)
+        return sorted(fact.activity for fact in facts)
+
+    def assertIntegrity(self):
+        # raises sqlite3.DatabaseError if the index and its content differ
+        self.storage.connection.execute(
+            "INSERT INTO fact_index(fact_index, rank) VALUES('integrity-check', 1)")
+
+    def test_fields(self):
+        self.add("coding", 1, 2, category="work", description="hamster",
+                 tags=["python"])
+        self.add("reading", 2, 3, category="home")
+        self.assertEqual(self.search("coding"), ["coding"])
+        self.assertEqual(self.search("work"), ["coding"])
+        self.assertEqual(self.search("hamster"), ["coding"])
+        self.assertEqual(self.search("python"), ["coding"])
+        self.assertEqual(self.search("pyth*"), ["coding"])
+        self.assertEqual(self.search("pyth"), [])
+        self.assertEqual(self.search("coding, reading"), ["coding", "reading"])
+        self.assertEqual(self.search("coding reading"), [])
+        self.assertEqual(self.search("not coding"), ["reading"])
+        # fts5 syntax is taken literally
+        self.assertEqual(self.search('" NEAR( ^col:'), [])
+
+    def test_follows_changes(self):
+        fact_id = self.add("coding", 1, 2, category="work")
+        self.add("reading", 2, 3, category="home")
+
+        category_id = self.storage.get_category_id("work")
+        self.storage.update_category(category_id, "job")
+        self.assertEqual(self.search("work"), [])
+        self.assertEqual(self.search("job"), ["coding"])
+
+        activity = self.storage.get_activity_by_name("reading", None)
+        self.storage.update_activity(activity["id"], "studying", -1)
+        self.assertEqual(self.search("reading"), [])
+        self.assertEqual(self.search("home"), [])
+        self.assertEqual(self.search("studying"), ["studying"])
+
+        fact = self.storage.get_fact(fact_id)
+        fact.tags = ["late"]
+        fact.description = "hamster"
+        fact_id = self.storage.update_fact(fact_id, fact)
+        self.assertEqual(self.search("late"), ["coding"])
+        self.assertEqual(self.search("hamster"), ["coding"])
+
+        self.storage.remove_category(self.storage.get_category_id("job"))
+        self.assertEqual(self.search("job"), [])
+        self.assertEqual(self.search("coding"), ["coding"])
+
+        self.storage.remove_fact(fact_id)
+        self.assertEqual(self.search("coding"), [])
+        self.assertIntegrity()
+
+    def test_rebuild(self):
+        self.add("coding", 1, 2, tags=["python"])
+        self.storage.execute("INSERT INTO fact_index(fact_index) VALUES('delete-all')")
+        self.assertEqual(self.search("coding"), [])
+        self.storage.rebuild_index()
+        self.assertEqual(self.search("python"), ["coding"])
+        self.assertIntegrity()
+
+
+class TestAddFacts(StorageTestCase):
+
+    def facts(self, *specs):
+        """Facts from (activity, start hours, end hours) after self.day start."""
+        return [Fact(activity=activity, category="imported", tags=["a", "b"],
+                     start_time=self.day.start + dt.timedelta(hours=start),
+                     end_time=self.day.start + dt.timedelta(hours=end))
+                for activity, start, end in specs]
+
+    def summary(self):
+        hours = lambda time: (time - self.day.start).total_seconds() / 3600
+        return [(fact.activity, hours(fact.start_time), hours(fact.end_time))
+                for fact in self.storage.get_facts(self.day)]
+
+    def test_skip(self):
+        self.add("existing", 2, 3)
+        ids = self.storage.add_facts(self.facts(("late", 4, 5), ("overlap", 2.5, 3.5),
+                                                ("early", 1, 2), ("within", 1.5, 1.75)))
+        self.assertEqual([bool(id_) for id_ in ids], [True, False, True, False])
+        self.assertEqual(self.summary(), [("early", 1, 2), ("existing", 2, 3), ("late", 4, 5)])
+        fact = self.storage.get_fact(ids[0])
+        self.assertEqual((fact.category, fact.tags), ("imported", ["a", "b"]))
+        self.assertEqual(self.storage.get_facts(self.day, search_terms="imported")[0].id,
+                         ids[2])
+        # importing again is harmless
+        self.assertEqual(self.storage.add_facts(self.facts(("late", 4, 5))), [0])
+
+        totals = self.storage.get_daily_totals(self.day)
+        self.storage.rebuild_daily_totals()
+        self.assertEqual(self.storage.get_daily_totals(self.day), totals)
+
+    def test_skip_long_facts(self):
+        # overlapping facts started long before, finished or not
+        self.storage.add_facts(self.facts(("long", -24 * 60, 2)), on_conflict="keep")
+        ids = self.storage.add_facts(self.facts(("overlap", 1, 3), ("after", 3, 4)))
+        self.assertEqual([bool(id_) for id_ in ids], [False, True])
+        self.storage.add_fact(Fact(activity="on-going",
+                                   start_time=self.day.start - dt.timedelta(days=60)))
+        self.assertEqual(self.storage.add_facts(self.facts(("during", 5, 6))), [0])
+
+    def test_solve_keep(self):
+        self.add("existing", 2, 4)
+        self.storage.add_facts(self.facts(("inside", 2.5, 3), ("across", 3.5, 5)),
+                               on_conflict="solve")
+        self.assertEqual(self.summary(), [("existing", 2, 2.5), ("inside", 2.5, 3),
+                                          ("existing", 3, 3.5), ("across", 3.5, 5)])
+        self.storage.add_facts(self.facts(("kept", 2, 5)), on_conflict="keep")
+        self.assertEqual(len(self.summary()), 5)
+        with self.assertRaises(ValueError):
+            self.storage.add_facts([], on_conflict="replace")
+
+    def test_split_tail_overlaps(self):
+        # the end of a split fact makes room for itself, as any added fact
+        self.storage.add_facts(self.facts(("long", 2, 8), ("across", 6, 9)), on_conflict="keep")
+        self.add("new", 3, 4)
+        self.assertEqual(self.summary(), [("long", 2, 3), ("new", 3, 4),
+                                          ("long", 4, 8), ("across", 8, 9)])
+
+    def test_reports(self):
+        from hamster import reports
+        from hamster.lib import i18n
+        i18n.setup_i18n()
+        facts = self.facts(("coding", 1, 2), ("reading", 2, 3))
+        facts[0].category = ""
+        facts[0].description = "hamster"
+        facts.append(Fact(activity="ongoing", start_time=self.day.start + dt.timedelta(hours=3)))
+        for format in ("tsv", "xml"):
+            path = os.path.join(self.tmp_dir.name, "export." + format)
+            reports.simple(facts, self.day, self.day, format, path)
+            self.assertEqual([fact.serialized() for fact in reports.read(path)],
+                             [fact.serialized() for fact in facts])
+        path = os.path.join(self.tmp_dir.name, "export.json")
+        with open(path, "w") as f:
+            f.write(reports.json_dumps([fact.as_dict() for fact in facts[:2]]))
+        self.assertEqual([fact.serialized() for fact in reports.read(path)],
+                         [fact.serialized() for fact in facts[:2]])
+
+
+class TestBatches(StorageTestCase):
+
+    def test_update_facts(self):
+        ids = [self.add("fact {}".format(i), i, i + 1) for i in range(3)]
+        updates = [(fact_id, self.storage.get_fact(fact_id).copy(tags=["retagged"]))
+                   for fact_id in ids]
+        updates.insert(1, (ids[-1] + 100, updates[0][1].copy()))
+        updates.append((ids[0], updates[0][1].copy(activity="")))
+        with mock.patch.object(self.storage, "facts_changed") as facts_changed:
+            results = self.storage.update_facts(updates)
+        facts_changed.assert_called_once_with()
+        self.assertEqual([bool(new_id) for new_id, __ in results],
+                         [True, False, True, True, False])
+        self.assertEqual([bool(error) for __, error in results],
+                         [False, True, False, False, True])
+        facts = self.storage.get_facts(self.day)
+        self.assertEqual([fact.id for fact in facts],
+                         [new_id for new_id, __ in results if new_id])
+        self.assertEqual([fact.tags for fact in facts], [["retagged"]] * 3)
+
+    def test_remove_facts(self):
+        ids = [self.add("fact {}".format(i), i, i + 1) for i in range(3)]
+        with mock.patch.object(self.storage, "facts_changed") as facts_changed:
+            errors = self.storage.remove_facts([ids[0], ids[-1] + 100, ids[2]])
+        facts_changed.assert_called_once_with()
+        self.assertEqual([bool(error) for error in errors], [False, True, False])
+        self.assertEqual([fact.id for fact in self.storage.get_facts(self.day)], [ids[1]])
+        with mock.patch.object(self.storage, "facts_changed") as facts_changed:
+            self.storage.remove_facts([ids[0]])
+        facts_changed.assert_not_called()
+
+
+class TestChanges(StorageTestCase):
+
+    def changes(self, revision):
+        latest, changes = self.storage.get_changes_since(revision)
+        self.assertEqual(latest, self.storage.get_revision())
+        return [(fact_id, op) for __, fact_id, op, __, __ in changes]
+
+    def test_journal(self):
+        revision = self.storage.get_revision()
+        first = self.add("first", 1, 3)
+        self.assertEqual(self.changes(revision), [(first, "add")])
+
+        revision = self.storage.get_revision()
+        second = self.add("second", 2, 4)  # truncates first
+        self.assertEqual(self.changes(revision), [(first, "update"), (second, "add")])
+        latest, changes = self.storage.get_changes_since(revision)
+        self.assertEqual(changes[0][3:], (self.day.start + dt.timedelta(hours=1),
+                                          self.day.start + dt.timedelta(hours=2)))
+
+        revision = self.storage.get_revision()
+        fact = self.storage.get_fact(second)
+        third = self.storage.update_fact(second, fact.copy(activity="third"))
+        self.storage.remove_fact(first)
+        # only the latest change of each fact
+        self.assertEqual(self.changes(revision),
+                         [(second, "remove"), (third, "add"), (first, "remove")])
+        self.assertEqual(self.changes(self.storage.get_revision()), [])
+        # unknown revision
+        self.assertIsNone(self.storage.get_changes_since(self.storage.get_revision() + 1)[1])
+
+    def test_compaction(self):
+        with mock.patch.object(db, "JOURNAL_SIZE", 2), \
+             mock.patch.object(db, "JOURNAL_COMPACT_EVERY", 2):
+            ids = [self.add("fact {}".format(i), i, i + 0.5) for i in range(4)]
+        revision = self.storage.get_revision()
+        self.assertEqual(self.storage.fetchone("SELECT count(*) FROM changes")[0], 2)
+        self.assertIsNone(self.storage.get_changes_since(revision - 3)[1])
+        self.assertEqual(self.changes(revision - 1), [(ids[-1], "add")])
+
+
+class TestArchive(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.old_id = self.add("coding", -47, -46, category="work",
+                               description="hamster", tags=["python"])
+        self.add("reading", 1, 2, category="home", tags=["python"])
+        self.week = (self.day - dt.timedelta(days=7), self.day)
+        self.assertEqual(self.storage.archive_facts(self.day.start), 1)
+
+    def test_queries(self):
+        self.assertEqual(self.storage.fetchall("SELECT id FROM facts WHERE id = ?",
+                                               (self.old_id, )), [])
+        facts = self.storage.get_facts(*self.week)
+        self.assertEqual([(fact.activity, fact.category, fact.tags) for fact in facts],
+                         [("coding", "work", ["python"]), ("reading", "home", ["python"])])
+        self.assertEqual([fact.id for fact in self.storage.iter_facts(*self.week)],
+                         [fact.id for fact in facts])
+        page = self.storage.get_facts_page(*self.week, limit=1)
+        self.assertEqual([fact.id for fact in page], [self.old_id])
+        page = self.storage.get_facts_page(*self.week, after=(page[0].start_time, page[0].id))
+        self.assertEqual([fact.activity for fact in page], ["reading"])
+        search = self.storage.get_facts(*self.week, search_terms="hamster")
+        self.assertEqual([fact.id for fact in search], [self.old_id])
+        search = self.storage.get_facts(*self.week, search_terms="not hamster")
+        self.assertEqual([fact.activity for fact in search], ["reading"])
+        self.assertEqual(self.storage.get_totals(*self.week, group_by="tag"),
+                         [("python", dt.timedelta(hours=2))])
+        # daily totals are left as they were
+        self.assertEqual(len(self.storage.get_daily_totals(*self.week)), 2)
+
+    def test_hot_range(self):
+        statements = []
+        self.storage.connection.set_trace_callback(statements.append)
+        try:
+            facts = self.storage.get_facts(self.day, search_terms="python")
+            self.storage.get_totals(self.day)
+        finally:
+            self.storage.connection.set_trace_callback(None)
+        self.assertEqual([fact.activity for fact in facts], ["reading"])
+        self.assertFalse([statement for statement in statements
+                          if "archive." in statement])
+
+    def test_changes(self):
+        self.assertEqual(self.storage.get_fact(self.old_id).activity, "coding")
+
+        # references from archived facts are kept
+        activity_id = self.storage.get_activity_by_name("coding", self.storage.get_category_id("work"))["id"]
+        self.storage.remove_activity(activity_id)
+        self.assertEqual(self.storage.get_fact(self.old_id).activity, "coding")
+        self.storage.update_autocomplete_tags("")
+        self.assertEqual([tag["name"] for tag in self.storage.get_tags(False)], ["python"])
+
+        self.storage.remove_fact(self.old_id)
+        self.assertEqual([fact.activity for fact in self.storage.get_facts(*self.week)],
+                         ["reading"])
+        self.assertEqual(len(self.storage.get_daily_totals(*self.week)), 1)
+
+    def test_add_facts(self):
+        def imported(start, end):
+            return Fact(activity="imported", start_time=self.day.start + dt.timedelta(hours=start),
+                        end_time=self.day.start + dt.timedelta(hours=end))
+
+        self.assertTrue(self.storage.add_facts([imported(-30, -29)])[0])
+        self.assertEqual(self.storage.archive_facts(self.day.start), 1)
+        # importing again is harmless, archived facts are left as they are
+        for on_conflict in ("skip", "solve"):
+            self.assertEqual(self.storage.add_facts([imported(-30, -29), imported(-47.5, -46.5)],
+                                                    on_conflict=on_conflict), [0, 0])
+        self.assertTrue(self.storage.add_facts([imported(-40, -39)])[0])
+        self.assertEqual([fact.activity for fact in self.storage.get_facts(*self.week)],
+                         ["coding", "imported", "imported", "reading"])
+
+    def test_reopen(self):
+        self.storage.connection.close()
+        self.storage = db.Storage(unsorted_localized="", database_dir=self.tmp_dir.name,
+                                  **self.storage_kwds)
+        self.assertEqual(len(self.storage.get_facts(*self.week)), 2)
+        # archiving again is harmless
+        self.assertEqual(self.storage.archive_facts(self.day.start), 0)
+
+
+class TestMaintenance(StorageTestCase):
+
+    def pragma(self, name):
+        return self.storage.fetchone("PRAGMA {}".format(name))[0]
+
+    def setUp(self):
+        super().setUp()
+        self.storage.add_facts(Fact(activity="activity {}".format(i % 10),
+                                    description="description {}".format(i),
+                                    start_time=self.day.start + dt.timedelta(minutes=i),
+                                    end_time=self.day.start + dt.timedelta(minutes=i + 1))
+                               for i in range(2000))
+
+    def test_full(self):
+        tasks = [name for name, __ in self.storage.maintenance()]
+        self.assertEqual(tasks, ["statistics", "search index", "journal", "vacuum"])
+        self.assertEqual(self.pragma("auto_vacuum"), 2)  # incremental
+        self.assertTrue(self.storage.fetchall("SELECT * FROM sqlite_stat1"))
+
+    def test_steps(self):
+        self.storage.maintenance()
+        self.storage.execute("DELETE FROM facts")
+        self.assertGreater(self.pragma("freelist_count"), 0)
+        steps = list(self.storage.maintenance_steps())
+        self.assertGreater(len(steps), 1)
+        self.assertEqual(self.pragma("freelist_count"), 0)
+        # nothing left to do
+        self.assertEqual([name for name, __ in self.storage.maintenance_steps()],
+                         ["statistics", "search index", "journal"])
+        self.assertEqual(self.storage.get_facts(self.day, search_terms="description"), [])
+
+    def test_stats(self):
+        self.storage.maintenance()
+        self.storage.execute("DELETE FROM facts")
+        self.storage.enable_stats()
+        self.storage.maintenance()
+        self.assertEqual(self.pragma("freelist_count"), 0)
+        statements = [item["statement"] for item in self.storage.get_stats()["statements"]]
+        self.assertIn("PRAGMA incremental_vacuum(0)", statements)
+
+
+class TestTotalsEpochMinutes(TestTotals):
+    storage_kwds = {"epoch_minutes": True}
+
+
+class TestFactsEpochMinutes(TestFacts):
+    storage_kwds = {"epoch_minutes": True}
+
+    def test_sync(self):
+        fact_id = self.add("synced", 1, 2)
+        self.storage.execute("UPDATE facts SET end_time = ? WHERE id = ?",
+                             (self.day.start + dt.timedelta(hours=3), fact_id))
+        row = self.storage.fetchone("SELECT * FROM facts WHERE id = ?", (fact_id, ))
+        self.assertEqual(row["start_minute"], db.to_epoch_minutes(row["start_time"]))
+        self.assertEqual(row["end_minute"] - row["start_minute"], 120)
+
+
+class TestQueryPlans(StorageTestCase):
+    """Guard against time range lookups falling back to table scans."""
+
+    # facts lookups that are expected to be served by an index
+    facts_query = re.compile(r"\bfrom\s+facts\b", flags=re.IGNORECASE)
+    # a full scan, except for the full text search virtual table
+    full_scan = re.compile(r"^SCAN (?!.*VIRTUAL TABLE)")
+
+    def setUp(self):
+        super().setUp()
+        for i in range(8):
+            self.add("activity {}".format(i % 3), i, i + 0.5,
+                     category="cat {}".format(i % 2), tags=["tag{}".format(i)])
+
+    def capture(self, func, *args, **kwds):
+        """Run func and return the statements that hit the facts table."""
+        statements = []
+        connections = (self.storage.connection, self.storage.read_connection)
+        for con in connections:
+            con.set_trace_callback(statements.append)
+        try:
+            func(*args, **kwds)
+        finally:
+            for con in connections:
+                con.set_trace_callback(None)
+        return [statement for statement in statements
+                if self.facts_query.search(statement)
+                and statement.lstrip().upper().startswith(("SELECT", "DELETE", "UPDATE"))]
+
+    def assertIndexed(self, statements):
+        self.assertTrue(statements, "no facts query was captured")
+        for statement in statements:
+            plan = self.storage.connection.execute("EXPLAIN QUERY PLAN " + statement).fetchall()
+            details = [row[3] for row in plan]
+            scans = [detail for detail in details if self.full_scan.match(detail)]
+            self.assertFalse(scans, "table scan in\n{}\n{}".format(statement,
+                                                                   "\n".join(details)))
+
+    def test_get_facts(self):
+        self.assertIndexed(self.capture(self.storage.get_facts, self.day))
+
+    def test_search(self):
+        self.assertIndexed(self.capture(self.storage.get_facts, self.day,
+                                        search_terms="activity"))
+
+    def test_totals(self):
+        for group_by in ("week", "category", "tag"):
+            self.assertIndexed(self.capture(self.storage.get_totals, self.day,
+                                            group_by=group_by))
+
+    def test_solve_overlaps(self):
+        self.assertIndexed(self.capture(self.add, "overlap", 2.25, 4.25))
+
+    def test_squeeze_in(self):
+        self.assertIndexed(self.capture(self.add, "squeeze", 3.25))
+
+    def test_get_activities(self):
+        self.assertEqual(self.capture(self.storage.get_activities, "act"), [])
+
+    def test_activity_lookups(self):
+        activity_id = self.storage.get_activity_by_name("activity 1", 0)["id"]
+        self.assertIndexed(self.capture(self.storage.remove_activity, activity_id))
+
+
+class TestQueryPlansEpochMinutes(TestQueryPlans):
+    storage_kwds = {"epoch_minutes": True}
+
+
+if __name__ == '__main__':
+    unittest.main()
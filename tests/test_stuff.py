@@ -10,8 +10,10 @@ from hamster.lib.dbus import (
     to_dbus_fact,
     to_dbus_fact_json,
     to_dbus_range,
+    to_dbus_facts_columns,
     from_dbus_fact,
     from_dbus_fact_json,
+    from_dbus_facts_columns,
     from_dbus_range,
     )
 from hamster.lib.fact import Fact
@@ -520,6 +522,20 @@ class TestDBus(unittest.TestCase):
         return_range = from_dbus_range(dbus_range)
         self.assertEqual(return_range, range)
 
+    def test_facts_columns(self):
+        facts = [Fact.parse("2020-01-19 11:00 12:00 activity@category, description #and #tags"),
+                 Fact.parse("2020-01-19 12:00 other, #tags"),
+                 Fact.parse("1969-12-31 23:00 activity")]
+        for fact_id, fact in enumerate(facts, 1):
+            fact.id, fact.activity_id = fact_id, fact_id + 10
+        columns = to_dbus_facts_columns(facts)
+        self.assertEqual(columns[-1], ["activity", "category", "and", "tags", "other", ""])
+        return_facts = list(from_dbus_facts_columns(columns))
+        self.assertEqual(return_facts, facts)
+        self.assertEqual([(fact.id, fact.activity_id) for fact in return_facts],
+                         [(1, 11), (2, 12), (3, 13)])
+        self.assertEqual(list(from_dbus_facts_columns(to_dbus_facts_columns([]))), [])
+
 
 if __name__ == '__main__':
     unittest.main()